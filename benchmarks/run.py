@@ -0,0 +1,462 @@
+"""
+Qimba benchmark suite.
+
+Times the hot paths on deterministic synthetic amplicon data and stores
+reads/sec and peak memory per benchmark in ``benchmarks/results/<version>.json``
+so that successive versions can be compared:
+
+    python benchmarks/run.py                 # run everything, save, compare
+    python benchmarks/run.py --quick -k derep
+    python benchmarks/run.py --compare benchmarks/results/0.1.0.json
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from qimba import __version__
+from qimba.core.align import edit_distances
+from qimba.core.bgzf import BgzfWriter
+from qimba.core.chimera import ChimeraDetector
+from qimba.core.derep import Dereplicator
+from qimba.core.executor import AsyncExecutor, Executor
+from qimba.core.fastx import FastxReader, find_fastx_files, read_pair_batches
+from qimba.core.filters import ExpectedErrorFilter, QualityFilter
+from qimba.core.merge import PairMerger
+from qimba.core.pipeline import Pipeline
+from qimba.core.qcstats import ReadProfile
+from qimba.core.samples import discover_samples
+from qimba.utils.config import Config
+from qimba.utils.simulate import AmpliconSimulator
+
+RESULTS_DIR = Path(__file__).parent / "results"
+console = Console()
+
+# A benchmark prepares its inputs from the dataset directory and returns
+# the timed callable, which returns the number of items it processed
+Benchmark = Callable[[Path], Callable[[], int]]
+BENCHMARKS: dict[str, tuple[str, Benchmark]] = {}
+
+
+def benchmark(name: str, unit: str = "reads"):
+    def register(func: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = (unit, func)
+        return func
+    return register
+
+
+def _config(work_dir: Path) -> Config:
+    config = Config(config_path=None, temp_dir=work_dir / "tmp", cache=False)
+    config.qc.engine = "native"
+    config.qc.min_length = 50
+    config.denoise.engine = "native"
+    return config
+
+
+def _batches(data: Path) -> list:
+    return [batch for path in find_fastx_files(data) for batch in FastxReader(path)]
+
+
+@benchmark("parse_fastq")
+def parse_fastq(data: Path) -> Callable[[], int]:
+    files = find_fastx_files(data / "plain")
+    return lambda: sum(len(batch) for path in files for batch in FastxReader(path))
+
+
+@benchmark("parse_fastq_gz")
+def parse_fastq_gz(data: Path) -> Callable[[], int]:
+    files = find_fastx_files(data / "gzip")
+    return lambda: sum(len(batch) for path in files for batch in FastxReader(path))
+
+
+def _bgzf_files(data: Path) -> list[Path]:
+    """BGZF copies of the plain dataset, written once."""
+    files = []
+    for path in find_fastx_files(data / "plain"):
+        target = data / "bgzf" / f"{path.name}.gz"
+        if not target.exists():
+            target.parent.mkdir(exist_ok=True)
+            with open(path, "rb") as f, BgzfWriter(target, threads=os.cpu_count() or 1) as out:
+                out.write(f.read())
+        files.append(target)
+    return files
+
+
+@benchmark("parse_fastq_bgzf")
+def parse_fastq_bgzf(data: Path) -> Callable[[], int]:
+    files = _bgzf_files(data)
+    threads = os.cpu_count() or 1
+    return lambda: sum(
+        len(batch) for path in files for batch in FastxReader(path, threads=threads)
+    )
+
+
+@benchmark("write_bgzf")
+def write_bgzf(data: Path) -> Callable[[], int]:
+    batches = _batches(data / "plain")
+    threads = os.cpu_count() or 1
+
+    def run() -> int:
+        with BgzfWriter(os.devnull, level=6, threads=threads) as out:
+            for batch in batches:
+                out.write(batch.to_fastq())
+        return sum(len(batch) for batch in batches)
+    return run
+
+
+@benchmark("quality_filter")
+def quality_filter(data: Path) -> Callable[[], int]:
+    batches = _batches(data / "plain")
+    read_filter = QualityFilter(min_quality=20, min_length=50)
+
+    def run() -> int:
+        for batch in batches:
+            read_filter.apply(batch)
+        return sum(len(batch) for batch in batches)
+    return run
+
+
+@benchmark("ee_filter")
+def ee_filter(data: Path) -> Callable[[], int]:
+    batches = _batches(data / "plain")
+    read_filter = ExpectedErrorFilter(max_ee=1.0, truncate=True)
+
+    def run() -> int:
+        for batch in batches:
+            read_filter.apply(batch)
+        return sum(len(batch) for batch in batches)
+    return run
+
+
+@benchmark("read_profile")
+def read_profile(data: Path) -> Callable[[], int]:
+    batches = _batches(data / "plain")
+
+    def run() -> int:
+        profile = ReadProfile()
+        for batch in batches:
+            profile.add(batch)
+        return profile.reads
+    return run
+
+
+@benchmark("dereplicate")
+def dereplicate(data: Path) -> Callable[[], int]:
+    batches = _batches(data / "plain")
+
+    def run() -> int:
+        dereplicator = Dereplicator()
+        for batch in batches:
+            dereplicator.add_batch(batch, "sample")
+        dereplicator.finish()
+        return sum(len(batch) for batch in batches)
+    return run
+
+
+@benchmark("merge_pairs", unit="pairs")
+def merge_pairs(data: Path) -> Callable[[], int]:
+    pairs = [
+        pair for sample in discover_samples(data / "plain")
+        for pair in read_pair_batches(sample.r1, sample.r2)
+    ]
+    merger = PairMerger()
+
+    def run() -> int:
+        for r1, r2 in pairs:
+            merger.merge(r1, r2)
+        return sum(len(r1) for r1, _ in pairs)
+    return run
+
+
+def _uniques(data: Path):
+    dereplicator = Dereplicator()
+    for batch in _batches(data / "plain"):
+        dereplicator.add_batch(batch, "sample")
+    return dereplicator.finish()
+
+
+@benchmark("edit_distance", unit="pairs")
+def edit_distance(data: Path) -> Callable[[], int]:
+    uniques = _uniques(data).uniques
+    targets = [uniques.seq(i) for i in range(1, min(len(uniques), 20001))]
+
+    def run() -> int:
+        edit_distances(uniques.seq(0), targets, max_distance=8)
+        return len(targets)
+    return run
+
+
+@benchmark("chimeras", unit="asvs")
+def chimeras(data: Path) -> Callable[[], int]:
+    uniques = _uniques(data)
+    keep = np.arange(min(len(uniques), 20000))
+    detector = ChimeraDetector(workers=os.cpu_count() or 1)
+
+    def run() -> int:
+        detector.detect(uniques.uniques.take(keep), uniques.abundances[keep])
+        return len(keep)
+    return run
+
+
+@benchmark("executor_call", unit="calls")
+def executor_call(data: Path) -> Callable[[], int]:
+    executor = Executor(_config(data))
+    calls = 100
+
+    def run() -> int:
+        for _ in range(calls):
+            executor._run_command(["true"])
+        return calls
+    return run
+
+
+@benchmark("executor_stream", unit="calls")
+def executor_stream(data: Path) -> Callable[[], int]:
+    executor = Executor(_config(data))
+    calls = 100
+
+    def run() -> int:
+        for i in range(calls):
+            executor._run_command(["true"], log_prefix=data / "logs" / str(i))
+        return calls
+    return run
+
+
+@benchmark("async_executor_call", unit="calls")
+def async_executor_call(data: Path) -> Callable[[], int]:
+    executor = AsyncExecutor(_config(data), max_concurrency=8)
+    calls = 200
+
+    def run() -> int:
+        asyncio.run(executor.run_all(executor.run_command(["true"]) for _ in range(calls)))
+        return calls
+    return run
+
+
+def _cli(*args: str) -> Benchmark:
+    """Startup cost of a CLI invocation in a fresh interpreter."""
+    def prepare(data: Path) -> Callable[[], int]:
+        config = data / "config.json"
+        config.write_text("{}")
+        cmd = [
+            sys.executable, "-c", "from qimba.cli import app; app(prog_name='qimba')",
+            "--config", str(config), *args,
+        ]
+        calls = 10
+
+        def run() -> int:
+            for _ in range(calls):
+                subprocess.run(cmd, check=True, capture_output=True)
+            return calls
+        return run
+    return prepare
+
+
+benchmark("cli_version", unit="calls")(_cli("--version"))
+benchmark("cli_config", unit="calls")(_cli("config"))
+
+
+def _pipeline(threads: int) -> Benchmark:
+    def prepare(data: Path) -> Callable[[], int]:
+        output = Path(tempfile.mkdtemp(dir=data))
+        pipeline = Pipeline(data / "plain", output, threads=threads, config=_config(output))
+
+        def run() -> int:
+            results = pipeline.run(use_cache=False)
+            return sum(result.stats.reads_in for result in results["qc"])
+        return run
+    return prepare
+
+
+benchmark("pipeline_1_thread")(_pipeline(1))
+benchmark("pipeline_4_threads")(_pipeline(4))
+
+
+def generate(data: Path, samples: int, depth: int) -> Path:
+    """Write (or reuse) the synthetic dataset for a given size."""
+    dataset = data / f"amplicon-{samples}x{depth}"
+    if not (dataset / "done").exists():
+        simulator = AmpliconSimulator(seed=42)
+        simulator.write_dataset(dataset / "plain", samples=samples, depth=depth)
+        simulator.write_dataset(dataset / "gzip", samples=samples, depth=depth, compress=True)
+        (dataset / "done").touch()
+    return dataset
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process or of any of its finished child
+    processes (such as pool workers), whichever is larger. ``ru_maxrss``
+    survives exec and would report the parent's peak in a spawned child,
+    so Linux's VmHWM is preferred for this process.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                own = int(line.split()[1])
+                break
+    except OSError:
+        pass
+    return max(own, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def _measure(name: str, dataset: str, repeat: int) -> dict:
+    """Run one benchmark; called in a fresh process to isolate peak memory."""
+    unit, prepare = BENCHMARKS[name]
+    run = prepare(Path(dataset))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = run()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        "unit": unit,
+        "items": items,
+        "seconds": best,
+        "rate": items / best if best else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _child(name: str, dataset: str, repeat: int, connection) -> None:
+    connection.send(_measure(name, dataset, repeat))
+    connection.close()
+
+
+def measure(name: str, dataset: Path, repeat: int) -> Optional[dict]:
+    """
+    Run one benchmark in a fresh (non-daemonic, so it may use process
+    pools) interpreter; ``None`` if it crashed.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(name, str(dataset), repeat, sender))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        return None
+    finally:
+        process.join()
+
+
+def _machine() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _rate(rate: float) -> str:
+    return f"{rate:,.0f}" if rate >= 100 else f"{rate:.2f}"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> Table:
+    """Table of rate and memory changes against a baseline run."""
+    table = Table(title=f"Compared to {baseline.get('version', '?')}")
+    for column in ("Benchmark", "Rate", "Baseline", "Change", "Peak RSS MB", "Baseline MB"):
+        table.add_column(column, justify="left" if column == "Benchmark" else "right")
+    for name, result in results["benchmarks"].items():
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is None:
+            continue
+        change = result["rate"] / old["rate"] - 1 if old["rate"] else 0.0
+        memory = result["peak_rss_mb"] / old["peak_rss_mb"] - 1 if old["peak_rss_mb"] else 0.0
+        style = "red" if change < -threshold or memory > threshold else "green" if change > threshold else ""
+        table.add_row(
+            name,
+            _rate(result['rate']),
+            _rate(old['rate']),
+            f"[{style}]{change:+.1%}[/{style}]" if style else f"{change:+.1%}",
+            f"{result['peak_rss_mb']:.0f}",
+            f"{old['peak_rss_mb']:.0f}",
+        )
+    return table
+
+
+def _latest_baseline(exclude: Path) -> Optional[Path]:
+    candidates = [p for p in RESULTS_DIR.glob("*.json") if p.resolve() != exclude.resolve()]
+    return max(candidates, key=lambda p: p.stat().st_mtime, default=None)
+
+
+def main(
+    select: Optional[list[str]] = typer.Option(
+        None, "-k", help="Only run benchmarks whose name contains this (repeatable)",
+    ),
+    quick: bool = typer.Option(False, "--quick", help="Small dataset, single repetition"),
+    samples: int = typer.Option(4, "--samples", help="Samples in the synthetic dataset"),
+    depth: int = typer.Option(50000, "--depth", help="Read pairs per sample"),
+    repeat: int = typer.Option(3, "--repeat", help="Repetitions; the fastest is kept"),
+    data_dir: Path = typer.Option(
+        Path(tempfile.gettempdir()) / "qimba-bench", "--data", help="Where datasets are generated",
+    ),
+    compare_to: Optional[Path] = typer.Option(
+        None, "--compare", help="Results file to compare with (default: latest stored)",
+    ),
+    save: bool = typer.Option(True, "--save/--no-save", help=f"Store results in {RESULTS_DIR}"),
+    threshold: float = typer.Option(0.1, "--threshold", help="Relative change flagged as a regression"),
+) -> None:
+    """Run the benchmarks and store their results."""
+    if quick:
+        samples, depth, repeat = 2, 5000, 1
+    names = [n for n in BENCHMARKS if not select or any(s in n for s in select)]
+    console.print(f"Generating {samples} x {depth} read pairs...")
+    dataset = generate(data_dir, samples, depth)
+
+    results = {
+        "version": __version__,
+        "created": time.time(),
+        "dataset": {"samples": samples, "depth": depth, "seed": 42},
+        "machine": _machine(),
+        "benchmarks": {},
+    }
+    table = Table(title=f"Qimba {__version__} benchmarks")
+    for column in ("Benchmark", "Items", "Seconds", "Rate", "Peak RSS MB"):
+        table.add_column(column, justify="left" if column == "Benchmark" else "right")
+    for name in names:
+        result = measure(name, dataset, repeat)
+        if result is None:
+            console.print(f"  [red]{name} failed[/red]")
+            continue
+        results["benchmarks"][name] = result
+        table.add_row(
+            name,
+            f"{result['items']:,}",
+            f"{result['seconds']:.3f}",
+            f"{_rate(result['rate'])} {result['unit']}/s",
+            f"{result['peak_rss_mb']:.0f}",
+        )
+        console.print(f"  {name}: {_rate(result['rate'])} {result['unit']}/s")
+    console.print(table)
+
+    output = RESULTS_DIR / f"{__version__}.json"
+    baseline = compare_to or _latest_baseline(output)
+    if baseline is not None and baseline.exists():
+        console.print(compare(results, json.loads(baseline.read_text()), threshold))
+    if save:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        console.print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
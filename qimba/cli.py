@@ -1,31 +1,71 @@
+import importlib
 import typer
-from rich.console import Console
-from rich.panel import Panel
 from typing import Optional
 from pathlib import Path
+from typer.core import TyperCommand, TyperGroup
 
-from qimba.commands import run, qc, denoise, config
-from qimba.utils.config import Config
+from qimba import __version__
+
+# Subcommands are only imported when they are run (or their help is shown),
+# so `qimba --version` does not pay for numpy, pydantic and the pipeline.
+# Help texts here are shown by `qimba --help` and mirror each module's app.
+COMMANDS = {
+    "run": ("qimba.commands.run", "Run the complete analysis pipeline"),
+    "batch": ("qimba.commands.batch", "Run the pipeline over many projects with one pool of workers"),
+    "qc": ("qimba.commands.qc", "Run quality control analysis"),
+    "denoise": ("qimba.commands.denoise", "Denoise sequencing data"),
+    "config": ("qimba.commands.config", "Manage configuration settings"),
+    "cache": ("qimba.commands.cache", "Inspect and prune the step result cache"),
+    "table": ("qimba.commands.table", "Inspect, export, merge and filter ASV count tables"),
+    "worker": ("qimba.commands.worker", "Run pipeline jobs from a shared work queue"),
+}
+
+class LazyCommand(TyperCommand):
+    """
+    Stand-in for a subcommand whose module is imported on first use.
+    """
+
+    def __init__(self, name: str, module: str, help: str):
+        super().__init__(name, help=help)
+        self.module = module
+        self._command = None
+
+    def load(self):
+        if self._command is None:
+            app = importlib.import_module(self.module).app
+            self._command = typer.main.get_group(app)
+        return self._command
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+class LazyGroup(TyperGroup):
+    """
+    Top-level group resolving the subcommands of ``COMMANDS`` lazily.
+    """
+
+    def list_commands(self, ctx) -> list[str]:
+        return [*self.commands, *(name for name in COMMANDS if name not in self.commands)]
+
+    def get_command(self, ctx, cmd_name: str):
+        if cmd_name not in self.commands and cmd_name in COMMANDS:
+            module, help = COMMANDS[cmd_name]
+            self.commands[cmd_name] = LazyCommand(cmd_name, module, help)
+        return super().get_command(ctx, cmd_name)
 
 # Initialize Typer app
 app = typer.Typer(
     name="qimba",
     help="A modern bioinformatics analysis pipeline",
     add_completion=False,
+    cls=LazyGroup,
 )
 
-# Initialize Rich console
-console = Console()
-
-# Add subcommands
-app.add_typer(run.app, name="run")
-app.add_typer(qc.app, name="qc")
-app.add_typer(denoise.app, name="denoise")
-app.add_typer(config.app, name="config")
-
 def version_callback(value: bool):
     if value:
-        console.print(Panel.fit("Qimba version 0.1.0", title="Version"))
+        from rich.console import Console
+        from rich.panel import Panel
+        Console().print(Panel.fit(f"Qimba version {__version__}", title="Version"))
         raise typer.Exit()
 
 @app.callback()
@@ -48,8 +88,7 @@ def main(
     
     Run 'qimba COMMAND --help' for more information on a command.
     """
+    from qimba.utils.config import load_config
+
     # Store configuration in context
-    ctx.obj = Config(
-        config_path=config,
-        verbose=verbose
-    )
\ No newline at end of file
+    ctx.obj = load_config(config, verbose=verbose)
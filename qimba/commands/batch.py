@@ -0,0 +1,123 @@
+import typer
+from rich.console import Console
+from rich.table import Table
+from pathlib import Path
+from typing import Optional
+
+from qimba.utils.config import Config
+
+app = typer.Typer(help="Run the pipeline over many projects with one pool of workers")
+console = Console()
+
+def print_projects(projects) -> None:
+    """Print the outcome and throughput of every project of a batch."""
+    table = Table(title="Batch Projects")
+    for column in ("Project", "Samples", "Reads", "Input MB", "Wall s", "Reads/s", "MB/s", "Cached", "Status"):
+        table.add_column(column, justify="left" if column in ("Project", "Status") else "right")
+    for project in projects:
+        table.add_row(
+            project.name,
+            str(project.samples),
+            f"{project.reads:,}" if project.reads else "-",
+            f"{project.input_bytes / (1024 * 1024):.1f}",
+            f"{project.elapsed:.2f}",
+            f"{project.reads_per_second:,.0f}" if project.reads else "-",
+            f"{project.mb_per_second:.2f}",
+            str(project.cached),
+            "[green]ok[/green]" if project.error is None else "[red]failed[/red]",
+        )
+    console.print(table)
+
+@app.callback(invoke_without_command=True)
+def batch(
+    ctx: typer.Context,
+    manifest: Path = typer.Argument(
+        ...,
+        help="JSON manifest of projects (input_dir, output_dir, config overrides)",
+        exists=True,
+        dir_okay=False,
+    ),
+    threads: Optional[int] = typer.Option(
+        None,
+        "--threads", "-t",
+        help="Threads shared by all projects (default from config)",
+    ),
+    max_projects: int = typer.Option(
+        4,
+        "--max-projects",
+        min=1,
+        help="Projects running at the same time",
+    ),
+    backend: Optional[str] = typer.Option(
+        None,
+        "--backend",
+        help="Where steps run: 'local' or 'queue' for qimba workers (default from config)",
+    ),
+    local_workers: Optional[int] = typer.Option(
+        None,
+        "--local-workers",
+        help="With the queue backend, workers to start on this machine (default from config)",
+    ),
+    no_cache: bool = typer.Option(
+        False,
+        "--no-cache",
+        help="Run every step even if a cached result exists",
+    ),
+    report: Optional[Path] = typer.Option(
+        None,
+        "--report",
+        help="Write the per-project outcome and throughput to this JSON file",
+    ),
+) -> None:
+    """
+    Run the complete pipeline over every project of a manifest in one
+    process, with one pool of workers started once for all of them.
+
+    The manifest is a JSON list of {"input_dir", "output_dir", "name",
+    "config"} entries, or an object with that list under "projects" and
+    settings for all of them under "defaults". Projects running at the same
+    time take turns at the shared threads, so small projects finish early
+    next to large ones.
+    """
+    if ctx.resilient_parsing:
+        return
+
+    # Deferred so that `qimba batch --help` does not load the pipeline
+    from qimba.core.batch import load_batch, run_batch, write_batch_report
+
+    config: Config = ctx.obj
+    config.threads = threads or config.threads
+    if backend is not None:
+        config.backend = backend
+    if local_workers is not None:
+        config.queue_local_workers = local_workers
+    if config.backend not in ("local", "queue"):
+        console.print(f"[red]Unknown backend: {config.backend} (use 'local' or 'queue')[/red]")
+        raise typer.Exit(1)
+
+    try:
+        projects = load_batch(manifest, config)
+    except (OSError, ValueError) as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+    console.print(
+        f"Running {len(projects)} projects, up to {max_projects} at a time, "
+        f"on {config.threads} shared threads"
+    )
+
+    def finished(project) -> None:
+        if project.error is None:
+            console.print(f"[green]{project.name} completed in {project.elapsed:.1f}s[/green]")
+        else:
+            console.print(f"[red]{project.name} failed: {project.error}[/red]")
+
+    run_batch(projects, config, max_projects=max_projects, use_cache=not no_cache, on_finish=finished)
+    print_projects(projects)
+    if report is not None:
+        write_batch_report(projects, report)
+        console.print(f"Report written to {report}")
+    failed = [project.name for project in projects if project.error is not None]
+    if failed:
+        console.print(f"[red]{len(failed)} of {len(projects)} projects failed[/red]")
+        raise typer.Exit(1)
+    console.print("[green]Batch completed successfully! :rocket:[/green]")
@@ -0,0 +1,80 @@
+# qimba/commands/cache.py
+
+import typer
+from collections import defaultdict
+from typing import Optional
+from rich.console import Console
+from rich.table import Table
+
+from qimba.core.cache import StepCache
+from qimba.utils.config import Config
+
+app = typer.Typer(help="Inspect and prune the step result cache")
+console = Console()
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def _open_cache(config: Config) -> StepCache:
+    return StepCache(config.cache_dir, content_hash=config.cache_content_hash)
+
+@app.callback(invoke_without_command=True)
+def show_cache(
+    ctx: typer.Context,
+) -> None:
+    """Show what is stored in the step cache."""
+    if ctx.invoked_subcommand is not None:
+        return
+    config: Config = ctx.obj
+    entries = _open_cache(config).entries()
+    
+    steps = defaultdict(lambda: [0, 0])
+    for entry in entries:
+        steps[entry.step][0] += 1
+        steps[entry.step][1] += entry.size
+    
+    table = Table(title=f"Step Cache ({config.cache_dir})")
+    table.add_column("Step", style="cyan")
+    table.add_column("Entries", justify="right")
+    table.add_column("Size", justify="right", style="green")
+    for step, (count, size) in sorted(steps.items()):
+        table.add_row(step, str(count), _format_size(size))
+    table.add_section()
+    table.add_row("Total", str(len(entries)), _format_size(sum(e.size for e in entries)))
+    console.print(table)
+    console.print(f"Size limit: {config.cache_max_mb} MB")
+
+@app.command()
+def prune(
+    ctx: typer.Context,
+    max_size: Optional[int] = typer.Option(
+        None,
+        "--max-size",
+        help="Shrink the cache to this size in MB (default: cache_max_mb setting)",
+    ),
+    older_than: Optional[float] = typer.Option(
+        None,
+        "--older-than",
+        help="Remove entries not used for this many days",
+    ),
+) -> None:
+    """Remove least recently used entries."""
+    config: Config = ctx.obj
+    max_mb = config.cache_max_mb if max_size is None else max_size
+    removed, freed = _open_cache(config).evict(
+        max_bytes=max_mb * 1024 * 1024,
+        older_than=older_than * 86400 if older_than is not None else None,
+    )
+    console.print(f"[green]Removed {removed} entries ({_format_size(freed)})[/green]")
+
+@app.command()
+def clear(
+    ctx: typer.Context,
+) -> None:
+    """Remove every cached step result."""
+    config: Config = ctx.obj
+    removed, freed = _open_cache(config).clear()
+    console.print(f"[green]Removed {removed} entries ({_format_size(freed)})[/green]")
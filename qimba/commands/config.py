@@ -24,25 +24,65 @@ def show_config(
     # Basic settings
     table.add_row("Config File", str(config.config_path or DEFAULT_CONFIG_FILE))
     table.add_row("Threads", str(config.threads))
+    table.add_row("Memory Limit (MB)", str(config.memory_mb or "physical memory"))
+    table.add_row("Threads per Sample", str(config.threads_per_sample or "auto"))
     table.add_row("Verbose", str(config.verbose))
     
     # Paths
     table.add_row("Data Directory", str(config.data_dir))
     table.add_row("Temp Directory", str(config.temp_dir))
+    table.add_row("Step Cache", f"{config.cache} (max {config.cache_max_mb} MB)")
+    table.add_row("Tool Timeout (s)", str(config.tool_timeout or "none"))
+    table.add_row(
+        "Output Compression",
+        f"BGZF level {config.compression_level}" if config.compression_level else "none",
+    )
+    table.add_row(
+        "Streaming QC to Denoising",
+        f"{config.stream} (buffer {config.stream_buffer} batches"
+        f"{', QC reads kept' if config.stream_keep_qc else ''})",
+    )
+    table.add_row(
+        "Execution Backend",
+        config.backend if config.backend != "queue" else
+        f"queue at {config.work_queue_dir} ({config.queue_local_workers} local workers, "
+        f"timeout {config.queue_timeout:g}s, {config.queue_max_attempts} attempts)",
+    )
     
     # QC settings
     table.add_section()
+    table.add_row("QC Engine", config.qc.engine)
     table.add_row("QC Tool", config.qc.tool)
     table.add_row("Min Quality", str(config.qc.min_quality))
     table.add_row("Min Length", str(config.qc.min_length))
     table.add_row("Max N", str(config.qc.max_n))
+    table.add_row("Window Size", str(config.qc.window_size))
+    table.add_row("Native QC Statistics", str(config.qc.stats))
+    table.add_row("QC Memory per Job (MB)", str(config.qc.memory_mb))
     
     # Denoise settings
     table.add_section()
+    table.add_row("Denoise Engine", config.denoise.engine)
     table.add_row("Denoise Tool", config.denoise.tool)
     table.add_row("Min Reads", str(config.denoise.min_reads))
     table.add_row("Max EE", str(config.denoise.max_ee))
-    
+    table.add_row("Truncate at Max EE", str(config.denoise.truncate_ee))
+    table.add_row("Dereplication Memory (MB)", str(config.denoise.derep_memory_mb))
+    table.add_row("UNOISE Alpha", str(config.denoise.unoise_alpha))
+    table.add_row("Chimera Parent Min Fold", str(config.denoise.chimera_min_fold))
+    table.add_row("Denoise Tool Memory (MB)", str(config.denoise.memory_mb))
+
+    # Merge settings
+    table.add_section()
+    table.add_row("Paired-end Merging", str(config.merge.enabled))
+    table.add_row("Min Overlap", str(config.merge.min_overlap))
+    table.add_row("Max Overlap Mismatches", str(config.merge.max_mismatches))
+    table.add_row(
+        "Merged Length",
+        f"{config.merge.min_length or 'any'} - {config.merge.max_length or 'any'}",
+    )
+    table.add_row("Max Merged Quality", str(config.merge.max_quality))
+
     console.print(table)
 
 @app.command()
@@ -4,12 +4,57 @@ from rich.progress import Progress, SpinnerColumn, TextColumn
 from pathlib import Path
 from typing import Optional
 
+from qimba.core.denoiser import Denoiser, DenoiseSummary
 from qimba.core.executor import Executor
+from qimba.core.fastx import fastx_stem, find_fastx_files
+from qimba.core.table import TABLE_SUFFIX, CountTable
 from qimba.utils.config import Config
 
 app = typer.Typer(help="Denoise sequencing data")
 console = Console()
 
+ENGINES = ("external", "native")
+
+def run_native_denoise(
+    config: Config,
+    input_dir: Path,
+    output_dir: Path,
+    overrides: dict,
+) -> DenoiseSummary:
+    """Run the in-process denoising engine over every input file."""
+    denoiser = Denoiser(
+        config.denoise.model_copy(update=overrides),
+        temp_dir=config.temp_dir,
+        compression_level=config.compression_level,
+    )
+    input_files = find_fastx_files(input_dir)
+    if not input_files:
+        console.print(f"[red]No FASTA/FASTQ files found in {input_dir}[/red]")
+        raise typer.Exit(1)
+    
+    summary = DenoiseSummary()
+    dereplicator = denoiser.new_dereplicator()
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        console=console,
+    ) as progress:
+        task = progress.add_task("Filtering sequences...", total=len(input_files))
+        for path in input_files:
+            stats = denoiser.process_sample(
+                path, output_dir / "filtered", dereplicator,
+                workers=config.threads, index_dir=config.index_dir,
+            )
+            summary.samples[fastx_stem(path)] = stats
+            summary.filter_stats += stats
+            progress.advance(task)
+        
+        progress.add_task("Dereplicating...", total=None)
+        uniques = denoiser.dereplicate(dereplicator, output_dir, summary)
+        progress.add_task("Generating ASVs...", total=None)
+        denoiser.find_asvs(uniques, output_dir, summary)
+    return summary
+
 @app.callback(invoke_without_command=True)
 def denoise(
     ctx: typer.Context,
@@ -35,10 +80,20 @@ def denoise(
         "--max-ee",
         help="Maximum expected error rate",
     ),
-    threads: int = typer.Option(
-        1,
+    truncate_ee: Optional[bool] = typer.Option(
+        None,
+        "--truncate-ee/--no-truncate-ee",
+        help="Truncate reads where --max-ee is exceeded instead of discarding them",
+    ),
+    threads: Optional[int] = typer.Option(
+        None,
         "--threads", "-t",
-        help="Number of threads to use",
+        help="Number of threads to use (default from config)",
+    ),
+    engine: Optional[str] = typer.Option(
+        None,
+        "--engine", "-e",
+        help="Denoising engine: 'external' tool or in-process 'native' (default from config)",
     ),
 ) -> None:
     """
@@ -51,14 +106,41 @@ def denoise(
         return
         
     config: Config = ctx.obj
+    # All jobs of the command share one thread budget
+    threads = threads or config.threads
+    config.threads = threads
     
     # Set default output directory if not specified
     if output_dir is None:
         output_dir = input_dir / "denoise_results"
     
+    engine = engine or config.denoise.engine
+    if engine not in ENGINES:
+        console.print(f"[red]Unknown denoising engine '{engine}' (choose from {', '.join(ENGINES)})[/red]")
+        raise typer.Exit(1)
+    
     # Create output directory
     output_dir.mkdir(parents=True, exist_ok=True)
     
+    if engine == "native":
+        overrides = {"min_reads": min_reads, "max_ee": max_ee}
+        if truncate_ee is not None:
+            overrides["truncate_ee"] = truncate_ee
+        summary = run_native_denoise(config, input_dir, output_dir, overrides)
+        stats = summary.filter_stats
+        console.print("[green]Denoising completed successfully![/green]")
+        console.print(f"Results saved to: {output_dir}")
+        console.print("\n[bold]Summary Statistics:[/bold]")
+        console.print(f"Input sequences: {stats.reads_in}")
+        console.print(f"Sequences retained: {stats.reads_out} ({stats.pass_rate:.1%})")
+        console.print(f"Sequences truncated: {stats.reads_trimmed}")
+        console.print(f"Above max EE: {stats.high_ee}")
+        console.print(f"Unique sequences: {summary.uniques}")
+        console.print(f"Uniques with >= {min_reads} reads: {summary.uniques_retained}")
+        console.print(f"ASVs: {summary.asvs}")
+        console.print(f"Reads in ASV table: {summary.table_reads}")
+        return
+    
     # Initialize executor
     executor = Executor(config)
     
@@ -94,12 +176,20 @@ def denoise(
         console.print("[green]Denoising completed successfully![/green]")
         console.print(f"Results saved to: {output_dir}")
         
-        # Mock summary statistics
-        console.print("\n[bold]Summary Statistics:[/bold]")
-        console.print(f"Input sequences: 10000")
-        console.print(f"Sequences retained: 8500")
-        console.print(f"Unique ASVs: 150")
-        console.print(f"Average quality score: 35.2")
+        # Statistics come from the tool's count table, when it writes one
+        table_path = output_dir / "asv_table.tsv"
+        if table_path.exists():
+            table = CountTable.read_tsv(table_path)
+            table.save(output_dir / f"asv_table{TABLE_SUFFIX}")
+            totals = table.sample_totals()
+            console.print("\n[bold]Summary Statistics:[/bold]")
+            console.print(f"Samples: {len(table.samples)}")
+            console.print(f"ASVs: {len(table.observations)}")
+            console.print(f"Reads in ASV table: {table.total}")
+            if len(totals):
+                console.print(f"Reads per sample: {totals.min()} - {totals.max()}")
+        else:
+            console.print(f"[yellow]No ASV table ({table_path.name}) written by the denoising tool[/yellow]")
     else:
         console.print("[red]Denoising failed![/red]")
         console.print(f"Error: {result.error}")
@@ -1,15 +1,77 @@
+import asyncio
+
 import typer
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.table import Table
 from pathlib import Path
 from typing import Optional
 
-from qimba.core.executor import Executor
+from qimba.core.fastx import find_fastx_files, output_name
+from qimba.core.filters import FilterStats, QualityFilter, filter_file
+from qimba.core.pipeline import external_qc
+from qimba.core.qcstats import QC_REPORT_NAME, ReadProfile, write_report
+from qimba.core.samples import discover_samples
 from qimba.utils.config import Config
 
 app = typer.Typer(help="Run quality control analysis")
 console = Console()
 
+ENGINES = ("external", "native")
+
+def print_profiles(profiles: dict[str, ReadProfile]) -> None:
+    """Print the main read statistics of every input file."""
+    table = Table(title="Read Statistics")
+    for column in ("File", "Reads", "Mean length", "Mean quality", "GC", "N", "Duplicates"):
+        table.add_column(column, justify="left" if column == "File" else "right")
+    for name, profile in profiles.items():
+        summary = profile.to_dict()
+        quality = summary["mean_quality"]
+        table.add_row(
+            name,
+            str(summary["reads"]),
+            f"{summary['mean_length']:.1f}",
+            "-" if quality is None else f"{quality:.1f}",
+            f"{summary['gc_content']:.1%}",
+            f"{summary['n_content']:.2%}",
+            f"{summary['duplicate_rate']:.1%}",
+        )
+    console.print(table)
+
+def run_native_qc(
+    config: Config,
+    input_dir: Path,
+    output_dir: Path,
+) -> FilterStats:
+    """
+    Filter every input file in-process with the native quality filter,
+    collecting the read statistics of the input in the same pass.
+    """
+    read_filter = QualityFilter.from_config(config.qc)
+    input_files = find_fastx_files(input_dir)
+    if not input_files:
+        console.print(f"[red]No FASTA/FASTQ files found in {input_dir}[/red]")
+        raise typer.Exit(1)
+    
+    stats = FilterStats()
+    with Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        console=console,
+    ) as progress:
+        task = progress.add_task("Filtering reads...", total=len(input_files))
+        for path in input_files:
+            stats += filter_file(
+                read_filter, path,
+                output_dir / output_name(path, bool(config.compression_level)),
+                workers=config.threads, index_dir=config.index_dir,
+                compression_level=config.compression_level, profile=config.qc.stats,
+            )
+            progress.advance(task)
+    if stats.profiles:
+        write_report(stats.profiles, output_dir / QC_REPORT_NAME)
+    return stats
+
 @app.callback(invoke_without_command=True)
 def qc(
     ctx: typer.Context,
@@ -25,15 +87,20 @@ def qc(
         "--output", "-o",
         help="Output directory for QC results",
     ),
-    min_quality: int = typer.Option(
-        20,
+    min_quality: Optional[int] = typer.Option(
+        None,
         "--min-quality", "-q",
-        help="Minimum quality score threshold",
+        help="Minimum quality score threshold (default from config)",
     ),
-    threads: int = typer.Option(
-        1,
+    threads: Optional[int] = typer.Option(
+        None,
         "--threads", "-t",
-        help="Number of threads to use",
+        help="Number of threads to use (default from config)",
+    ),
+    engine: Optional[str] = typer.Option(
+        None,
+        "--engine", "-e",
+        help="QC engine: 'external' tool or in-process 'native' filter (default from config)",
     ),
 ) -> None:
     """
@@ -43,16 +110,46 @@ def qc(
         return
         
     config: Config = ctx.obj
+    # All jobs of the command share one thread budget
+    threads = threads or config.threads
+    config.threads = threads
+    if min_quality is not None:
+        config = config.model_copy(update={
+            "qc": config.qc.model_copy(update={"min_quality": min_quality}),
+        })
     
     # Set default output directory if not specified
     if output_dir is None:
         output_dir = input_dir / "qc_results"
     
+    engine = engine or config.qc.engine
+    if engine not in ENGINES:
+        console.print(f"[red]Unknown QC engine '{engine}' (choose from {', '.join(ENGINES)})[/red]")
+        raise typer.Exit(1)
+    
     # Create output directory
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Initialize executor
-    executor = Executor(config)
+    if engine == "native":
+        stats = run_native_qc(config, input_dir, output_dir)
+        console.print("[green]Quality Control completed successfully![/green]")
+        console.print(f"Results saved to: {output_dir}")
+        console.print("\n[bold]Summary Statistics:[/bold]")
+        console.print(f"Input reads: {stats.reads_in}")
+        console.print(f"Reads retained: {stats.reads_out} ({stats.pass_rate:.1%})")
+        console.print(f"Reads trimmed: {stats.reads_trimmed}")
+        console.print(f"Too short: {stats.too_short}")
+        console.print(f"Too many Ns: {stats.too_many_n}")
+        console.print(f"Low quality: {stats.low_quality}")
+        if stats.profiles:
+            print_profiles(stats.profiles)
+            console.print(f"Read statistics written to {output_dir / QC_REPORT_NAME}")
+        return
+    
+    samples = discover_samples(input_dir)
+    if not samples:
+        console.print(f"[red]No FASTA/FASTQ files found in {input_dir}[/red]")
+        raise typer.Exit(1)
     
     with Progress(
         SpinnerColumn(),
@@ -61,21 +158,18 @@ def qc(
     ) as progress:
         task = progress.add_task("Running Quality Control...", total=None)
         
-        # Run QC analysis
-        result = executor.run_qc_tool(
-            input_dir=input_dir,
-            output_dir=output_dir,
-            min_quality=min_quality,
-            threads=threads
-        )
+        # One tool run per sample, as many at once as the threads allow
+        results = asyncio.run(external_qc(config, samples, output_dir, threads))
         
         progress.update(task, completed=True)
     
     # Generate report
-    if result.success:
+    failed = [result for result in results if not result.success]
+    if not failed:
         console.print("[green]Quality Control completed successfully![/green]")
         console.print(f"Results saved to: {output_dir}")
     else:
         console.print("[red]Quality Control failed![/red]")
-        console.print(f"Error: {result.error}")
+        for result in failed:
+            console.print(f"Error in {result.sample}: {result.error}")
         raise typer.Exit(1)
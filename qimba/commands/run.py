@@ -1,15 +1,37 @@
 import typer
 from rich.console import Console
-from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, SpinnerColumn, TextColumn
+from rich.table import Table
 from pathlib import Path
 from typing import Optional
 
-from qimba.core.pipeline import Pipeline
+from qimba.core.profiling import Profiler
 from qimba.utils.config import Config
 
 app = typer.Typer(help="Run the complete analysis pipeline")
 console = Console()
 
+def print_profile(profiler: Profiler) -> None:
+    """Print the per-step resource usage of a profiled run."""
+    table = Table(title="Step Profile")
+    for column in ("Step", "Tasks", "Wall s", "CPU s", "RSS MB",
+                   "Read MB", "Write MB", "Reads", "Reads/s", "Slowest"):
+        table.add_column(column, justify="left" if column in ("Step", "Slowest") else "right")
+    for summary in profiler.summary():
+        table.add_row(
+            summary.step,
+            str(summary.tasks),
+            f"{summary.wall:.2f}",
+            f"{summary.cpu:.2f}",
+            f"{summary.max_rss_kb / 1024:.0f}",
+            f"{summary.read_bytes / 1e6:.1f}",
+            f"{summary.write_bytes / 1e6:.1f}",
+            str(summary.reads),
+            f"{summary.reads_per_second:,.0f}",
+            f"{summary.slowest} ({summary.slowest_wall:.2f}s)",
+        )
+    console.print(table)
+
 @app.callback(invoke_without_command=True)
 def run(
     ctx: typer.Context,
@@ -25,54 +47,176 @@ def run(
         "--output", "-o",
         help="Output directory for results",
     ),
-    threads: int = typer.Option(
-        1,
+    threads: Optional[int] = typer.Option(
+        None,
         "--threads", "-t",
-        help="Number of threads to use",
+        help="Number of threads to use (default from config)",
+    ),
+    memory: Optional[int] = typer.Option(
+        None,
+        "--memory", "-m",
+        help="Memory shared by concurrent jobs in MB (default from config)",
     ),
     skip_qc: bool = typer.Option(
         False,
         "--skip-qc",
         help="Skip quality control step",
     ),
+    skip: Optional[list[str]] = typer.Option(
+        None,
+        "--skip",
+        help="Skip a pipeline step by name (repeatable)",
+    ),
+    no_cache: bool = typer.Option(
+        False,
+        "--no-cache",
+        help="Run every step even if a cached result is available",
+    ),
+    incremental: bool = typer.Option(
+        False,
+        "--incremental",
+        help="Add samples not yet in the output directory to its ASVs and count table",
+    ),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Stream quality-filtered reads straight into dereplication (native engines)",
+    ),
+    backend: Optional[str] = typer.Option(
+        None,
+        "--backend",
+        help="Where steps run: 'local' or 'queue' for qimba workers (default from config)",
+    ),
+    local_workers: Optional[int] = typer.Option(
+        None,
+        "--local-workers",
+        help="With the queue backend, workers to start on this machine (default from config)",
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Record per-step resource usage to profile.json and profile.trace.json",
+    ),
 ) -> None:
     """
     Run the complete Qimba analysis pipeline.
     
-    This will execute all steps in sequence:
+    Steps form a graph and run per sample as soon as their inputs are ready:
     1. Quality Control (QC)
     2. Denoising
+    3. Chimera removal (native denoising)
     [Additional steps...]
+    
+    With --incremental, only samples missing from the output's manifest are
+    processed, and their reads are added to the existing results.
+    With --stream, quality-filtered reads flow straight into dereplication
+    instead of being written to qc_results and read back.
+    With --backend queue, per-sample steps are put on a work queue and run
+    by `qimba worker` processes, on this machine or any node sharing the
+    queue, input and output directories. -t then sets the jobs in flight.
     """
     if ctx.resilient_parsing:
         return
         
+    # Deferred so that `qimba run --help` does not load the pipeline
+    from qimba.core.manifest import MANIFEST_NAME, Manifest
+    from qimba.core.pipeline import Pipeline
+    
     config: Config = ctx.obj
+    # All jobs of the command share one thread budget
+    threads = threads or config.threads
+    config.threads = threads
+    if memory is not None:
+        config.memory_mb = memory
+    if stream:
+        config.stream = True
+    if backend is not None:
+        config.backend = backend
+    if local_workers is not None:
+        config.queue_local_workers = local_workers
+    if config.backend not in ("local", "queue"):
+        console.print(f"[red]Unknown backend: {config.backend} (use 'local' or 'queue')[/red]")
+        raise typer.Exit(1)
+    if config.stream and (config.qc.engine, config.denoise.engine) != ("native", "native"):
+        console.print("[yellow]Streaming needs the native QC and denoising engines; writing step outputs instead[/yellow]")
     
     # Create output directory
     output_dir.mkdir(parents=True, exist_ok=True)
     
+    if incremental and Manifest.load(output_dir) is None:
+        console.print(f"[yellow]No {MANIFEST_NAME} in {output_dir}, running all samples[/yellow]")
+        incremental = False
+    
     # Initialize pipeline
     pipeline = Pipeline(
         input_dir=input_dir,
         output_dir=output_dir,
         threads=threads,
-        config=config
+        config=config,
+        incremental=incremental,
     )
     
+    skipped = set(skip or [])
+    if skip_qc:
+        skipped.add("qc")
+    unknown = skipped - set(pipeline.graph.steps)
+    if unknown:
+        console.print(f"[red]Unknown pipeline steps: {', '.join(sorted(unknown))}[/red]")
+        console.print(f"Available steps: {', '.join(pipeline.graph.steps)}")
+        raise typer.Exit(1)
+    
+    try:
+        pending = pipeline.pending_samples()
+    except RuntimeError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+    if incremental and not pending:
+        console.print("[green]No new samples to add[/green]")
+        return
+    if incremental:
+        console.print(f"Adding {len(pending)} new samples")
+    if config.backend == "queue":
+        console.print(
+            f"Queueing jobs in {config.work_queue_dir}; add workers with "
+            f"`qimba worker --queue {config.work_queue_dir}`"
+        )
+    
     with Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        MofNCompleteColumn(),
         console=console,
     ) as progress:
-        # Execute pipeline steps
-        if not skip_qc:
-            progress.add_task("Running Quality Control...", total=None)
-            pipeline.run_qc()
-            
-        progress.add_task("Running Denoising...", total=None)
-        pipeline.run_denoise()
-        
-        # Add more pipeline steps here
+        # One progress bar per step, advanced as samples finish
+        graph = pipeline.graph.prune(skipped)
+        samples = len(pending)
+        bars = {
+            step.name: progress.add_task(
+                f"Running {step.name}...", total=samples if step.per_sample else 1
+            )
+            for step in graph.order()
+        }
+        profiler = Profiler() if profile else None
+        try:
+            pipeline.run(
+                skip=skipped,
+                on_complete=lambda task, result: progress.advance(bars[task.step.name]),
+                use_cache=not no_cache,
+                profiler=profiler,
+            )
+        except RuntimeError:
+            raise typer.Exit(1)
+        finally:
+            if profiler is not None:
+                profiler.write_json(output_dir / "profile.json")
+                profiler.write_chrome_trace(output_dir / "profile.trace.json")
         
+    if profiler is not None:
+        print_profile(profiler)
+        console.print(f"Profile written to {output_dir / 'profile.json'} and {output_dir / 'profile.trace.json'}")
+    if pipeline.cached_tasks:
+        console.print(f"Reused {pipeline.cached_tasks} cached step results")
+    if pipeline.retried_tasks:
+        console.print(f"[yellow]Retried {pipeline.retried_tasks} jobs lost by their workers[/yellow]")
     console.print("[green]Pipeline completed successfully! :rocket:[/green]")
@@ -0,0 +1,95 @@
+# qimba/commands/table.py
+
+import numpy as np
+import typer
+from pathlib import Path
+from typing import List
+from rich.console import Console
+from rich.table import Table
+
+from qimba.core.table import TABLE_SUFFIX, CountTable
+
+app = typer.Typer(help="Inspect, export, merge and filter ASV count tables")
+console = Console()
+
+FORMATS = ("tsv", "biom")
+
+def _load(path: Path) -> CountTable:
+    try:
+        return CountTable.load(path)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+
+@app.command()
+def summary(
+    path: Path = typer.Argument(..., help="Count table (.qct)", exists=True, dir_okay=False),
+) -> None:
+    """Show the size and read depth of a count table."""
+    table = _load(path)
+    sample_totals = table.sample_totals()
+    observation_totals = table.observation_totals()
+
+    overview = Table(title=f"Count Table ({path})")
+    overview.add_column("Property", style="cyan")
+    overview.add_column("Value", justify="right", style="green")
+    overview.add_row("Samples", str(len(table.samples)))
+    overview.add_row("ASVs", str(len(table.observations)))
+    overview.add_row("Non-zero counts", str(table.nnz))
+    overview.add_row("Reads", str(table.total))
+    if len(sample_totals):
+        overview.add_row("Reads per sample (min)", str(sample_totals.min()))
+        overview.add_row("Reads per sample (median)", f"{float(np.median(sample_totals)):.0f}")
+        overview.add_row("Reads per sample (max)", str(sample_totals.max()))
+    if len(observation_totals):
+        overview.add_row("Singleton ASVs", str(int((observation_totals == 1).sum())))
+    console.print(overview)
+
+@app.command()
+def export(
+    path: Path = typer.Argument(..., help="Count table (.qct)", exists=True, dir_okay=False),
+    output: Path = typer.Option(..., "--output", "-o", help="File to write"),
+    format: str = typer.Option("tsv", "--format", "-f", help="Output format: tsv or biom (JSON BIOM 1.0)"),
+) -> None:
+    """Export a count table as TSV or BIOM."""
+    if format not in FORMATS:
+        console.print(f"[red]Unknown format '{format}' (choose from {', '.join(FORMATS)})[/red]")
+        raise typer.Exit(1)
+    table = _load(path)
+    if format == "tsv":
+        table.write_tsv(output)
+    else:
+        table.write_biom(output)
+    console.print(f"[green]Wrote {output}[/green]")
+
+@app.command()
+def merge(
+    paths: List[Path] = typer.Argument(..., help="Count tables to merge", exists=True, dir_okay=False),
+    output: Path = typer.Option(..., "--output", "-o", help=f"Merged table ({TABLE_SUFFIX})"),
+) -> None:
+    """
+    Merge count tables, matching ASVs by id and adding up the counts of
+    samples present in several tables.
+    """
+    table = CountTable.merge(_load(path) for path in paths)
+    table.save(output)
+    console.print(
+        f"[green]Merged {len(paths)} tables into {output}: "
+        f"{len(table.samples)} samples, {len(table.observations)} ASVs[/green]"
+    )
+
+@app.command("filter")
+def filter_table(
+    path: Path = typer.Argument(..., help="Count table (.qct)", exists=True, dir_okay=False),
+    output: Path = typer.Option(..., "--output", "-o", help=f"Filtered table ({TABLE_SUFFIX})"),
+    min_abundance: int = typer.Option(1, "--min-abundance", help="Minimum reads of an ASV over all samples"),
+    min_samples: int = typer.Option(1, "--min-samples", help="Minimum number of samples an ASV is found in"),
+) -> None:
+    """Drop rare ASVs from a count table."""
+    table = _load(path)
+    filtered = table.filter(min_abundance=min_abundance, min_samples=min_samples)
+    filtered.save(output)
+    console.print(
+        f"[green]Kept {len(filtered.observations)} of {len(table.observations)} ASVs "
+        f"({filtered.total} of {table.total} reads)[/green]"
+    )
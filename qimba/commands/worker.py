@@ -0,0 +1,94 @@
+# qimba/commands/worker.py
+
+import time
+import typer
+from pathlib import Path
+from typing import Optional
+from rich.console import Console
+from rich.table import Table
+
+from qimba.core.workqueue import WorkQueue, Worker
+from qimba.utils.config import Config
+
+app = typer.Typer(help="Run pipeline jobs from a shared work queue")
+console = Console()
+
+def _queue(config: Config, queue_dir: Optional[Path]) -> WorkQueue:
+    return WorkQueue(queue_dir or config.work_queue_dir)
+
+@app.callback(invoke_without_command=True)
+def worker(
+    ctx: typer.Context,
+    queue_dir: Optional[Path] = typer.Option(
+        None,
+        "--queue", "-q",
+        help="Work queue directory (default from config)",
+    ),
+    name: Optional[str] = typer.Option(
+        None,
+        "--name",
+        help="Worker name (default: host name and process id)",
+    ),
+    max_jobs: Optional[int] = typer.Option(
+        None,
+        "--max-jobs",
+        help="Stop after this many jobs",
+    ),
+    idle_timeout: Optional[float] = typer.Option(
+        None,
+        "--idle-timeout",
+        help="Stop after this many seconds without pending jobs",
+    ),
+) -> None:
+    """
+    Pull jobs from the work queue of `qimba run` with the queue backend and
+    run them, until stopped.
+
+    Start any number of workers, on any machine that sees the queue
+    directory and the input and output paths of the run at the same
+    locations.
+    """
+    if ctx.resilient_parsing or ctx.invoked_subcommand is not None:
+        return
+    config: Config = ctx.obj
+    queue = _queue(config, queue_dir)
+    runner = Worker(queue, name=name, heartbeat=config.queue_heartbeat)
+    console.print(f"Worker {runner.name} waiting for jobs in {queue.root}")
+    try:
+        done = runner.run(max_jobs=max_jobs, idle_timeout=idle_timeout)
+    except KeyboardInterrupt:
+        done = runner.jobs_done
+    console.print(f"[green]Worker {runner.name} ran {done} jobs[/green]")
+
+@app.command()
+def status(
+    ctx: typer.Context,
+    queue_dir: Optional[Path] = typer.Option(
+        None,
+        "--queue", "-q",
+        help="Work queue directory (default from config)",
+    ),
+) -> None:
+    """Show the jobs in the work queue and the active workers."""
+    config: Config = ctx.obj
+    queue = _queue(config, queue_dir)
+    # Workers are considered gone after missing a few heartbeats
+    state = queue.status(max_age=3 * config.queue_heartbeat)
+    console.print(
+        f"Queue {queue.root}: {state.pending} pending, {state.running} running, "
+        f"{state.results} results waiting"
+    )
+    table = Table(title="Workers")
+    for column in ("Name", "Host", "PID", "Job", "Jobs done", "Last seen"):
+        table.add_column(column)
+    now = time.time()
+    for info in state.workers:
+        table.add_row(
+            info["name"],
+            info["host"],
+            str(info["pid"]),
+            info["job"] or "-",
+            str(info["jobs_done"]),
+            f"{now - info['heartbeat']:.0f}s ago",
+        )
+    console.print(table)
@@ -0,0 +1,245 @@
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from qimba.core.derep import _CODES
+
+# The band of 2k + 1 diagonals must fit in one 64-bit word
+MAX_DISTANCE = 31
+# Finished and hopeless comparisons are dropped from the working set this often
+_COMPACT_EVERY = 16
+# Text code that matches no query base (N and padding)
+_NO_MATCH = 4
+# Up to this many targets, comparing them one by one on Python integers is
+# cheaper than the per-column overhead of the vectorised kernel
+_SCALAR_TARGETS = 8
+
+Sequence_ = Union[bytes, np.ndarray]
+
+_ONE = np.uint64(1)
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).astype(np.int64)
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((words * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def encode(sequence: Sequence_) -> np.ndarray:
+    """2-bit codes of a sequence (bytes, or codes already); anything but ACGT is 255."""
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    return np.take(_CODES, np.frombuffer(sequence, dtype=np.uint8))
+
+
+def _match_windows(query: np.ndarray, k: int, columns: int) -> np.ndarray:
+    """
+    Bit masks of the query positions matching each base, for the band of
+    rows covered in every text column: shape ``(columns + 1, 5)``, where
+    bit ``b`` of column ``j`` is row ``max(1, j - k) + b`` and the fifth
+    symbol (N or padding) matches nothing.
+    """
+    width = 2 * k + 1
+    tops = np.maximum(1, np.arange(columns + 1) - k)
+    padded = np.zeros(len(query) + columns + width + 1, dtype=np.uint8)
+    padded[1:len(query) + 1] = query
+    rows = tops[:, None] + np.arange(width)
+    windows = np.zeros((columns + 1, 5), dtype=np.uint64)
+    valid = rows <= len(query)
+    for code in range(4):
+        bits = (padded[rows] == code) & valid
+        packed = np.packbits(bits, axis=1, bitorder="little")
+        packed = np.pad(packed, ((0, 0), (0, 8 - packed.shape[1])))
+        windows[:, code] = packed.view("<u8").ravel()
+    return windows
+
+
+def _myers(query: np.ndarray, text: np.ndarray) -> int:
+    """
+    Edit distance of two coded sequences by Myers' bit-vector algorithm,
+    with the whole query held in one Python integer.
+    """
+    m = len(query)
+    if not m or not len(text):
+        return max(m, len(text))
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    peq = [
+        int.from_bytes(np.packbits(query == code, bitorder="little").tobytes(), "little")
+        for code in range(4)
+    ] + [0]
+    vp, vn, score = full, 0, m
+    for code in np.minimum(text, _NO_MATCH).tolist():
+        eq = peq[code]
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        ph = vn | (~(xh | vp) & full)
+        mh = vp & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        vp = mh | (~(xv | ph) & full)
+        vn = ph & xv
+    return score
+
+
+def _banded(
+    tables: np.ndarray,
+    table_ids: np.ndarray,
+    query_lengths: np.ndarray,
+    texts: np.ndarray,
+    text_lengths: np.ndarray,
+    limits: np.ndarray,
+    k: int,
+) -> np.ndarray:
+    """
+    Banded global edit distances of many (query, text) pairs at once.
+
+    Myers' bit-vector algorithm on a window of the ``2k + 1`` rows around
+    the diagonal, which moves down one row per text column (Hyyrö's banded
+    variant). Cells outside the band are taken as reachable from the row
+    above at cost +1, an overestimate that only matters for alignments
+    leaving the band, i.e. with more than ``k`` differences. ``score``
+    tracks the cell at the top of the window. A pair is given up as soon
+    as no cell of its window can be within its limit.
+    """
+    result = limits + 1
+    width = 2 * k + 1
+    window = np.uint64((1 << width) - 1)
+    bottom = np.uint64(1 << (width - 1))
+
+    active = np.flatnonzero(np.abs(query_lengths - text_lengths) <= limits)
+    vp = np.full(len(active), window, dtype=np.uint64)
+    vn = np.zeros(len(active), dtype=np.uint64)
+    score = np.ones(len(active), dtype=np.int64)
+    # Against an empty sequence, every base of the other is an indel
+    empty = (text_lengths[active] == 0) | (query_lengths[active] == 0)
+    ids = active[empty]
+    result[ids] = np.minimum(np.maximum(query_lengths[ids], text_lengths[ids]), limits[ids] + 1)
+    keep = ~empty
+    active, vp, vn, score = active[keep], vp[keep], vn[keep], score[keep]
+
+    for j in range(1, int(text_lengths.max(initial=0)) + 1):
+        if not len(active):
+            break
+        eq = tables[table_ids[active], j, texts[active, j - 1]]
+        sliding = j > k + 1
+        if sliding:
+            vp = (vp >> _ONE) | bottom
+            vn = vn >> _ONE
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        ph = vn | ~(xh | vp)
+        mh = vp & xh
+        if not sliding:
+            score += (ph & _ONE).astype(np.int64) - (mh & _ONE).astype(np.int64)
+        ph = ((ph << _ONE) | _ONE) & window
+        mh = (mh << _ONE) & window
+        vp = (mh | ~(xv | ph)) & window
+        vn = ph & xv
+        if sliding:
+            score += 1 + (vp & _ONE).astype(np.int64) - (vn & _ONE).astype(np.int64)
+
+        done = text_lengths[active] == j
+        if done.any():
+            ids = active[done]
+            top = max(1, j - k)
+            span = query_lengths[ids] - top
+            inside = (span >= 0) & (span < width)
+            mask = ((_ONE << (span.clip(0, width - 1) + 1).astype(np.uint64)) - _ONE) & ~_ONE
+            distance = (
+                score[done] + _popcount(vp[done] & mask) - _popcount(vn[done] & mask)
+            )
+            result[ids] = np.where(inside, np.minimum(distance, limits[ids] + 1), limits[ids] + 1)
+        # No cell of the window can lead to a distance within the limit
+        hopeless = score - _popcount(vn) > limits[active]
+        if j % _COMPACT_EVERY == 0 or done.any():
+            keep = ~(done | hopeless)
+            active, vp, vn, score = active[keep], vp[keep], vn[keep], score[keep]
+    return result
+
+
+def _pad_texts(targets: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    lengths = np.array([len(t) for t in targets], dtype=np.int64)
+    texts = np.full((len(targets), max(1, int(lengths.max(initial=0)))), _NO_MATCH, dtype=np.uint8)
+    for i, target in enumerate(targets):
+        texts[i, :len(target)] = np.minimum(target, _NO_MATCH)
+    return texts, lengths
+
+
+def _limits(max_distance: Union[int, np.ndarray], pairs: int) -> tuple[np.ndarray, int]:
+    limits = np.broadcast_to(np.asarray(max_distance, dtype=np.int64), (pairs,)).copy()
+    k = int(limits.max(initial=0))
+    if k > MAX_DISTANCE:
+        raise ValueError(f"max_distance above {MAX_DISTANCE} is not supported by the banded kernel")
+    return limits, max(k, 0)
+
+
+def edit_distances(
+    query: Sequence_,
+    targets: Sequence[Sequence_],
+    max_distance: Union[int, np.ndarray] = 8,
+) -> np.ndarray:
+    """
+    Edit (Levenshtein) distances between one query and many targets.
+
+    Distances above ``max_distance`` (a scalar or one limit per target, at
+    most ``MAX_DISTANCE``) are reported as ``max_distance + 1``; the band
+    and the early exit of hopeless targets both depend on it, so keep it
+    as small as the caller allows. Sequences are bytes or 2-bit codes.
+    """
+    targets = [encode(t) for t in targets]
+    if not targets:
+        return np.empty(0, dtype=np.int64)
+    query = encode(query)
+    limits, k = _limits(max_distance, len(targets))
+    if len(targets) <= _SCALAR_TARGETS:
+        distances = np.array([_myers(query, t) for t in targets], dtype=np.int64)
+        return np.minimum(distances, limits + 1)
+    texts, text_lengths = _pad_texts(targets)
+    tables = _match_windows(query, k, texts.shape[1])[None]
+    return _banded(
+        tables,
+        np.zeros(len(targets), dtype=np.int64),
+        np.full(len(targets), len(query), dtype=np.int64),
+        texts,
+        text_lengths,
+        limits,
+        k,
+    )
+
+
+def pair_distances(
+    queries: Sequence[Sequence_],
+    targets: Sequence[Sequence_],
+    max_distance: Union[int, np.ndarray] = 8,
+    query_ids: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Edit distances of many (query, target) pairs, computed together.
+
+    Pair ``i`` compares ``queries[query_ids[i]]`` (``queries[i]`` without
+    ``query_ids``) with ``targets[i]``; limits work as in ``edit_distances``.
+    """
+    targets = [encode(t) for t in targets]
+    if not targets:
+        return np.empty(0, dtype=np.int64)
+    queries = [encode(q) for q in queries]
+    query_ids = np.arange(len(targets)) if query_ids is None else np.asarray(query_ids, dtype=np.int64)
+    limits, k = _limits(max_distance, len(targets))
+    texts, text_lengths = _pad_texts(targets)
+    used, table_ids = np.unique(query_ids, return_inverse=True)
+    tables = np.stack([_match_windows(queries[q], k, texts.shape[1]) for q in used.tolist()])
+    query_lengths = np.array([len(q) for q in queries], dtype=np.int64)[query_ids]
+    return _banded(tables, table_ids.ravel(), query_lengths, texts, text_lengths, limits, k)
+
+
+def edit_distance(a: Sequence_, b: Sequence_, max_distance: int = MAX_DISTANCE) -> int:
+    """Edit distance of two sequences, capped at ``max_distance + 1``."""
+    return int(edit_distances(a, [b], max_distance)[0])
@@ -0,0 +1,346 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    CancelledError, Executor as PoolExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed,
+)
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from pydantic import ValidationError
+
+from qimba.core.pipeline import Pipeline
+from qimba.core.resources import ResourceManager, physical_memory_mb
+from qimba.core.samples import SampleResult
+from qimba.core.workqueue import LocalWorkers, QueueExecutor, WorkQueue
+from qimba.utils.config import Config
+
+# Settings merged key by key instead of replaced by an override
+_NESTED = ("qc", "denoise", "merge")
+
+
+@dataclass
+class Project:
+    """
+    One input directory of a batch, its output directory and the settings
+    it runs with, and how its run went.
+    """
+    name: str
+    input_dir: Path
+    output_dir: Path
+    config: Config
+    samples: int = 0
+    reads: int = 0
+    input_bytes: int = 0
+    tasks: int = 0
+    cached: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return max(0.0, self.finished - self.started) if self.started else 0.0
+
+    @property
+    def reads_per_second(self) -> float:
+        return self.reads / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.input_bytes / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "input_dir": str(self.input_dir),
+            "output_dir": str(self.output_dir),
+            "success": self.error is None,
+            "error": self.error,
+            "samples": self.samples,
+            "reads": self.reads,
+            "input_bytes": self.input_bytes,
+            "tasks": self.tasks,
+            "cached_tasks": self.cached,
+            "started": self.started,
+            "elapsed_seconds": self.elapsed,
+            "reads_per_second": self.reads_per_second,
+            "mb_per_second": self.mb_per_second,
+        }
+
+
+def _merge(settings: dict, overrides: dict) -> dict:
+    merged = dict(settings)
+    for key, value in overrides.items():
+        if key in _NESTED and isinstance(value, dict):
+            merged[key] = {**merged.get(key, {}), **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_batch(path: Path, config: Config) -> list[Project]:
+    """
+    Read a batch manifest: a JSON list of projects, or an object with the
+    list under ``projects`` and settings shared by all of them under
+    ``defaults``.
+
+    Every project has an ``input_dir`` and an ``output_dir``, relative to
+    the manifest's directory unless absolute, and optionally a ``name``
+    (the input directory's name by default) and ``config`` settings that
+    override those of ``config`` and the defaults.
+    """
+    path = Path(path)
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"projects": data}
+    base = _merge(config.model_dump(), data.get("defaults", {}))
+    projects: list[Project] = []
+    for number, entry in enumerate(data.get("projects", []), 1):
+        missing = [key for key in ("input_dir", "output_dir") if key not in entry]
+        if missing:
+            raise ValueError(f"{path}: project {number} has no {' or '.join(missing)}")
+        input_dir, output_dir = (
+            path.parent / Path(entry[key]).expanduser() for key in ("input_dir", "output_dir")
+        )
+        name = entry.get("name") or input_dir.name
+        if any(project.name == name for project in projects):
+            raise ValueError(f"{path}: duplicate project name {name}")
+        settings = _merge(base, entry.get("config", {}))
+        # Without a path, validation does not load the configuration file again
+        settings["config_path"] = None
+        try:
+            project_config = Config.model_validate(settings)
+        except ValidationError as e:
+            raise ValueError(f"{path}: invalid settings for project {name}: {e}") from e
+        projects.append(Project(name, input_dir, output_dir, project_config))
+    if not projects:
+        raise ValueError(f"{path}: no projects")
+    return projects
+
+
+@dataclass
+class _Call:
+    future: Future
+    fn: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+    weight: int
+
+
+class _Lane(PoolExecutor):
+    """The calls of one run on a ``FairExecutor``."""
+
+    def __init__(self, owner: "FairExecutor", name: str):
+        self.owner = owner
+        self.name = name
+        self.waiting: deque[_Call] = deque()
+        self.running: set[Future] = set()
+        self.threads = 0
+        self.started = 0
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return self.submit_weighted(1, fn, *args, **kwargs)
+
+    def submit_weighted(self, weight: int, fn, /, *args, **kwargs) -> Future:
+        """Submit a call that holds ``weight`` threads while it runs."""
+        weight = max(1, min(weight, self.owner.slots))
+        future: Future = Future()
+        with self.owner._lock:
+            self.waiting.append(_Call(future, fn, args, kwargs, weight))
+            self.owner._dispatch()
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        if cancel_futures:
+            with self.owner._lock:
+                calls, self.waiting = list(self.waiting), deque()
+            for call in calls:
+                call.future.cancel()
+        if wait:
+            with self.owner._lock:
+                running = list(self.running)
+            for future in running:
+                future.exception()
+
+
+class FairExecutor:
+    """
+    Shares one executor between several runs, each submitting through its
+    own ``lane``, so that they take turns at its ``slots`` threads.
+
+    Calls wait in their lane until threads are free. Whenever they are,
+    the lane with the fewest threads in use (then with the fewest calls
+    started) goes next, so a small run gets its share next to a large one
+    instead of waiting for it to finish.
+    """
+
+    def __init__(self, pool: PoolExecutor, slots: int):
+        self.pool = pool
+        self.slots = max(1, slots)
+        self.free = self.slots
+        self._lanes: list[_Lane] = []
+        # Reentrant, as an executor may finish a call while it is submitted
+        self._lock = threading.RLock()
+
+    def lane(self, name: str) -> _Lane:
+        lane = _Lane(self, name)
+        with self._lock:
+            self._lanes.append(lane)
+        return lane
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            while True:
+                waiting = [lane for lane in self._lanes if lane.waiting]
+                if not waiting:
+                    return
+                lane = min(waiting, key=lambda lane: (lane.threads, lane.started))
+                call = lane.waiting[0]
+                # The next lane waits for enough threads rather than being overtaken
+                if call.weight > self.free:
+                    return
+                lane.waiting.popleft()
+                if not call.future.set_running_or_notify_cancel():
+                    continue
+                self.free -= call.weight
+                lane.threads += call.weight
+                lane.started += 1
+                lane.running.add(call.future)
+                try:
+                    inner = self.pool.submit(call.fn, *call.args, **call.kwargs)
+                except BaseException as e:
+                    self._finished(lane, call, None, e)
+                    continue
+                inner.add_done_callback(lambda inner, lane=lane, call=call: self._finished(lane, call, inner))
+
+    def _finished(
+        self, lane: _Lane, call: _Call, inner: Optional[Future], error: Optional[BaseException] = None
+    ) -> None:
+        with self._lock:
+            self.free += call.weight
+            lane.threads -= call.weight
+            lane.running.discard(call.future)
+        if inner is not None:
+            if inner.cancelled():
+                error = CancelledError()
+            else:
+                error = inner.exception()
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(inner.result())
+        self._dispatch()
+
+
+def _count(project: Project, first_steps: set[str]) -> Callable:
+    lock = threading.Lock()
+
+    def on_complete(task, result) -> None:
+        with lock:
+            project.tasks += 1
+            stats = getattr(result, "stats", None)
+            if task.step.name in first_steps and isinstance(result, SampleResult) and stats is not None:
+                project.reads += stats.reads_in
+    return on_complete
+
+
+def run_project(
+    project: Project,
+    pool: PoolExecutor,
+    use_cache: bool = True,
+    resources: Optional[ResourceManager] = None,
+) -> Project:
+    """
+    Run the pipeline of one project on a shared pool, and on ``resources``
+    shared with other projects if given, recording how it went.
+    """
+    project.started = time.time()
+    try:
+        if not project.input_dir.is_dir():
+            raise FileNotFoundError(f"Input directory not found: {project.input_dir}")
+        project.output_dir.mkdir(parents=True, exist_ok=True)
+        pipeline = Pipeline(
+            input_dir=project.input_dir,
+            output_dir=project.output_dir,
+            threads=project.config.threads,
+            config=project.config,
+        )
+        project.samples = len(pipeline.samples())
+        project.input_bytes = sum(path.stat().st_size for path in pipeline.input_files())
+        first_steps = {step.name for step in pipeline.graph.order() if not step.inputs}
+        try:
+            pipeline.run(
+                on_complete=_count(project, first_steps), use_cache=use_cache,
+                pool=pool, resources=resources,
+            )
+        finally:
+            project.cached = pipeline.cached_tasks
+    except Exception as e:
+        project.error = str(e)
+    project.finished = time.time()
+    return project
+
+
+def run_batch(
+    projects: list[Project],
+    config: Config,
+    max_projects: int = 4,
+    use_cache: bool = True,
+    on_finish: Optional[Callable[[Project], None]] = None,
+) -> list[Project]:
+    """
+    Run several projects through one pool of workers started once.
+
+    Up to ``max_projects`` projects run at the same time, in manifest
+    order, sharing the ``config.threads`` of the pool through a
+    ``FairExecutor``; each project is limited to its own thread budget on
+    top of that. The memory of ``config`` is one budget for all projects,
+    so that concurrent projects do not book the same memory. With the
+    queue backend of ``config``, the pool is the work queue and its
+    workers. A failed project is recorded in its ``error`` and does not
+    stop the others.
+    """
+    threads = max(1, config.threads)
+    for project in projects:
+        project.config.threads = max(1, min(project.config.threads, threads))
+    # Threads are shared out by the FairExecutor and the projects' own
+    # budgets; as with a single run, the memory of the queue's workers is
+    # only limited when set explicitly
+    memory_mb = config.memory_mb
+    if config.backend != "queue":
+        memory_mb = memory_mb or physical_memory_mb()
+    resources = ResourceManager(sum(project.config.threads for project in projects), memory_mb)
+    workers = nullcontext()
+    if config.backend == "queue":
+        queue = WorkQueue(config.work_queue_dir)
+        pool: PoolExecutor = QueueExecutor(
+            queue, timeout=config.queue_timeout, max_attempts=config.queue_max_attempts
+        )
+        workers = LocalWorkers(queue, config.queue_local_workers, config.queue_heartbeat)
+    else:
+        pool = ProcessPoolExecutor(threads)
+    fair = FairExecutor(pool, threads)
+    try:
+        with workers, ThreadPoolExecutor(
+            max(1, max_projects), thread_name_prefix="qimba-project"
+        ) as runner:
+            futures = [
+                runner.submit(run_project, project, fair.lane(project.name), use_cache, resources)
+                for project in projects
+            ]
+            for future in as_completed(futures):
+                if on_finish is not None:
+                    on_finish(future.result())
+    finally:
+        pool.shutdown(wait=config.backend != "queue", cancel_futures=True)
+    return projects
+
+
+def write_batch_report(projects: list[Project], path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump({"projects": [project.to_dict() for project in projects]}, f, indent=2)
@@ -0,0 +1,301 @@
+import io
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+import numpy as np
+
+# Uncompressed bytes per block, as written by bgzip and htslib
+BLOCK_SIZE = 0xFF00
+# gzip header with the 'BC' extra subfield holding the block size
+_HEADER = struct.Struct("<4BI2BH2BHH")
+_HEADER_SIZE = _HEADER.size
+_TRAILER = struct.Struct("<II")
+# Empty block marking the end of a BGZF file
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Blocks compressed or decompressed ahead of the writer or reader, per thread
+_QUEUE_PER_THREAD = 4
+
+Source = Union[str, Path, BinaryIO]
+
+
+def is_bgzf(header: bytes) -> bool:
+    """Whether the first bytes of a file are those of a BGZF block."""
+    return (
+        len(header) >= _HEADER_SIZE
+        and header[:4] == b"\x1f\x8b\x08\x04"
+        and header[10:16] == b"\x06\x00BC\x02\x00"
+    )
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    """Compress up to ``BLOCK_SIZE`` bytes into one BGZF block."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = _HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + _TRAILER.pack(zlib.crc32(data), len(data))
+
+
+def decompress_block(block: bytes) -> bytes:
+    """Decompress one BGZF block, checking its length and CRC."""
+    data = zlib.decompress(memoryview(block)[_HEADER_SIZE:-8], -15)
+    crc, size = _TRAILER.unpack_from(block, len(block) - 8)
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError("Corrupt BGZF block (length or CRC mismatch)")
+    return data
+
+
+def _read_block(handle: BinaryIO) -> Optional[bytes]:
+    """Read the next raw block of a BGZF stream; ``None`` at the end."""
+    header = handle.read(_HEADER_SIZE)
+    if not header:
+        return None
+    if not is_bgzf(header):
+        raise ValueError("Not a BGZF block (is the file plain gzip?)")
+    size = _HEADER.unpack(header)[-1] + 1
+    rest = handle.read(size - _HEADER_SIZE)
+    if len(rest) != size - _HEADER_SIZE:
+        raise ValueError("Truncated BGZF block")
+    return header + rest
+
+
+def block_index(path: Union[str, Path]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compressed and uncompressed start offsets of every block of a BGZF
+    file, followed by the file's total sizes. Read from a bgzip ``.gzi``
+    index next to the file when there is one, otherwise from the block
+    headers.
+    """
+    path = Path(path)
+    total = path.stat().st_size
+    gzi = path.with_name(path.name + ".gzi")
+    if gzi.exists() and gzi.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+        entries = np.fromfile(gzi, dtype="<u8")[1:].reshape(-1, 2).astype(np.int64)
+        coffsets = np.concatenate(([0], entries[:, 0]))
+        uoffsets = np.concatenate(([0], entries[:, 1]))
+        # The uncompressed size is that of the last block
+        with open(path, "rb") as f:
+            f.seek(int(coffsets[-1]))
+            last = 0
+            while (block := _read_block(f)) is not None:
+                last += _TRAILER.unpack_from(block, len(block) - 8)[1]
+        return np.append(coffsets, total), np.append(uoffsets, uoffsets[-1] + last)
+    coffsets, uoffsets = [0], [0]
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER_SIZE)
+            if not header:
+                break
+            if not is_bgzf(header):
+                raise ValueError(f"{path} is not a BGZF file")
+            size = _HEADER.unpack(header)[-1] + 1
+            f.seek(coffsets[-1] + size - 4)
+            isize = struct.unpack("<I", f.read(4))[0]
+            coffsets.append(coffsets[-1] + size)
+            uoffsets.append(uoffsets[-1] + isize)
+    return np.array(coffsets, dtype=np.int64), np.array(uoffsets, dtype=np.int64)
+
+
+def _open(source: Source, mode: str) -> tuple[BinaryIO, bool]:
+    if isinstance(source, (str, Path)):
+        return open(source, mode), True
+    return source, False
+
+
+class BgzfWriter(io.BufferedIOBase):
+    """
+    Writes BGZF (blocked gzip) output, readable by any gzip reader as well
+    as by bgzip/htslib tools.
+
+    Data is cut into ``BLOCK_SIZE`` blocks which, with ``threads > 1``, are
+    compressed in a thread pool (zlib releases the GIL) while the caller
+    keeps producing; blocks are written in order.
+    """
+
+    def __init__(self, destination: Source, level: int = 6, threads: int = 1):
+        super().__init__()
+        self._handle, self._owned = _open(destination, "wb")
+        self.level = level
+        self.threads = max(1, threads)
+        self._buffer = bytearray()
+        self._pending: deque[Future] = deque()
+        self._pool = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        buffer = self._buffer
+        buffer += data
+        full = len(buffer) // BLOCK_SIZE * BLOCK_SIZE
+        if full:
+            with memoryview(buffer) as view:
+                for start in range(0, full, BLOCK_SIZE):
+                    self._submit(bytes(view[start:start + BLOCK_SIZE]))
+            del buffer[:full]
+        return len(data)
+
+    def _submit(self, data: bytes) -> None:
+        if self._pool is None:
+            self._handle.write(compress_block(data, self.level))
+            return
+        self._pending.append(self._pool.submit(compress_block, data, self.level))
+        while len(self._pending) > self.threads * _QUEUE_PER_THREAD:
+            self._handle.write(self._pending.popleft().result())
+
+    def flush(self) -> None:
+        """Compress and write everything written so far."""
+        if self.closed or self._handle.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._handle.write(self._pending.popleft().result())
+        self._handle.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self._handle.write(EOF_BLOCK)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+            if self._owned:
+                self._handle.close()
+            super().close()
+
+
+class BgzfReader(io.BufferedIOBase):
+    """
+    Reads BGZF files, with ``threads > 1`` inflating the blocks ahead of
+    the caller in a thread pool.
+
+    ``seek`` goes to any uncompressed offset through the file's block index
+    (see ``block_index``), decompressing only from the block holding it.
+    A file object passed in is closed with the reader if ``close_source``.
+    """
+
+    def __init__(self, source: Source, threads: int = 1, close_source: bool = False):
+        super().__init__()
+        self._handle, self._owned = _open(source, "rb")
+        self._owned = self._owned or close_source
+        self.threads = max(1, threads)
+        self._pool = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+        self._pending: deque[Future] = deque()
+        self._exhausted = False
+        self._data = b""
+        self._pos = 0
+        # Uncompressed offset of the start of ``_data``
+        self._offset = 0
+        self._index: Optional[tuple[np.ndarray, np.ndarray]] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self._handle.seekable()
+
+    def _fill(self) -> None:
+        """Queue blocks for decompression up to the read-ahead limit."""
+        limit = self.threads * _QUEUE_PER_THREAD if self._pool else 1
+        while not self._exhausted and len(self._pending) < limit:
+            block = _read_block(self._handle)
+            if block is None:
+                self._exhausted = True
+            elif self._pool is None:
+                future: Future = Future()
+                future.set_result(decompress_block(block))
+                self._pending.append(future)
+            else:
+                self._pending.append(self._pool.submit(decompress_block, block))
+
+    def _next_block(self) -> bool:
+        """Move on to the next non-empty block; ``False`` at the end."""
+        while True:
+            self._fill()
+            if not self._pending:
+                return False
+            self._offset += len(self._data)
+            self._data, self._pos = self._pending.popleft().result(), 0
+            if self._data:
+                return True
+
+    def read1(self, size: int = -1) -> bytes:
+        if self._pos >= len(self._data) and not self._next_block():
+            return b""
+        end = len(self._data) if size is None or size < 0 else self._pos + size
+        chunk = self._data[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if self.closed:
+            raise ValueError("read from closed file")
+        chunks = []
+        remaining = -1 if size is None or size < 0 else size
+        while remaining:
+            chunk = self.read1(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if remaining > 0:
+                remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset + self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Seek to an uncompressed offset."""
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += int(self.index[1][-1])
+        if self._offset <= offset <= self._offset + len(self._data):
+            self._pos = offset - self._offset
+            return offset
+        coffsets, uoffsets = self.index
+        block = max(0, int(np.searchsorted(uoffsets, offset, side="right")) - 1)
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._exhausted = False
+        self._handle.seek(int(coffsets[block]))
+        self._offset, self._data, self._pos = int(uoffsets[block]), b"", 0
+        if self._next_block():
+            self._pos = min(offset - self._offset, len(self._data))
+        return self.tell()
+
+    @property
+    def index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Block offsets of the file, loaded on first use."""
+        if self._index is None:
+            name = getattr(self._handle, "name", None)
+            if not isinstance(name, (str, Path)):
+                raise io.UnsupportedOperation("seeking needs a BGZF file on disk")
+            self._index = block_index(name)
+        return self._index
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        for future in self._pending:
+            future.cancel()
+        if self._pool is not None:
+            self._pool.shutdown()
+        if self._owned:
+            self._handle.close()
+        super().close()
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+_SUFFIX = ".pkl"
+
+
+def fingerprint(path: Path, content: bool = False) -> list:
+    """
+    Identify a file by path, size and modification time, or by a hash of
+    its content when ``content`` is set.
+    """
+    path = Path(path)
+    stat = path.stat()
+    if content:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return [str(path.resolve()), stat.st_size, digest.hexdigest()]
+    return [str(path.resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+def result_files(result: Any) -> list[Path]:
+    """Files produced by a step result (its output sample and ``files``)."""
+    # Imported here so that cache maintenance does not load numpy
+    from qimba.core.samples import Sample
+    files = [Path(p) for p in getattr(result, "files", None) or []]
+    output = getattr(result, "output", None)
+    if isinstance(output, Sample):
+        files.extend(output.files)
+    return files
+
+
+def input_files(inputs: Any) -> list[Path]:
+    """Files consumed by a step, given what the scheduler hands to it."""
+    from qimba.core.samples import Sample
+    if isinstance(inputs, Sample):
+        return inputs.files
+    if isinstance(inputs, list):
+        return [path for item in inputs for path in result_files(item)]
+    return result_files(inputs)
+
+
+@dataclass
+class CacheEntry:
+    """Summary of one cached step result."""
+    key: str
+    step: str
+    size: int
+    created: float
+    last_used: float
+    path: Path
+
+
+class StepCache:
+    """
+    Content-addressed cache of step results.
+
+    A result is stored under a hash of the step name, its parameters, the
+    fingerprints of its input files and its output directory. Output files
+    are not copied: the entry records their fingerprints and is only reused
+    while they are unchanged on disk. Entries are evicted least recently
+    used first once the cache grows beyond ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: Optional[int] = None,
+        content_hash: bool = False,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+
+    def key(
+        self,
+        step: str,
+        params: dict,
+        inputs: Iterable[Path],
+        output_dir: Path,
+    ) -> str:
+        """Hash everything that determines the result of a step."""
+        data = {
+            "step": step,
+            "params": params,
+            "inputs": [fingerprint(p, self.content_hash) for p in inputs],
+            "output_dir": str(Path(output_dir).resolve()),
+        }
+        encoded = json.dumps(data, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}{_SUFFIX}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached result, or ``None`` if missing or stale."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                header = pickle.load(f)
+                outputs = header["outputs"]
+                if any(fingerprint(Path(p[0]), self.content_hash) != p for p in outputs):
+                    return None
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+            return None
+        os.utime(path)
+        return result
+
+    def put(self, key: str, step: str, result: Any) -> None:
+        """Store a step result and evict old entries if needed."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = {
+            "step": step,
+            "created": time.time(),
+            "outputs": [fingerprint(p, self.content_hash) for p in result_files(result)],
+        }
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def entries(self) -> list[CacheEntry]:
+        """All cache entries, least recently used first."""
+        entries = []
+        for path in self.root.glob(f"*/*{_SUFFIX}"):
+            try:
+                stat = path.stat()
+                with open(path, "rb") as f:
+                    header = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            entries.append(CacheEntry(
+                key=path.stem,
+                step=header.get("step", "?"),
+                size=stat.st_size,
+                created=header.get("created", stat.st_mtime),
+                last_used=stat.st_mtime,
+                path=path,
+            ))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def evict(
+        self,
+        max_bytes: Optional[int] = None,
+        older_than: Optional[float] = None,
+    ) -> tuple[int, int]:
+        """
+        Remove entries unused for ``older_than`` seconds, then the least
+        recently used ones until the cache fits in ``max_bytes``.
+
+        Returns the number of entries removed and the bytes freed.
+        """
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+        now = time.time()
+        removed = freed = 0
+        for entry in entries:
+            expired = older_than is not None and now - entry.last_used > older_than
+            too_big = max_bytes is not None and total > max_bytes
+            if not (expired or too_big):
+                continue
+            entry.path.unlink(missing_ok=True)
+            total -= entry.size
+            removed += 1
+            freed += entry.size
+        return removed, freed
+
+    def clear(self) -> tuple[int, int]:
+        """Remove every entry."""
+        return self.evict(max_bytes=0)
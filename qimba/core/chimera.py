@@ -0,0 +1,232 @@
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from qimba.core.derep import read_sized_fasta
+from qimba.core.fastx import ReadBatch
+from qimba.core.table import TABLE_SUFFIX, CountTable
+from qimba.utils.config import DenoiseConfig
+
+# Fewer ASVs than this per worker are not worth a process
+_MIN_PART = 2048
+# Closest parents on each side of a query in sorted order that are compared
+_NEIGHBOURS = 2
+
+
+@dataclass
+class ChimeraResult:
+    """
+    Two-parent chimeras found among ASVs.
+
+    ``parents[i]`` holds the ASVs whose start and end ASV ``i`` is made of
+    (-1 for ASVs that are not chimeric).
+    """
+    chimeric: np.ndarray
+    parents: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.chimeric.sum())
+
+
+@dataclass
+class ChimeraSummary:
+    """Statistics of chimera removal."""
+    asvs: int = 0
+    chimeras: int = 0
+    chimeric_reads: int = 0
+    files: list[Path] = field(default_factory=list)
+
+
+class _SortedIndex:
+    """
+    Parents in lexicographic order of their sequences, or of their
+    reversed sequences for suffixes.
+
+    Among a set of sequences, those sharing the longest prefix with a query
+    are its neighbours in sorted order: the common prefix only shrinks when
+    moving away from where the query would be inserted. The two best
+    distinct parents are thus among the two closest on either side.
+    """
+
+    def __init__(self, keys: list[bytes]):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.order = np.array(order, dtype=np.int64)
+        self.rank = np.empty(len(keys), dtype=np.int64)
+        self.rank[self.order] = np.arange(len(keys))
+        self.present: list[int] = []
+
+    def fill(self, parents: int) -> None:
+        """Hold the first ``parents`` ASVs, by abundance."""
+        self.present = sorted(self.rank[:parents].tolist())
+
+    def add(self, asv: int) -> None:
+        bisect.insort(self.present, int(self.rank[asv]))
+
+    def neighbours(self, query: int) -> list[int]:
+        i = bisect.bisect_left(self.present, int(self.rank[query]))
+        ranks = self.present[max(0, i - _NEIGHBOURS):i + _NEIGHBOURS]
+        return self.order[ranks].tolist()
+
+
+def _common_lengths(matrix: np.ndarray, candidates: list[int], sequence: np.ndarray) -> np.ndarray:
+    """Leading positions of each candidate row that match ``sequence``."""
+    differ = matrix[candidates, :len(sequence)] != sequence
+    return np.where(differ.any(axis=1), differ.argmax(axis=1), len(sequence))
+
+
+class ChimeraDetector:
+    """
+    De novo detection of two-parent chimeras (bimeras) among ASVs, by exact
+    matching.
+
+    An ASV is chimeric when a prefix of it is a prefix of one ASV and the
+    rest is a suffix of another, without any mismatch, both parents being
+    at least ``min_fold`` times as abundant and neither sharing the whole
+    ASV as a prefix or suffix. Unlike DADA2's ``isBimeraDenovo``, parents
+    are not aligned: a chimera whose parents differ from it by an indel or
+    a substitution (or are shifted relative to it) is not found.
+
+    Rather than comparing every ASV with all more abundant ones, parents
+    are looked up in sorted indexes of the sequences and of their
+    reverses, which give the parents sharing the longest prefix and suffix
+    in logarithmic time; under exact matching, evaluating only these few
+    crossover models finds the same chimeras as comparing all pairs. ASVs
+    are judged independently, so with ``workers > 1`` they are split
+    between processes.
+    """
+
+    def __init__(self, min_fold: float = 2.0, workers: int = 1):
+        self.min_fold = min_fold
+        self.workers = max(1, workers)
+
+    @classmethod
+    def from_config(cls, denoise: DenoiseConfig, workers: int = 1) -> "ChimeraDetector":
+        return cls(min_fold=denoise.chimera_min_fold, workers=workers)
+
+    def detect(self, asvs: ReadBatch, abundances: np.ndarray) -> ChimeraResult:
+        """Flag the chimeric ASVs of a batch with the given abundances."""
+        n = len(asvs)
+        order = np.argsort(-abundances, kind="stable")
+        batch = asvs.take(order)
+        ranked = np.asarray(abundances, dtype=np.float64)[order]
+        parts = min(self.workers, max(1, n // _MIN_PART))
+        bounds = np.linspace(0, n, parts + 1).astype(int)
+        if parts == 1:
+            outcomes = [self._detect_range(batch, ranked, 0, n)]
+        else:
+            with ProcessPoolExecutor(max_workers=parts) as pool:
+                futures = [
+                    pool.submit(self._detect_range, batch, ranked, int(start), int(stop))
+                    for start, stop in zip(bounds[:-1], bounds[1:])
+                ]
+                outcomes = [future.result() for future in futures]
+
+        parents = np.concatenate(outcomes) if outcomes else np.full((0, 2), -1, dtype=np.int64)
+        # Back from abundance ranks to the order of the input
+        chimeric = np.zeros(n, dtype=bool)
+        chimeric[order] = parents[:, 0] >= 0
+        result = np.full((n, 2), -1, dtype=np.int64)
+        result[order] = np.where(parents >= 0, order[parents.clip(0)], -1)
+        return ChimeraResult(chimeric=chimeric, parents=result)
+
+    def _detect_range(
+        self,
+        batch: ReadBatch,
+        abundances: np.ndarray,
+        start: int,
+        stop: int,
+    ) -> np.ndarray:
+        """Parents of ASVs ``start`` to ``stop``, sorted by decreasing abundance."""
+        found = np.full((stop - start, 2), -1, dtype=np.int64)
+        if stop <= start:
+            return found
+        # ASVs at least min_fold times as abundant as each query
+        limits = np.minimum(
+            np.searchsorted(-abundances, -self.min_fold * abundances[start:stop], side="right"),
+            np.arange(start, stop),
+        )
+        sequences = [batch.seq(i) for i in range(len(batch))]
+        prefixes = _SortedIndex(sequences)
+        suffixes = _SortedIndex([sequence[::-1] for sequence in sequences])
+        left, right = _aligned_rows(batch)
+        width = left.shape[1]
+        parents = int(limits[0])
+        prefixes.fill(parents)
+        suffixes.fill(parents)
+
+        for j, limit in enumerate(limits.tolist()):
+            for asv in range(parents, limit):
+                prefixes.add(asv)
+                suffixes.add(asv)
+            parents = max(parents, limit)
+            if limit < 2:
+                continue
+            query = start + j
+            sequence = left[query, :batch.seq_offsets[query + 1] - batch.seq_offsets[query]]
+            length = len(sequence)
+            heads = prefixes.neighbours(query)
+            tails = suffixes.neighbours(query)
+            prefix = _common_lengths(left, heads, sequence)
+            suffix = _common_lengths(right[:, ::-1], tails, sequence[::-1])
+            if prefix.max() >= length or suffix.max() >= length:
+                # Part of a single parent, e.g. a truncated read
+                continue
+            # Best two-parent model, with distinct parents
+            coverage = prefix[:, None] + suffix[None, :]
+            coverage[np.equal.outer(heads, tails)] = -1
+            a, b = np.unravel_index(np.argmax(coverage), coverage.shape)
+            if coverage[a, b] >= length:
+                found[j] = heads[a], tails[b]
+        return found
+
+
+def _aligned_rows(batch: ReadBatch) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The sequences as the rows of two matrices, one with them starting at the
+    first column and one with them ending at the last, padded with zeros.
+    """
+    lengths = batch.lengths
+    width = max(1, int(lengths.max(initial=0)))
+    left = np.zeros((len(batch), width), dtype=np.uint8)
+    right = np.zeros((len(batch), width), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(batch)), lengths)
+    position = np.arange(len(batch.seqs)) - np.repeat(batch.seq_offsets[:-1], lengths)
+    left[rows, position] = batch.seqs
+    right[rows, position + np.repeat(width - lengths, lengths)] = batch.seqs
+    return left, right
+
+
+def remove_chimeras(
+    asv_path: Path,
+    table_path: Path,
+    output_dir: Path,
+    detector: ChimeraDetector,
+) -> ChimeraSummary:
+    """
+    Detect chimeras among the ASVs of a FASTA file and write the remaining
+    ASVs, the chimeras and the count table without them to ``output_dir``.
+    """
+    asvs, abundances = read_sized_fasta(asv_path)
+    result = detector.detect(asvs, abundances)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "asvs.fasta", "wb") as out:
+        out.write(asvs.take(~result.chimeric).to_fasta())
+    with open(output_dir / "chimeras.fasta", "wb") as out:
+        out.write(asvs.take(result.chimeric).to_fasta())
+
+    chimeras = {
+        asvs.name(i).split(b";")[0].decode() for i in np.flatnonzero(result.chimeric).tolist()
+    }
+    table = CountTable.load(table_path)
+    keep = np.array([o not in chimeras for o in table.observations], dtype=bool)
+    table_output = output_dir / f"asv_table{TABLE_SUFFIX}"
+    table.take_observations(keep).save(table_output)
+    return ChimeraSummary(
+        asvs=len(asvs) - len(result),
+        chimeras=len(result),
+        chimeric_reads=int(abundances[result.chimeric].sum()),
+        files=[output_dir / "asvs.fasta", output_dir / "chimeras.fasta", table_output],
+    )
@@ -0,0 +1,299 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from qimba.core.derep import Dereplicator, DerepResult, read_sized_fasta
+from qimba.core.fastx import (
+    FastxReader, ReadBatch, _offsets, fastx_stem, open_output, output_name, write_batch,
+)
+from qimba.core.filters import ExpectedErrorFilter, FilterStats
+from qimba.core.index import MmapFastq, join_parts, part_path, plan_chunks
+from qimba.core.table import TABLE_SUFFIX, CountTable
+from qimba.core.unoise import AsvResult, Unoise
+from qimba.utils.config import DenoiseConfig
+
+# ASV of every retained unique (in uniques.fasta order), kept so that
+# later samples can be added to the run
+UNIQUE_ASVS = "unique_asvs.npy"
+# Uniques below min_reads so far, with their reads in all samples so far,
+# so that later samples can still take them past the threshold
+PENDING_UNIQUES = "pending_uniques.fasta"
+
+
+@dataclass
+class DenoiseSummary:
+    """Statistics collected by the native denoising engine."""
+    filter_stats: FilterStats = field(default_factory=FilterStats)
+    samples: dict[str, FilterStats] = field(default_factory=dict)
+    uniques: int = 0
+    uniques_retained: int = 0
+    asvs: int = 0
+    table_reads: int = 0
+    files: list[Path] = field(default_factory=list)
+
+
+def _sized(uniques: ReadBatch, sizes: np.ndarray, first: int = 0) -> ReadBatch:
+    """Uniques labelled ``Uniq<n>;size=<reads>``, numbered after ``first``."""
+    labels = [b"Uniq%d;size=%d" % (first + i + 1, size) for i, size in enumerate(sizes.tolist())]
+    uniques.names = np.frombuffer(b"".join(labels), dtype=np.uint8)
+    uniques.name_offsets = _offsets(np.array([len(label) for label in labels], dtype=np.int64))
+    return uniques
+
+
+class Denoiser:
+    """
+    In-process denoising engine driven by ``DenoiseConfig``.
+    """
+
+    def __init__(
+        self,
+        config: DenoiseConfig,
+        temp_dir: Optional[Path] = None,
+        compression_level: int = 0,
+    ):
+        self.config = config
+        self.temp_dir = temp_dir
+        self.compression_level = compression_level
+        self.ee_filter = ExpectedErrorFilter.from_config(config)
+
+    def new_dereplicator(self) -> Dereplicator:
+        return Dereplicator(
+            max_memory=self.config.derep_memory_mb * 1024 * 1024,
+            spill_dir=self.temp_dir,
+        )
+
+    def filter_batches(
+        self,
+        batches: Iterable[ReadBatch],
+        output_path: Optional[Path],
+        dereplicator: Dereplicator,
+        sample: str,
+        threads: int = 1,
+    ) -> FilterStats:
+        """
+        Expected-error filter batches of reads and count the passing ones in
+        the dereplicator, also writing them unless ``output_path`` is None.
+        """
+        stats = FilterStats()
+        output = (
+            nullcontext() if output_path is None
+            else open_output(output_path, self.compression_level, threads)
+        )
+        with output as out:
+            for batch in batches:
+                passed = self.ee_filter.apply(batch, stats)
+                if out is not None:
+                    write_batch(out, passed)
+                dereplicator.add_batch(passed, sample)
+        return stats
+
+    def process_range(
+        self,
+        input_path: Path,
+        output_path: Path,
+        sample: str,
+        start: int,
+        stop: int,
+        index_dir: Optional[Path] = None,
+    ) -> tuple[FilterStats, DerepResult]:
+        """Filter and dereplicate reads ``start`` to ``stop`` of an indexed file."""
+        dereplicator = self.new_dereplicator()
+        with MmapFastq(input_path, index_dir) as reader:
+            stats = self.filter_batches(
+                reader.batches(start, stop), output_path, dereplicator, sample
+            )
+        return stats, dereplicator.finish()
+
+    def process_sample(
+        self,
+        input_path: Path,
+        output_dir: Path,
+        dereplicator: Dereplicator,
+        sample: Optional[str] = None,
+        workers: int = 1,
+        index_dir: Optional[Path] = None,
+    ) -> FilterStats:
+        """
+        Expected-error filter one sample file, write the passing reads and
+        count them in the dereplicator, all in a single pass.
+
+        With several ``workers``, a large uncompressed FASTQ file is indexed
+        and split into chunks processed in parallel, whose uniques are then
+        merged into the dereplicator; otherwise they (de)compress BGZF blocks.
+        """
+        sample = sample or fastx_stem(input_path)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_path = output_dir / output_name(input_path, compressed=bool(self.compression_level))
+        chunks = plan_chunks((input_path,), workers, index_dir)
+        if chunks is None:
+            return self.filter_batches(
+                FastxReader(input_path, threads=workers), output_path, dereplicator, sample, workers
+            )
+        # Workers share the sample's dereplication memory budget
+        config = self.config.model_copy(update={
+            "derep_memory_mb": max(1, self.config.derep_memory_mb // len(chunks)),
+        })
+        worker = Denoiser(config, temp_dir=self.temp_dir, compression_level=self.compression_level)
+        stats = FilterStats()
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [
+                pool.submit(
+                    worker.process_range,
+                    input_path,
+                    part_path(output_path, part),
+                    sample,
+                    start,
+                    stop,
+                    index_dir,
+                )
+                for part, (start, stop) in enumerate(chunks)
+            ]
+            for future in futures:
+                part_stats, uniques = future.result()
+                stats += part_stats
+                uniques.add_to(dereplicator)
+        join_parts(output_path, len(chunks))
+        return stats
+
+    def dereplicate(
+        self,
+        dereplicator: Dereplicator,
+        output_dir: Path,
+        summary: DenoiseSummary,
+    ) -> DerepResult:
+        """
+        Collect the uniques, drop those below ``min_reads`` and write them.
+        The dropped ones are written to ``PENDING_UNIQUES``.
+        """
+        uniques = dereplicator.finish()
+        kept = uniques.abundances >= self.config.min_reads
+        retained = uniques.take(kept)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        retained.write_fasta(output_dir / "uniques.fasta")
+        uniques.take(~kept).write_fasta(output_dir / PENDING_UNIQUES)
+        summary.files += [output_dir / "uniques.fasta", output_dir / PENDING_UNIQUES]
+        summary.uniques = len(uniques)
+        summary.uniques_retained = len(retained)
+        return retained
+
+    def find_asvs(
+        self,
+        uniques: DerepResult,
+        output_dir: Path,
+        summary: DenoiseSummary,
+    ) -> AsvResult:
+        """
+        Denoise the retained uniques into ASVs and write them with their
+        sample-by-ASV count table.
+        """
+        result = Unoise.from_config(self.config).run(uniques)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        result.write_fasta(output_dir / "asvs.fasta")
+        np.save(output_dir / UNIQUE_ASVS, result.assignments)
+        table = CountTable.from_asvs(result)
+        table.save(output_dir / f"asv_table{TABLE_SUFFIX}")
+        summary.files += [
+            output_dir / "asvs.fasta",
+            output_dir / UNIQUE_ASVS,
+            output_dir / f"asv_table{TABLE_SUFFIX}",
+        ]
+        summary.asvs = len(result)
+        summary.table_reads = table.total
+        return result
+
+    def extend_asvs(
+        self,
+        uniques: DerepResult,
+        output_dir: Path,
+        summary: DenoiseSummary,
+    ) -> AsvResult:
+        """
+        Add the uniques of new samples to the ASVs and count table written
+        to ``output_dir`` by an earlier run.
+
+        Uniques that run retained keep their ASV whatever their abundance in
+        the new samples. Only the others are denoised, against the existing
+        ASVs (weighted by all their reads so far), joining them or making
+        new ASVs numbered after them. Their reads in earlier samples, kept
+        in ``PENDING_UNIQUES``, count towards ``min_reads`` and the ASV
+        abundances, though the count table gains only the new samples.
+        """
+        known, _ = read_sized_fasta(output_dir / "uniques.fasta")
+        known_asvs = np.load(output_dir / UNIQUE_ASVS)
+        asvs, asv_abundances = read_sized_fasta(output_dir / "asvs.fasta")
+        lookup = {known.seq(i): asv for i, asv in enumerate(known_asvs.tolist()) if asv >= 0}
+        lookup.update((asvs.seq(j), j) for j in range(len(asvs)))
+        mapped = np.array(
+            [lookup.get(uniques.uniques.seq(i), -1) for i in range(len(uniques))], dtype=np.int64
+        )
+        is_known = mapped >= 0
+        asv_abundances = asv_abundances + np.bincount(
+            mapped[is_known], weights=uniques.abundances[is_known], minlength=len(asvs)
+        ).astype(np.int64)
+
+        # Other uniques are denoised with their reads in earlier samples
+        pending = {}
+        if (output_dir / PENDING_UNIQUES).exists():
+            earlier, earlier_sizes = read_sized_fasta(output_dir / PENDING_UNIQUES)
+            pending = {earlier.seq(i): size for i, size in enumerate(earlier_sizes.tolist())}
+        new = np.flatnonzero(~is_known)
+        totals = uniques.abundances[new] + np.array(
+            [pending.pop(uniques.uniques.seq(i), 0) for i in new.tolist()], dtype=np.int64
+        )
+        order = np.argsort(-totals, kind="stable")
+        new, totals = new[order], totals[order]
+        empty = np.zeros(0, dtype=np.int64)
+        result = Unoise.from_config(self.config).run(
+            DerepResult(uniques.uniques.take(new), totals, uniques.samples, empty, empty, empty),
+            seeds=asvs,
+            seed_abundances=asv_abundances,
+        )
+        assignments = mapped
+        assignments[new] = result.assignments
+        result = replace(result, assignments=assignments, uniques=uniques)
+        result.write_fasta(output_dir / "asvs.fasta")
+
+        # Newly retained uniques are recorded for the next extension, the
+        # rest stay pending with those not seen in the new samples
+        retained = result.assignments[new] >= 0
+        added = _sized(uniques.uniques.take(new[retained]), totals[retained], len(known))
+        with open(output_dir / "uniques.fasta", "wb") as out:
+            out.write(ReadBatch.concat([known, added]).to_fasta())
+        np.save(output_dir / UNIQUE_ASVS, np.concatenate((known_asvs, assignments[new[retained]])))
+        left = ReadBatch.from_records((b"", seq, None) for seq in pending)
+        left = ReadBatch.concat([uniques.uniques.take(new[~retained]), left])
+        sizes = np.concatenate((totals[~retained], np.array(list(pending.values()), dtype=np.int64)))
+        order = np.argsort(-sizes, kind="stable")
+        with open(output_dir / PENDING_UNIQUES, "wb") as out:
+            out.write(_sized(left.take(order), sizes[order]).to_fasta())
+
+        table_path = output_dir / f"asv_table{TABLE_SUFFIX}"
+        table = CountTable.merge([CountTable.load(table_path), CountTable.from_asvs(result)])
+        table.save(table_path)
+        summary.files += [
+            output_dir / "uniques.fasta",
+            output_dir / PENDING_UNIQUES,
+            output_dir / "asvs.fasta",
+            output_dir / UNIQUE_ASVS,
+            table_path,
+        ]
+        summary.uniques = len(uniques)
+        summary.uniques_retained = int(np.count_nonzero(assignments >= 0))
+        summary.asvs = len(result)
+        summary.table_reads = table.total
+        return result
+
+    def run(self, input_files: list[Path], output_dir: Path) -> DenoiseSummary:
+        """Run all native denoising steps over the given sample files."""
+        summary = DenoiseSummary()
+        dereplicator = self.new_dereplicator()
+        for path in input_files:
+            stats = self.process_sample(path, output_dir / "filtered", dereplicator)
+            summary.samples[fastx_stem(path)] = stats
+            summary.filter_stats += stats
+        self.find_asvs(self.dereplicate(dereplicator, output_dir, summary), output_dir, summary)
+        return summary
@@ -0,0 +1,390 @@
+import heapq
+import pickle
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from qimba.core.fastx import FastxReader, ReadBatch, fastx_stem, ragged_take
+
+# 2-bit codes for (upper- and lower-case) nucleotides; 255 marks anything else
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+    _CODES[_base] = _code
+    _CODES[_base | 0x20] = _code
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+# Key prefixes: 2-bit packed ACGT sequences, or raw bytes for anything else
+_PACKED = b"\x00"
+_RAW = b"\x01"
+
+# Rough per-entry overhead of the hash index (dict slot, bytes header, int)
+_ENTRY_OVERHEAD = 120
+_SPILL_CHUNK = 10000
+
+_SIZE = re.compile(rb";size=(\d+)")
+
+
+def _packed_rows(batch: ReadBatch) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode every read of a batch as a fixed-width row: a 4-byte big-endian
+    length followed by the 2-bit packed bases (4 per byte).
+
+    Returns the rows and a mask of reads that contain only ACGT.
+    """
+    n = len(batch)
+    lengths = batch.lengths
+    codes = np.take(_CODES, batch.seqs)
+    invalid = np.zeros(n, dtype=bool)
+    bad = np.flatnonzero(codes == 255)
+    if len(bad):
+        invalid[np.searchsorted(batch.seq_offsets, bad, side="right") - 1] = True
+
+    width = (int(lengths.max()) + 3) // 4 if n else 0
+    if np.all(lengths == width * 4):
+        # Common amplicon case: equal read lengths that need no padding
+        padded = codes & 3
+    else:
+        padded = np.zeros(n * width * 4, dtype=np.uint8)
+        shift = np.repeat(np.arange(n, dtype=np.int64) * width * 4 - batch.seq_offsets[:-1], lengths)
+        padded[np.arange(len(codes), dtype=np.int64) + shift] = codes & 3
+    quads = padded.reshape(n, width, 4)
+    packed = (quads[:, :, 0] << 6) | (quads[:, :, 1] << 4) | (quads[:, :, 2] << 2) | quads[:, :, 3]
+
+    header = lengths.astype(">u4").view(np.uint8).reshape(n, 4)
+    return np.ascontiguousarray(np.concatenate([header, packed], axis=1)), ~invalid
+
+
+def _unpack(keys: list[bytes]) -> ReadBatch:
+    """Decode dereplication keys back into a batch of sequences."""
+    packed = [k for k in keys if k[:1] == _PACKED]
+    raw = [k[1:] for k in keys if k[:1] == _RAW]
+    # Packed keys: decode all of them at once
+    lengths = np.array([int.from_bytes(k[1:5], "big") for k in packed], dtype=np.int64)
+    data = np.frombuffer(b"".join(k[5:] for k in packed), dtype=np.uint8)
+    codes = np.stack([(data >> 6) & 3, (data >> 4) & 3, (data >> 2) & 3, data & 3], axis=1).ravel()
+    padded = (lengths + 3) // 4 * 4
+    seqs = _BASES[ragged_take(codes, np.cumsum(padded) - padded, lengths)]
+
+    # Keep the original key order
+    is_packed = np.array([k[:1] == _PACKED for k in keys], dtype=bool)
+    all_lengths = np.zeros(len(keys), dtype=np.int64)
+    all_lengths[is_packed] = lengths
+    all_lengths[~is_packed] = [len(r) for r in raw]
+    raw_buf = np.frombuffer(b"".join(raw), dtype=np.uint8)
+    source = np.concatenate([seqs, raw_buf])
+    source_start = np.zeros(len(keys), dtype=np.int64)
+    source_start[is_packed] = np.cumsum(lengths) - lengths
+    raw_lengths = all_lengths[~is_packed]
+    source_start[~is_packed] = len(seqs) + np.cumsum(raw_lengths) - raw_lengths
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(all_lengths, out=offsets[1:])
+    empty = np.zeros(len(keys) + 1, dtype=np.int64)
+    return ReadBatch(
+        names=np.empty(0, dtype=np.uint8),
+        name_offsets=empty,
+        seqs=ragged_take(source, source_start, all_lengths),
+        seq_offsets=offsets,
+        quals=None,
+    )
+
+
+def read_sized_fasta(path: Path) -> tuple[ReadBatch, np.ndarray]:
+    """Sequences of a FASTA file with their usearch-style ``;size=`` abundances."""
+    batch = ReadBatch.concat(FastxReader(path))
+    abundances = np.array([
+        int(match.group(1)) if (match := _SIZE.search(batch.name(i))) else 1
+        for i in range(len(batch))
+    ], dtype=np.int64)
+    return batch, abundances
+
+
+@dataclass
+class DerepResult:
+    """
+    Unique sequences with their total and per-sample abundances.
+
+    Uniques are sorted by decreasing abundance. Per-sample counts are kept
+    in coordinate form: ``count_values[i]`` reads of unique
+    ``count_uniques[i]`` were seen in sample ``samples[count_samples[i]]``.
+    """
+    uniques: ReadBatch
+    abundances: np.ndarray
+    samples: list[str]
+    count_samples: np.ndarray
+    count_uniques: np.ndarray
+    count_values: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.abundances)
+
+    @property
+    def total_reads(self) -> int:
+        return int(self.abundances.sum())
+
+    def filter(self, min_abundance: int) -> "DerepResult":
+        """Drop uniques seen fewer than ``min_abundance`` times in total."""
+        return self.take(self.abundances >= min_abundance)
+
+    def take(self, keep: np.ndarray) -> "DerepResult":
+        """The uniques where ``keep`` is set, with their per-sample counts."""
+        new_index = np.cumsum(keep) - 1
+        entries = keep[self.count_uniques]
+        return DerepResult(
+            uniques=self.uniques.take(keep),
+            abundances=self.abundances[keep],
+            samples=self.samples,
+            count_samples=self.count_samples[entries],
+            count_uniques=new_index[self.count_uniques[entries]],
+            count_values=self.count_values[entries],
+        )
+
+    def sample_counts(self, sample: str) -> tuple[np.ndarray, np.ndarray]:
+        """Unique indices and counts observed in one sample."""
+        entries = self.count_samples == self.samples.index(sample)
+        return self.count_uniques[entries], self.count_values[entries]
+
+    def add_to(self, dereplicator: "Dereplicator") -> None:
+        """Feed these uniques, sample by sample, into another dereplicator."""
+        for sample_id, sample in enumerate(self.samples):
+            entries = self.count_samples == sample_id
+            dereplicator.add_batch(
+                self.uniques.take(self.count_uniques[entries]),
+                sample,
+                counts=self.count_values[entries],
+            )
+
+    def write_fasta(self, path: Path) -> None:
+        """Write the uniques with usearch-style ``;size=`` annotations."""
+        with open(path, "wb") as out:
+            out.write(self.uniques.to_fasta())
+
+
+class Dereplicator:
+    """
+    Streaming dereplicator with a hash index of compactly encoded sequences.
+
+    Pure ACGT sequences are stored 2-bit packed, anything else as raw bytes.
+    Reads are first collapsed within each batch with a vectorised
+    ``np.unique`` on the packed rows, so the Python-level hash index is only
+    touched once per distinct sequence of a batch. Per-sample counts are
+    tracked alongside the totals. When the estimated index size exceeds
+    ``max_memory`` bytes, the index is written to a sorted run in
+    ``spill_dir`` and the runs are merged when ``finish`` is called.
+    """
+
+    def __init__(
+        self,
+        max_memory: Optional[int] = None,
+        spill_dir: Optional[Path] = None,
+    ):
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.samples: list[str] = []
+        self.reads = 0
+        self._index: dict[bytes, int] = {}
+        self._keys: list[bytes] = []
+        self._entries: list[tuple[int, np.ndarray, np.ndarray]] = []
+        self._memory = 0
+        self._runs: list[Path] = []
+        self._run_entries: list[int] = []
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None
+
+    def _sample_id(self, sample: str) -> int:
+        if sample not in self.samples:
+            self.samples.append(sample)
+        return self.samples.index(sample)
+
+    def _lookup(self, key: bytes) -> int:
+        uid = self._index.get(key)
+        if uid is None:
+            uid = len(self._keys)
+            self._index[key] = uid
+            self._keys.append(key)
+            self._memory += len(key) + _ENTRY_OVERHEAD
+        return uid
+
+    def add_batch(
+        self,
+        batch: ReadBatch,
+        sample: str,
+        counts: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Count the reads of a batch for the given sample.
+
+        ``counts`` optionally gives the multiplicity of every read, e.g. when
+        adding the uniques of an already dereplicated sample.
+        """
+        if not len(batch):
+            return
+        sample_id = self._sample_id(sample)
+        weights = np.ones(len(batch), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        rows, packable = _packed_rows(batch)
+        row_bytes = rows.shape[1]
+        uids = []
+        totals = []
+
+        if packable.any():
+            view = rows[packable].view(np.dtype((np.void, row_bytes))).ravel()
+            distinct, first, inverse = np.unique(view, return_index=True, return_inverse=True)
+            totals.append(np.bincount(inverse.ravel(), weights=weights[packable]).astype(np.int64))
+            key_lengths = 4 + (batch.lengths[packable][first] + 3) // 4
+            data = distinct.tobytes()
+            for i, size in enumerate(key_lengths.tolist()):
+                start = i * row_bytes
+                uids.append(self._lookup(_PACKED + data[start:start + size]))
+
+        for i in np.flatnonzero(~packable).tolist():
+            uids.append(self._lookup(_RAW + batch.seq(i).upper()))
+            totals.append(weights[i:i + 1])
+
+        uids = np.array(uids, dtype=np.int64)
+        totals = np.concatenate(totals)
+        self._entries.append((sample_id, uids, totals))
+        self._memory += uids.nbytes + totals.nbytes
+        self.reads += int(weights.sum())
+        if self.max_memory is not None and self._memory > self.max_memory:
+            self._spill()
+
+    def add_file(self, path: Path, sample: Optional[str] = None) -> None:
+        """Count every read of a FASTA/FASTQ file."""
+        sample = sample or fastx_stem(path)
+        for batch in FastxReader(path):
+            self.add_batch(batch, sample)
+
+    def _consolidate(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Merge buffered entries into sorted (sample, unique, count) arrays."""
+        if not self._entries:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        samples = np.concatenate([np.full(len(u), s, dtype=np.int64) for s, u, _ in self._entries])
+        uids = np.concatenate([u for _, u, _ in self._entries])
+        counts = np.concatenate([c for _, _, c in self._entries])
+        combined = uids * len(self.samples) + samples
+        keys, inverse = np.unique(combined, return_inverse=True)
+        totals = np.bincount(inverse, weights=counts).astype(np.int64)
+        return keys % len(self.samples), keys // len(self.samples), totals
+
+    def _spill(self) -> None:
+        """Write the in-memory index to a run sorted by key and reset it."""
+        if not self._keys:
+            return
+        if self._tmp is None:
+            if self.spill_dir is not None:
+                Path(self.spill_dir).mkdir(parents=True, exist_ok=True)
+            self._tmp = tempfile.TemporaryDirectory(prefix="qimba-derep-", dir=self.spill_dir)
+        sample_ids, uids, counts = self._consolidate()
+        order = np.argsort(uids, kind="stable")
+        sample_ids, uids, counts = sample_ids[order], uids[order], counts[order]
+        bounds = np.searchsorted(uids, np.arange(len(self._keys) + 1))
+
+        path = Path(self._tmp.name) / f"run{len(self._runs)}.pkl"
+        with open(path, "wb") as out:
+            chunk = []
+            for uid in sorted(range(len(self._keys)), key=self._keys.__getitem__):
+                lo, hi = bounds[uid], bounds[uid + 1]
+                chunk.append((self._keys[uid], sample_ids[lo:hi].tolist(), counts[lo:hi].tolist()))
+                if len(chunk) == _SPILL_CHUNK:
+                    pickle.dump(chunk, out, protocol=pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                pickle.dump(chunk, out, protocol=pickle.HIGHEST_PROTOCOL)
+        self._runs.append(path)
+        self._run_entries.append(len(uids))
+        self._index.clear()
+        self._keys = []
+        self._entries = []
+        self._memory = 0
+
+    @staticmethod
+    def _read_run(path: Path) -> Iterator[tuple[bytes, list[int], list[int]]]:
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield from pickle.load(f)
+                except EOFError:
+                    return
+
+    def _merge_runs(self) -> tuple[list[bytes], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        K-way merge of the sorted runs, streamed into (sample, unique, count)
+        arrays sized for the entries of all runs. Entries are buffered and
+        summed per (unique, sample) a chunk at a time, so that only the keys
+        are held as Python objects for the whole merge.
+        """
+        size = sum(self._run_entries)
+        sample_ids = np.empty(size, dtype=np.int64)
+        uids = np.empty(size, dtype=np.int64)
+        counts = np.empty(size, dtype=np.int64)
+        filled = 0
+        sample_parts: list[int] = []
+        unique_parts: list[int] = []
+        count_parts: list[int] = []
+
+        def flush() -> None:
+            nonlocal filled
+            # Runs may hold the same key for the same sample
+            combined = np.array(unique_parts, dtype=np.int64) * len(self.samples)
+            combined += np.array(sample_parts, dtype=np.int64)
+            merged, inverse = np.unique(combined, return_inverse=True)
+            end = filled + len(merged)
+            sample_ids[filled:end] = merged % len(self.samples)
+            uids[filled:end] = merged // len(self.samples)
+            counts[filled:end] = np.bincount(inverse, weights=count_parts)
+            filled = end
+            sample_parts.clear()
+            unique_parts.clear()
+            count_parts.clear()
+
+        keys = []
+        current = None
+        runs = [self._read_run(path) for path in self._runs]
+        for key, run_samples, run_counts in heapq.merge(*runs, key=lambda record: record[0]):
+            if key != current:
+                # Chunks end between keys, so no (unique, sample) spans two
+                if len(count_parts) >= _SPILL_CHUNK:
+                    flush()
+                current = key
+                keys.append(key)
+            sample_parts.extend(run_samples)
+            unique_parts.extend([len(keys) - 1] * len(run_samples))
+            count_parts.extend(run_counts)
+        flush()
+        return keys, sample_ids[:filled], uids[:filled], counts[:filled]
+
+    def finish(self) -> DerepResult:
+        """Merge everything seen so far into a ``DerepResult``."""
+        if self._runs:
+            self._spill()
+            keys, sample_ids, uids, counts = self._merge_runs()
+            self._tmp.cleanup()
+            self._tmp = None
+            self._runs = []
+            self._run_entries = []
+        else:
+            keys = self._keys
+            sample_ids, uids, counts = self._consolidate()
+
+        abundances = np.bincount(uids, weights=counts, minlength=len(keys)).astype(np.int64)
+        order = np.argsort(-abundances, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        uniques = _unpack([keys[i] for i in order.tolist()])
+        abundances = abundances[order]
+
+        labels = [b"Uniq%d;size=%d" % (i + 1, size) for i, size in enumerate(abundances.tolist())]
+        uniques.names = np.frombuffer(b"".join(labels), dtype=np.uint8)
+        uniques.name_offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum([len(label) for label in labels], out=uniques.name_offsets[1:])
+        return DerepResult(
+            uniques=uniques,
+            abundances=abundances,
+            samples=list(self.samples),
+            count_samples=sample_ids,
+            count_uniques=rank[uids] if len(uids) else uids,
+            count_values=counts,
+        )
@@ -1,37 +1,189 @@
+import asyncio
+import os
 import subprocess
+import threading
+from collections import deque
+from contextlib import ExitStack, nullcontext
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Awaitable, BinaryIO, Callable, Iterable, Iterator, Optional, Dict, Any, Union
 from rich.console import Console
 
 from qimba.utils.config import Config
+from qimba.core.profiling import Probe, record
+from qimba.core.resources import Reservation, ResourceManager, shared_resources
 
 console = Console()
 
+# Bytes of stdout/stderr kept in memory for error reporting when streaming
+DEFAULT_TAIL_BYTES = 64 * 1024
+_CHUNK_SIZE = 64 * 1024
+
+# Where streamed stdout goes: a file path, a binary file object or a callback
+OutputSink = Union[Path, BinaryIO, Callable[[bytes], None]]
+
 @dataclass
 class ExecutionResult:
-    """Contains the result of an external command execution."""
+    """
+    Contains the result of an external command execution.
+    
+    When the command was streamed, ``output`` only holds the tail of its
+    stdout and the full streams are in ``stdout_log``/``stderr_log``.
+    """
     success: bool
     error: Optional[str] = None
     output: Optional[str] = None
+    returncode: Optional[int] = None
+    stdout_log: Optional[Path] = None
+    stderr_log: Optional[Path] = None
+
+class TailBuffer:
+    """
+    Ring buffer keeping the last ``max_bytes`` bytes written to it.
+    """
+    
+    def __init__(self, max_bytes: int = DEFAULT_TAIL_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._chunks: deque[bytes] = deque()
+        
+    def write(self, data: bytes) -> None:
+        if self.max_bytes <= 0 or not data:
+            return
+        data = bytes(data[-self.max_bytes:])
+        self._chunks.append(data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            excess = self.size - self.max_bytes
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self.size -= len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self.size -= excess
+                
+    def getvalue(self) -> bytes:
+        return b"".join(self._chunks)
+        
+    def text(self) -> str:
+        """The tail decoded as text, starting at the first complete line."""
+        data = self.getvalue()
+        if self.size >= self.max_bytes and b"\n" in data[:-1]:
+            data = data[data.index(b"\n") + 1:]
+        return data.decode("utf-8", errors="replace")
+
+def _read_tail(path: Path, max_bytes: int) -> TailBuffer:
+    """Load the last ``max_bytes`` of a file into a ``TailBuffer``."""
+    tail = TailBuffer(max_bytes)
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        f.seek(max(0, f.tell() - max_bytes))
+        tail.write(f.read())
+    return tail
+
+def _wait(process: subprocess.Popen) -> tuple[int, Any]:
+    """Wait for a process and return its exit code and resource usage."""
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped elsewhere: no usage of its own is available
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+def _pump(pipe: BinaryIO, sinks: list[Callable[[bytes], None]]) -> None:
+    """Copy a pipe to every sink in chunks until it is closed."""
+    try:
+        for chunk in iter(lambda: pipe.read1(_CHUNK_SIZE), b""):
+            for sink in sinks:
+                sink(chunk)
+    finally:
+        pipe.close()
+
+@lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    """
+    First line of ``<tool> --version``, or ``"unknown"`` if it cannot be run.
+    """
+    try:
+        result = subprocess.run(
+            [tool, "--version"], capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    lines = (result.stdout or result.stderr).strip().splitlines()
+    return lines[0] if lines else "unknown"
+
+def qc_command(
+    input_dir: Path,
+    output_dir: Path,
+    min_quality: int = 20,
+    threads: int = 1,
+    input_files: Optional[list[Path]] = None
+) -> list[str]:
+    """Command line of the quality control tool."""
+    # Example command - replace with actual QC tool
+    return [
+        "fastqc",  # Replace with actual QC tool
+        "-o", str(output_dir),
+        "-t", str(threads),
+        "-q", str(min_quality),
+        *[str(path) for path in input_files or [input_dir]]
+    ]
+
+def denoise_command(input_dir: Path, output_dir: Path, threads: int = 1) -> list[str]:
+    """Command line of the denoising tool."""
+    # Example command - replace with actual denoising tool
+    return [
+        "denoiser",  # Replace with actual denoising tool
+        "-i", str(input_dir),
+        "-o", str(output_dir),
+        "-t", str(threads)
+    ]
 
 class Executor:
     """
     Handles execution of external bioinformatics tools.
+    
+    Tool runs reserve their threads and memory from ``resources``, by
+    default the budget shared by all executors of the process, unless
+    they are given the ``reservation`` their caller already holds (as
+    pipeline steps do, which the scheduler reserved for).
     """
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, resources: Optional[ResourceManager] = None):
         self.config = config
+        self.resources = resources or shared_resources(config)
         
+    def _reserve(self, reservation: Optional[Reservation], threads: int, memory_mb: int):
+        if reservation is not None:
+            return nullcontext(reservation)
+        return self.resources.reserve(threads, memory_mb)
+
     def _run_command(
         self,
         cmd: list[str],
         check: bool = True,
+        log_prefix: Optional[Path] = None,
+        stdout: Optional[OutputSink] = None,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
         **kwargs
     ) -> ExecutionResult:
         """
         Execute an external command and return the result.
+        
+        With ``log_prefix`` or ``stdout`` the command is streamed: its
+        output is never held in memory as a whole (see ``_stream_command``).
+        Otherwise stdout and stderr are captured as text.
         """
+        if log_prefix is not None or stdout is not None:
+            return self._stream_command(
+                cmd, check=check, log_prefix=log_prefix, stdout=stdout,
+                tail_bytes=tail_bytes, **kwargs
+            )
+        probe = Probe()
         try:
             if self.config.verbose:
                 console.print(f"[blue]Running command: {' '.join(cmd)}[/blue]")
@@ -46,54 +198,408 @@ class Executor:
             
             return ExecutionResult(
                 success=True,
-                output=result.stdout
+                output=result.stdout,
+                returncode=result.returncode
             )
             
         except subprocess.CalledProcessError as e:
             return ExecutionResult(
                 success=False,
-                error=f"Command failed with exit code {e.returncode}: {e.stderr}"
+                error=f"Command failed with exit code {e.returncode}: {e.stderr}",
+                returncode=e.returncode
             )
         except Exception as e:
             return ExecutionResult(
                 success=False,
                 error=str(e)
             )
+        finally:
+            record(probe.finish(Path(cmd[0]).name, "command", children_only=True))
+            
+    def _stream_command(
+        self,
+        cmd: list[str],
+        check: bool = True,
+        log_prefix: Optional[Path] = None,
+        stdout: Optional[OutputSink] = None,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
+        **kwargs
+    ) -> ExecutionResult:
+        """
+        Execute an external command, streaming its output as it arrives.
+        
+        stdout goes to ``stdout`` (a path, a binary file or a callback
+        receiving raw byte chunks), or else to ``<log_prefix>.stdout.log``.
+        stderr goes to ``<log_prefix>.stderr.log`` if a prefix is given.
+        Bytes are passed through untouched; only the last ``tail_bytes`` of
+        each stream are kept in memory and decoded for the result. Files
+        are handed to the child process directly, so output written to
+        them never passes through Python. Callbacks run on a reader thread.
+        """
+        stdout_tail = TailBuffer(tail_bytes)
+        stderr_tail = TailBuffer(tail_bytes)
+        stdout_log = stderr_log = None
+        probe = Probe()
+        try:
+            if self.config.verbose:
+                console.print(f"[blue]Running command: {' '.join(cmd)}[/blue]")
+                
+            with ExitStack() as stack:
+                if log_prefix is not None:
+                    log_prefix = Path(log_prefix)
+                    log_prefix.parent.mkdir(parents=True, exist_ok=True)
+                    stderr_log = Path(f"{log_prefix}.stderr.log")
+                    stderr_target = stack.enter_context(open(stderr_log, "wb"))
+                else:
+                    stderr_target = subprocess.PIPE
+                    
+                if stdout is None and log_prefix is not None:
+                    stdout = stdout_log = Path(f"{log_prefix}.stdout.log")
+                if isinstance(stdout, (str, Path)):
+                    stdout_log = Path(stdout)
+                    stdout_log.parent.mkdir(parents=True, exist_ok=True)
+                    stdout_target = stack.enter_context(open(stdout_log, "wb"))
+                elif stdout is not None and hasattr(stdout, "fileno"):
+                    stdout_target = stdout
+                else:
+                    stdout_target = subprocess.PIPE
+                    
+                process = subprocess.Popen(
+                    cmd, stdout=stdout_target, stderr=stderr_target, **kwargs
+                )
+                readers = []
+                if stdout_target is subprocess.PIPE:
+                    sinks = [stdout_tail.write]
+                    if stdout is not None:
+                        sinks.append(stdout)
+                    readers.append(threading.Thread(target=_pump, args=(process.stdout, sinks)))
+                if stderr_target is subprocess.PIPE:
+                    readers.append(threading.Thread(
+                        target=_pump, args=(process.stderr, [stderr_tail.write])
+                    ))
+                for reader in readers:
+                    reader.start()
+                returncode, usage = _wait(process)
+                for reader in readers:
+                    reader.join()
+                record(probe.finish(Path(cmd[0]).name, "command", usage=usage))
+        except Exception as e:
+            return ExecutionResult(
+                success=False,
+                error=str(e),
+                stdout_log=stdout_log,
+                stderr_log=stderr_log
+            )
+            
+        if stdout_log is not None:
+            stdout_tail = _read_tail(stdout_log, tail_bytes)
+        if stderr_log is not None:
+            stderr_tail = _read_tail(stderr_log, tail_bytes)
+        result = ExecutionResult(
+            success=returncode == 0 or not check,
+            output=stdout_tail.text(),
+            returncode=returncode,
+            stdout_log=stdout_log,
+            stderr_log=stderr_log
+        )
+        if not result.success:
+            result.error = f"Command failed with exit code {returncode}: {stderr_tail.text()}"
+        return result
+        
+    def iter_output(
+        self,
+        cmd: list[str],
+        chunk_size: int = _CHUNK_SIZE,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
+        **kwargs
+    ) -> Iterator[bytes]:
+        """
+        Run a command and yield its raw stdout in chunks as it arrives.
+        
+        Raises ``subprocess.CalledProcessError`` carrying the tail of stderr
+        once the output is exhausted if the command failed. Closing the
+        iterator early kills the command.
+        """
+        if self.config.verbose:
+            console.print(f"[blue]Running command: {' '.join(cmd)}[/blue]")
+        stderr_tail = TailBuffer(tail_bytes)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        reader = threading.Thread(target=_pump, args=(process.stderr, [stderr_tail.write]))
+        reader.start()
+        try:
+            for chunk in iter(lambda: process.stdout.read1(chunk_size), b""):
+                yield chunk
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            returncode = process.wait()
+            reader.join()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr_tail.text())
             
     def run_qc_tool(
         self,
         input_dir: Path,
         output_dir: Path,
         min_quality: int = 20,
-        threads: int = 1
+        threads: int = 1,
+        input_files: Optional[list[Path]] = None,
+        log_name: str = "qc",
+        reservation: Optional[Reservation] = None,
     ) -> ExecutionResult:
         """
         Run the quality control tool.
+        
+        If ``input_files`` is given, only those files are processed instead
+        of the whole input directory. The tool's output is streamed to
+        ``<output_dir>/logs/<log_name>.{stdout,stderr}.log``.
         """
-        # Example command - replace with actual QC tool
-        cmd = [
-            "fastqc",  # Replace with actual QC tool
-            "-o", str(output_dir),
-            "-t", str(threads),
-            "-q", str(min_quality),
-            str(input_dir)
-        ]
-        return self._run_command(cmd)
+        with self._reserve(reservation, threads, self.config.qc.memory_mb) as reservation:
+            cmd = qc_command(
+                input_dir, output_dir, min_quality, reservation.threads, input_files
+            )
+            return self._run_command(cmd, log_prefix=output_dir / "logs" / log_name)
         
     def run_denoise_tool(
         self,
         input_dir: Path,
         output_dir: Path,
-        threads: int = 1
+        threads: int = 1,
+        reservation: Optional[Reservation] = None,
     ) -> ExecutionResult:
         """
         Run the denoising tool.
+        
+        The tool's output is streamed to ``<output_dir>/logs/denoise.*.log``.
+        """
+        with self._reserve(reservation, threads, self.config.denoise.memory_mb) as reservation:
+            cmd = denoise_command(input_dir, output_dir, reservation.threads)
+            return self._run_command(cmd, log_prefix=output_dir / "logs" / "denoise")
+
+
+class AsyncExecutor:
+    """
+    Runs external tools as asyncio subprocesses.
+    
+    At most ``max_concurrency`` commands (``config.threads`` by default) run
+    at once, and tool runs also wait for their threads and memory from
+    ``resources``; waiting commands hold neither a thread nor a process.
+    Output is streamed as in ``Executor._stream_command`` and results
+    follow the same ``ExecutionResult`` contract.
+    """
+    
+    def __init__(
+        self,
+        config: Config,
+        max_concurrency: Optional[int] = None,
+        resources: Optional[ResourceManager] = None
+    ):
+        self.config = config
+        self.resources = resources or shared_resources(config)
+        self.max_concurrency = max(1, max_concurrency or config.threads)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Semaphores belong to an event loop, so one is made per loop
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+        
+    async def run_command(
+        self,
+        cmd: list[str],
+        check: bool = True,
+        timeout: Optional[float] = None,
+        log_prefix: Optional[Path] = None,
+        stdout: Optional[OutputSink] = None,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
+        **kwargs
+    ) -> ExecutionResult:
+        """
+        Execute an external command once a concurrency slot is free.
+        
+        The command is killed if it runs longer than ``timeout`` seconds
+        (not counting the wait for a slot) or if the calling task is
+        cancelled.
         """
-        # Example command - replace with actual denoising tool
-        cmd = [
-            "denoiser",  # Replace with actual denoising tool
-            "-i", str(input_dir),
-            "-o", str(output_dir),
-            "-t", str(threads)
+        async with self.semaphore:
+            return await self._run(cmd, check, timeout, log_prefix, stdout, tail_bytes, **kwargs)
+            
+    async def _run(
+        self,
+        cmd: list[str],
+        check: bool,
+        timeout: Optional[float],
+        log_prefix: Optional[Path],
+        stdout: Optional[OutputSink],
+        tail_bytes: int,
+        **kwargs
+    ) -> ExecutionResult:
+        stdout_tail = TailBuffer(tail_bytes)
+        stderr_tail = TailBuffer(tail_bytes)
+        stdout_log = stderr_log = None
+        if self.config.verbose:
+            console.print(f"[blue]Running command: {' '.join(cmd)}[/blue]")
+        with ExitStack() as stack:
+            try:
+                if log_prefix is not None:
+                    log_prefix = Path(log_prefix)
+                    log_prefix.parent.mkdir(parents=True, exist_ok=True)
+                    stderr_log = Path(f"{log_prefix}.stderr.log")
+                    stderr_target = stack.enter_context(open(stderr_log, "wb"))
+                else:
+                    stderr_target = subprocess.PIPE
+                    
+                if stdout is None and log_prefix is not None:
+                    stdout = Path(f"{log_prefix}.stdout.log")
+                if isinstance(stdout, (str, Path)):
+                    stdout_log = Path(stdout)
+                    stdout_log.parent.mkdir(parents=True, exist_ok=True)
+                    stdout_target = stack.enter_context(open(stdout_log, "wb"))
+                elif stdout is not None and hasattr(stdout, "fileno"):
+                    stdout_target = stdout
+                else:
+                    stdout_target = subprocess.PIPE
+                    
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=stdout_target, stderr=stderr_target, **kwargs
+                )
+            except Exception as e:
+                return ExecutionResult(
+                    success=False,
+                    error=str(e),
+                    stdout_log=stdout_log,
+                    stderr_log=stderr_log
+                )
+                
+            readers = []
+            if stdout_target is subprocess.PIPE:
+                sinks = [stdout_tail.write]
+                if stdout is not None:
+                    sinks.append(stdout)
+                readers.append(_apump(process.stdout, sinks))
+            if stderr_target is subprocess.PIPE:
+                readers.append(_apump(process.stderr, [stderr_tail.write]))
+                
+            timed_out = False
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(process.wait(), *readers), timeout
+                )
+            except asyncio.TimeoutError:
+                timed_out = True
+            finally:
+                # Also reached on cancellation: never leave the tool running
+                if process.returncode is None:
+                    process.kill()
+                    await asyncio.shield(process.wait())
+            returncode = process.returncode
+            
+        if stdout_log is not None:
+            stdout_tail = _read_tail(stdout_log, tail_bytes)
+        if stderr_log is not None:
+            stderr_tail = _read_tail(stderr_log, tail_bytes)
+        result = ExecutionResult(
+            success=not timed_out and (returncode == 0 or not check),
+            output=stdout_tail.text(),
+            returncode=returncode,
+            stdout_log=stdout_log,
+            stderr_log=stderr_log
+        )
+        if timed_out:
+            result.error = f"Command timed out after {timeout}s: {stderr_tail.text()}"
+        elif not result.success:
+            result.error = f"Command failed with exit code {returncode}: {stderr_tail.text()}"
+        return result
+        
+    async def run_all(
+        self,
+        commands: Iterable[Awaitable[ExecutionResult]],
+        cancel_on_failure: bool = True,
+    ) -> list[ExecutionResult]:
+        """
+        Run commands concurrently and return their results in order.
+        
+        With ``cancel_on_failure``, the first failure cancels every command
+        still waiting or running; those report a cancellation error.
+        """
+        tasks = [asyncio.ensure_future(command) for command in commands]
+        results: list[Optional[ExecutionResult]] = [None] * len(tasks)
+        index = {task: i for i, task in enumerate(tasks)}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                failed = False
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        result = ExecutionResult(success=False, error=str(task.exception()))
+                    else:
+                        result = task.result()
+                    results[index[task]] = result
+                    failed = failed or not result.success
+                if failed and cancel_on_failure:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return [
+            result or ExecutionResult(success=False, error="Cancelled after another command failed")
+            for result in results
         ]
-        return self._run_command(cmd)
+        
+    async def run_qc_tool(
+        self,
+        input_dir: Path,
+        output_dir: Path,
+        min_quality: int = 20,
+        threads: int = 1,
+        input_files: Optional[list[Path]] = None,
+        log_name: str = "qc",
+        timeout: Optional[float] = None
+    ) -> ExecutionResult:
+        """Run the quality control tool (see ``Executor.run_qc_tool``)."""
+        memory_mb = self.config.qc.memory_mb
+        async with self.resources.reserve_async(threads, memory_mb) as reservation:
+            cmd = qc_command(
+                input_dir, output_dir, min_quality, reservation.threads, input_files
+            )
+            return await self.run_command(
+                cmd,
+                timeout=timeout or self.config.tool_timeout,
+                log_prefix=output_dir / "logs" / log_name
+            )
+        
+    async def run_denoise_tool(
+        self,
+        input_dir: Path,
+        output_dir: Path,
+        threads: int = 1,
+        timeout: Optional[float] = None
+    ) -> ExecutionResult:
+        """Run the denoising tool (see ``Executor.run_denoise_tool``)."""
+        memory_mb = self.config.denoise.memory_mb
+        async with self.resources.reserve_async(threads, memory_mb) as reservation:
+            cmd = denoise_command(input_dir, output_dir, reservation.threads)
+            return await self.run_command(
+                cmd,
+                timeout=timeout or self.config.tool_timeout,
+                log_prefix=output_dir / "logs" / "denoise"
+            )
+
+async def _apump(stream: asyncio.StreamReader, sinks: list[Callable[[bytes], None]]) -> None:
+    """Async counterpart of ``_pump``."""
+    while True:
+        chunk = await stream.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        for sink in sinks:
+            sink(chunk)
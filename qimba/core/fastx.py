@@ -0,0 +1,454 @@
+import gzip
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from qimba.core.bgzf import BgzfReader, BgzfWriter, is_bgzf
+
+# Reads are pulled from disk in chunks of this many bytes
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+FASTQ_SUFFIXES = (".fastq", ".fq")
+FASTA_SUFFIXES = (".fasta", ".fa", ".fna")
+FASTX_SUFFIXES = FASTQ_SUFFIXES + FASTA_SUFFIXES
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_NEWLINE = 0x0A
+_CR = 0x0D
+
+
+def ragged_take(
+    source: np.ndarray,
+    starts: np.ndarray,
+    lengths: np.ndarray,
+) -> np.ndarray:
+    """
+    Concatenate the slices ``source[start:start + length]`` without a Python loop.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=source.dtype)
+    out_starts = np.cumsum(lengths) - lengths
+    shift = np.repeat(starts - out_starts, lengths)
+    return source[np.arange(total, dtype=np.int64) + shift]
+
+
+def _offsets(lengths: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+@dataclass
+class ReadBatch:
+    """
+    A batch of sequencing reads stored as flat byte buffers.
+
+    Names, sequences and qualities are each concatenated into one ``uint8``
+    array; ``name_offsets`` and ``seq_offsets`` (length ``n + 1``) delimit the
+    records. Qualities share the sequence offsets and are ``None`` for FASTA.
+    """
+    names: np.ndarray
+    name_offsets: np.ndarray
+    seqs: np.ndarray
+    seq_offsets: np.ndarray
+    quals: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.seq_offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Sequence length of every read."""
+        return np.diff(self.seq_offsets)
+
+    @property
+    def total_bases(self) -> int:
+        return int(self.seq_offsets[-1])
+
+    def name(self, i: int) -> bytes:
+        return self.names[self.name_offsets[i]:self.name_offsets[i + 1]].tobytes()
+
+    def seq(self, i: int) -> bytes:
+        return self.seqs[self.seq_offsets[i]:self.seq_offsets[i + 1]].tobytes()
+
+    def qual(self, i: int) -> Optional[bytes]:
+        if self.quals is None:
+            return None
+        return self.quals[self.seq_offsets[i]:self.seq_offsets[i + 1]].tobytes()
+
+    def records(self) -> Iterator[tuple[bytes, bytes, Optional[bytes]]]:
+        """
+        Iterate over ``(name, seq, qual)`` tuples.
+
+        This materialises one object per read and is meant for the slow paths
+        (debugging, small outputs), not for bulk processing.
+        """
+        for i in range(len(self)):
+            yield self.name(i), self.seq(i), self.qual(i)
+
+    def take(
+        self,
+        index: np.ndarray,
+        start: Optional[np.ndarray] = None,
+        end: Optional[np.ndarray] = None,
+    ) -> "ReadBatch":
+        """
+        Return a new batch with the selected reads, optionally trimmed.
+
+        ``index`` is a boolean mask or an integer index array. ``start`` and
+        ``end`` give, for every selected read, the slice of the sequence to
+        keep (relative to the start of the read).
+        """
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        lengths = self.lengths[index]
+        start = np.zeros_like(lengths) if start is None else np.asarray(start, dtype=np.int64)
+        end = lengths if end is None else np.asarray(end, dtype=np.int64)
+        new_lengths = np.maximum(end - start, 0)
+        seq_starts = self.seq_offsets[:-1][index] + start
+
+        name_starts = self.name_offsets[:-1][index]
+        name_lengths = np.diff(self.name_offsets)[index]
+        return ReadBatch(
+            names=ragged_take(self.names, name_starts, name_lengths),
+            name_offsets=_offsets(name_lengths),
+            seqs=ragged_take(self.seqs, seq_starts, new_lengths),
+            seq_offsets=_offsets(new_lengths),
+            quals=(
+                None if self.quals is None
+                else ragged_take(self.quals, seq_starts, new_lengths)
+            ),
+        )
+
+    def _format(self, fastq: bool) -> bytes:
+        n = len(self)
+        if n == 0:
+            return b""
+        # All pieces of the output are gathered from one source buffer:
+        # names, sequences, qualities and a few constant separators.
+        consts = np.frombuffer(b"@>\n+\n", dtype=np.uint8)
+        parts = [self.names, self.seqs]
+        if fastq:
+            parts.append(self.quals)
+        parts.append(consts)
+        source = np.concatenate(parts)
+        seq_base = len(self.names)
+        qual_base = seq_base + len(self.seqs)
+        c = len(source) - len(consts)
+
+        name_len = np.diff(self.name_offsets)
+        seq_len = self.lengths
+        ones = np.ones(n, dtype=np.int64)
+        if fastq:
+            starts = np.stack([
+                ones * c, self.name_offsets[:-1], ones * (c + 2),
+                seq_base + self.seq_offsets[:-1], ones * (c + 2),
+                qual_base + self.seq_offsets[:-1], ones * (c + 2),
+            ], axis=1)
+            lengths = np.stack([
+                ones, name_len, ones, seq_len, ones * 3, seq_len, ones,
+            ], axis=1)
+        else:
+            starts = np.stack([
+                ones * (c + 1), self.name_offsets[:-1], ones * (c + 2),
+                seq_base + self.seq_offsets[:-1], ones * (c + 2),
+            ], axis=1)
+            lengths = np.stack([ones, name_len, ones, seq_len, ones], axis=1)
+        return ragged_take(source, starts.ravel(), lengths.ravel()).tobytes()
+
+    def to_fastq(self) -> bytes:
+        """Serialise the batch as FASTQ text."""
+        if self.quals is None:
+            raise ValueError("Cannot write FASTQ without quality scores")
+        return self._format(fastq=True)
+
+    def to_fasta(self) -> bytes:
+        """Serialise the batch as FASTA text (one line per sequence)."""
+        return self._format(fastq=False)
+
+    @classmethod
+    def empty(cls, with_quals: bool = True) -> "ReadBatch":
+        zero = np.zeros(1, dtype=np.int64)
+        empty = np.empty(0, dtype=np.uint8)
+        return cls(empty, zero, empty, zero.copy(), empty if with_quals else None)
+
+    @classmethod
+    def concat(cls, batches: Iterable["ReadBatch"]) -> "ReadBatch":
+        """Join several batches into one."""
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        with_quals = all(b.quals is not None for b in batches)
+        return cls(
+            names=np.concatenate([b.names for b in batches]),
+            name_offsets=_offsets(np.concatenate([np.diff(b.name_offsets) for b in batches])),
+            seqs=np.concatenate([b.seqs for b in batches]),
+            seq_offsets=_offsets(np.concatenate([b.lengths for b in batches])),
+            quals=np.concatenate([b.quals for b in batches]) if with_quals else None,
+        )
+
+    @classmethod
+    def from_records(
+        cls,
+        records: Iterable[tuple[bytes, bytes, Optional[bytes]]],
+    ) -> "ReadBatch":
+        """Build a batch from ``(name, seq, qual)`` tuples."""
+        names, seqs, quals = [], [], []
+        for name, seq, qual in records:
+            names.append(name)
+            seqs.append(seq)
+            quals.append(qual)
+        with_quals = bool(quals) and all(q is not None for q in quals)
+
+        def pack(items: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+            lengths = np.fromiter((len(x) for x in items), dtype=np.int64, count=len(items))
+            return np.frombuffer(b"".join(items), dtype=np.uint8).copy(), _offsets(lengths)
+
+        name_buf, name_offsets = pack(names)
+        seq_buf, seq_offsets = pack(seqs)
+        return cls(
+            names=name_buf,
+            name_offsets=name_offsets,
+            seqs=seq_buf,
+            seq_offsets=seq_offsets,
+            quals=pack(quals)[0] if with_quals else None,
+        )
+
+
+def is_gzipped(path: Path) -> bool:
+    """Check the gzip magic bytes of a file."""
+    with open(path, "rb") as f:
+        return f.read(2) == _GZIP_MAGIC
+
+
+def open_fastx(path: Path, buffer_size: int = DEFAULT_CHUNK_SIZE, threads: int = 1) -> BinaryIO:
+    """
+    Open a plain or gzip-compressed file for binary reading.
+
+    BGZF files are decompressed with ``threads`` threads; other gzip files
+    can only be decompressed serially.
+    """
+    raw = open(path, "rb", buffering=buffer_size)
+    header = raw.peek(18)[:18]
+    if is_bgzf(header):
+        return BgzfReader(raw, threads=threads, close_source=True)
+    if header[:2] == _GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    return raw
+
+
+def open_output(path: Path, compression_level: int = 0, threads: int = 1) -> BinaryIO:
+    """
+    Open an output file: plain with ``compression_level=0``, otherwise
+    BGZF-compressed at that level with ``threads`` compression threads.
+    """
+    if compression_level:
+        return BgzfWriter(path, level=compression_level, threads=threads)
+    return open(path, "wb")
+
+
+def fastx_stem(path: Path) -> str:
+    """File name without the compression and FASTA/FASTQ suffixes."""
+    name = path.name
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for suffix in FASTX_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def output_name(path: Path, compressed: bool = False) -> str:
+    """Name of a plain (or, with ``compressed``, gzipped) output file derived from an input file."""
+    name = path.name[:-3] if path.name.endswith(".gz") else path.name
+    suffix = ".fasta" if name.endswith(FASTA_SUFFIXES) else ".fastq"
+    return fastx_stem(path) + suffix + (".gz" if compressed else "")
+
+
+def is_fastx_file(path: Path) -> bool:
+    name = path.name[:-3] if path.name.endswith(".gz") else path.name
+    return name.endswith(FASTX_SUFFIXES)
+
+
+def find_fastx_files(directory: Path) -> list[Path]:
+    """
+    List the FASTA/FASTQ files (plain or gzipped) directly inside a directory.
+    """
+    return sorted(p for p in Path(directory).iterdir() if p.is_file() and is_fastx_file(p))
+
+
+def _parse_fastq(buf: np.ndarray, final: bool) -> tuple[ReadBatch, int]:
+    """Parse the complete FASTQ records in ``buf``; return them and the bytes consumed."""
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    n = len(newlines) // 4
+    if final and len(newlines) % 4:
+        raise ValueError("Truncated FASTQ record at end of input")
+    if n == 0:
+        return ReadBatch.empty(), 0
+
+    ends = newlines[:n * 4].reshape(n, 4)
+    starts = np.empty_like(ends)
+    starts[0, 0] = 0
+    starts[1:, 0] = ends[:-1, 3] + 1
+    starts[:, 1:] = ends[:, :-1] + 1
+    # Tolerate Windows line endings
+    ends = ends - ((ends > starts) & (buf[np.maximum(ends - 1, 0)] == _CR))
+
+    if np.any(buf[starts[:, 0]] != ord("@")) or np.any(buf[starts[:, 2]] != ord("+")):
+        raise ValueError("Malformed FASTQ record (expected '@' header and '+' separator)")
+    lengths = ends[:, 1] - starts[:, 1]
+    if np.any(ends[:, 3] - starts[:, 3] != lengths):
+        raise ValueError("FASTQ sequence and quality lengths differ")
+
+    name_lengths = ends[:, 0] - starts[:, 0] - 1
+    batch = ReadBatch(
+        names=ragged_take(buf, starts[:, 0] + 1, name_lengths),
+        name_offsets=_offsets(name_lengths),
+        seqs=ragged_take(buf, starts[:, 1], lengths),
+        seq_offsets=_offsets(lengths),
+        quals=ragged_take(buf, starts[:, 3], lengths),
+    )
+    return batch, int(newlines[n * 4 - 1]) + 1
+
+
+def _parse_fasta(buf: np.ndarray, final: bool) -> tuple[ReadBatch, int]:
+    """Parse the complete (possibly multi-line) FASTA records in ``buf``."""
+    if final:
+        consumed = len(buf)
+    else:
+        # Only records followed by another header are known to be complete
+        headers = np.flatnonzero(buf[1:] == ord(">"))
+        headers = headers[buf[headers] == _NEWLINE]
+        if len(headers) == 0:
+            return ReadBatch.empty(with_quals=False), 0
+        consumed = int(headers[-1]) + 1
+    buf = buf[:consumed]
+    if not len(buf):
+        return ReadBatch.empty(with_quals=False), consumed
+    if buf[0] != ord(">"):
+        raise ValueError("Malformed FASTA input (expected '>' header)")
+
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    line_starts = np.concatenate(([0], newlines[:-1] + 1))
+    is_header = buf[line_starts] == ord(">")
+    header_starts = line_starts[is_header]
+    header_ends = newlines[is_header]
+    header_ends = header_ends - ((header_ends > header_starts) & (buf[header_ends - 1] == _CR))
+
+    in_header = np.zeros(len(buf) + 1, dtype=np.int64)
+    np.add.at(in_header, header_starts, 1)
+    np.add.at(in_header, newlines[is_header], -1)
+    in_header = np.cumsum(in_header[:-1]) > 0
+    record = np.zeros(len(buf), dtype=np.int64)
+    record[header_starts] = 1
+    record = np.cumsum(record) - 1
+
+    is_seq = ~in_header & (buf != _NEWLINE) & (buf != _CR)
+    n = len(header_starts)
+    lengths = np.bincount(record[is_seq], minlength=n).astype(np.int64)
+    name_lengths = header_ends - header_starts - 1
+    batch = ReadBatch(
+        names=ragged_take(buf, header_starts + 1, name_lengths),
+        name_offsets=_offsets(name_lengths),
+        seqs=buf[is_seq],
+        seq_offsets=_offsets(lengths),
+        quals=None,
+    )
+    return batch, consumed
+
+
+class FastxReader:
+    """
+    Streaming FASTA/FASTQ reader yielding ``ReadBatch`` objects.
+
+    The input is read in chunks of ``chunk_size`` bytes (after gzip
+    decompression) and every chunk is parsed with vectorised NumPy operations,
+    so the cost per read stays well below that of a line-by-line parser.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        threads: int = 1,
+    ):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.threads = threads
+        self.reads = 0
+        self.bases = 0
+
+    def _detect_format(self, data: bytes) -> str:
+        if data[:1] == b"@":
+            return "fastq"
+        if data[:1] == b">":
+            return "fasta"
+        raise ValueError(f"{self.path} is not a FASTA/FASTQ file")
+
+    def __iter__(self) -> Iterator[ReadBatch]:
+        with open_fastx(self.path, self.chunk_size, self.threads) as handle:
+            parse = None
+            pending = b""
+            while True:
+                data = handle.read(self.chunk_size)
+                final = not data
+                buf = pending + data
+                if final:
+                    # Drop trailing blank lines and make sure the last record is terminated
+                    buf = buf.rstrip() + b"\n" if buf.strip() else b""
+                if parse is None:
+                    buf = buf.lstrip()
+                    if not buf:
+                        if final:
+                            return
+                        continue
+                    parse = _parse_fastq if self._detect_format(buf) == "fastq" else _parse_fasta
+                batch, consumed = parse(np.frombuffer(buf, dtype=np.uint8), final)
+                pending = buf[consumed:]
+                if len(batch):
+                    self.reads += len(batch)
+                    self.bases += batch.total_bases
+                    yield batch
+                if final:
+                    if pending.strip():
+                        raise ValueError(f"Incomplete record at end of {self.path}")
+                    return
+
+
+def read_pair_batches(
+    path1: Union[str, Path],
+    path2: Union[str, Path],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    threads: int = 1,
+) -> Iterator[tuple[ReadBatch, ReadBatch]]:
+    """
+    Read two mate files in lockstep, yielding batches with matching read counts.
+    """
+    reader1 = iter(FastxReader(path1, chunk_size=chunk_size, threads=threads))
+    reader2 = iter(FastxReader(path2, chunk_size=chunk_size, threads=threads))
+    pending1 = ReadBatch.empty()
+    pending2 = ReadBatch.empty()
+    while True:
+        if not len(pending1):
+            pending1 = next(reader1, pending1)
+        if not len(pending2):
+            pending2 = next(reader2, pending2)
+        if not len(pending1) or not len(pending2):
+            if len(pending1) or len(pending2):
+                raise ValueError(f"{path1} and {path2} contain different numbers of reads")
+            return
+        n = min(len(pending1), len(pending2))
+        yield pending1.take(np.arange(n)), pending2.take(np.arange(n))
+        pending1 = pending1.take(np.arange(n, len(pending1)))
+        pending2 = pending2.take(np.arange(n, len(pending2)))
+
+
+def write_batch(handle: BinaryIO, batch: ReadBatch) -> None:
+    """Write a batch as FASTQ if it has qualities, otherwise as FASTA."""
+    handle.write(batch.to_fastq() if batch.quals is not None else batch.to_fasta())
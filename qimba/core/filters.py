@@ -0,0 +1,424 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Sequence, Union
+
+import numpy as np
+
+from qimba.core.fastx import FastxReader, ReadBatch, open_output, read_pair_batches, write_batch
+from qimba.core.index import MmapFastq, join_parts, part_path, plan_chunks
+from qimba.core.qcstats import PHRED_OFFSET, ReadProfile
+from qimba.utils.config import DenoiseConfig, QCConfig
+
+# Error probability for every possible (Phred+33 encoded) quality byte
+PHRED_ERROR = 10.0 ** (-np.clip(np.arange(256) - PHRED_OFFSET, 0, None) / 10.0)
+
+
+def prefix_sums(values: np.ndarray, dtype=np.int64) -> np.ndarray:
+    """Cumulative sums with a leading zero, so ``p[j] - p[i]`` sums ``values[i:j]``."""
+    out = np.zeros(len(values) + 1, dtype=dtype)
+    np.cumsum(values, out=out[1:])
+    return out
+
+
+@dataclass
+class FilterResult:
+    """Per-read decisions of a batch filter."""
+    keep: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.end - self.start
+
+
+@dataclass
+class FilterStats:
+    """
+    Counters accumulated while filtering reads, and the profiles of the
+    input files (by file name) when they were collected in the same pass.
+    """
+    reads_in: int = 0
+    reads_out: int = 0
+    bases_in: int = 0
+    bases_out: int = 0
+    reads_trimmed: int = 0
+    too_short: int = 0
+    too_many_n: int = 0
+    low_quality: int = 0
+    high_ee: int = 0
+    profiles: dict[str, ReadProfile] = field(default_factory=dict)
+
+    def __add__(self, other: "FilterStats") -> "FilterStats":
+        merged = FilterStats(**{
+            f.name: getattr(self, f.name) + getattr(other, f.name)
+            for f in fields(self) if f.name != "profiles"
+        })
+        merged.profiles = dict(self.profiles)
+        for name, profile in other.profiles.items():
+            merged.profiles[name] = merged.profiles[name] + profile if name in merged.profiles else profile
+        return merged
+
+    @property
+    def pass_rate(self) -> float:
+        return self.reads_out / self.reads_in if self.reads_in else 0.0
+
+
+class QualityFilter:
+    """
+    Vectorised implementation of the ``QCConfig`` read filters.
+
+    Whole batches are processed with NumPy operations on the flat quality
+    and sequence buffers of a ``ReadBatch``: reads are cut at the first
+    sliding window whose mean quality drops below ``min_quality``, then
+    rejected when the trimmed read is shorter than ``min_length``, has more
+    than ``max_n`` ambiguous bases or a mean quality below ``min_quality``.
+    """
+
+    def __init__(
+        self,
+        min_quality: int = 20,
+        min_length: int = 100,
+        max_n: int = 0,
+        window_size: int = 4,
+    ):
+        self.min_quality = min_quality
+        self.min_length = min_length
+        self.max_n = max_n
+        self.window_size = window_size
+
+    @classmethod
+    def from_config(cls, qc: QCConfig) -> "QualityFilter":
+        return cls(
+            min_quality=qc.min_quality,
+            min_length=qc.min_length,
+            max_n=qc.max_n,
+            window_size=qc.window_size,
+        )
+
+    def _window_ends(self, qual_sums: np.ndarray, batch: ReadBatch) -> np.ndarray:
+        """Start of the first failing window of every read (read length if none)."""
+        w = self.window_size
+        starts = batch.seq_offsets[:-1]
+        lengths = batch.lengths
+        if w <= 0:
+            return lengths.copy()
+        # window_sums[p] is the quality sum of the window starting at flat position p
+        window_sums = qual_sums[w:] - qual_sums[:-w]
+        bad = np.flatnonzero(window_sums < self.min_quality * w)
+        if len(bad) == 0:
+            return lengths.copy()
+        first = np.searchsorted(bad, starts)
+        candidate = bad[np.minimum(first, len(bad) - 1)]
+        # A window only counts when it lies entirely inside the read
+        inside = (first < len(bad)) & (candidate <= starts + lengths - w)
+        return np.where(inside, candidate - starts, lengths)
+
+    def evaluate(self, batch: ReadBatch, stats: Optional[FilterStats] = None) -> FilterResult:
+        """
+        Compute the keep/trim decision for every read of a batch.
+        """
+        n = len(batch)
+        lengths = batch.lengths
+        offsets = batch.seq_offsets[:-1]
+        start = np.zeros(n, dtype=np.int64)
+
+        if batch.quals is not None:
+            qual_sums = prefix_sums(batch.quals.astype(np.int32) - PHRED_OFFSET)
+            end = self._window_ends(qual_sums, batch)
+            total = qual_sums[offsets + end] - qual_sums[offsets + start]
+            low_quality = total < self.min_quality * (end - start)
+        else:
+            end = lengths.copy()
+            low_quality = np.zeros(n, dtype=bool)
+
+        n_sums = prefix_sums((batch.seqs | 0x20) == ord("n"), dtype=np.int32)
+        n_count = n_sums[offsets + end] - n_sums[offsets + start]
+        too_short = (end - start) < self.min_length
+        too_many_n = n_count > self.max_n
+        keep = ~(too_short | too_many_n | low_quality)
+
+        if stats is not None:
+            stats.reads_in += n
+            stats.bases_in += batch.total_bases
+            stats.reads_out += int(keep.sum())
+            stats.bases_out += int((end - start)[keep].sum())
+            stats.reads_trimmed += int((keep & (end - start < lengths)).sum())
+            stats.too_short += int(too_short.sum())
+            stats.too_many_n += int((too_many_n & ~too_short).sum())
+            stats.low_quality += int((low_quality & ~too_short & ~too_many_n).sum())
+        return FilterResult(keep=keep, start=start, end=end)
+
+    def apply(self, batch: ReadBatch, stats: Optional[FilterStats] = None) -> ReadBatch:
+        """Return the reads that pass the filter, trimmed."""
+        result = self.evaluate(batch, stats)
+        return batch.take(result.keep, result.start[result.keep], result.end[result.keep])
+
+
+class ExpectedErrorFilter:
+    """
+    Expected-error filter driven by ``DenoiseConfig.max_ee``.
+
+    The expected number of errors of a read is the sum of the error
+    probabilities of its bases, looked up from ``PHRED_ERROR``. Cumulative
+    sums over the flat quality buffer give the EE of every read prefix in one
+    pass, so reads can either be discarded when their total EE exceeds
+    ``max_ee`` or truncated just before the base where it is exceeded.
+    Reads without qualities (FASTA) pass unchanged.
+    """
+
+    def __init__(
+        self,
+        max_ee: float = 1.0,
+        truncate: bool = False,
+        min_length: int = 1,
+    ):
+        self.max_ee = max_ee
+        self.truncate = truncate
+        self.min_length = min_length
+
+    @classmethod
+    def from_config(cls, denoise: DenoiseConfig) -> "ExpectedErrorFilter":
+        return cls(max_ee=denoise.max_ee, truncate=denoise.truncate_ee)
+
+    def expected_errors(self, batch: ReadBatch) -> np.ndarray:
+        """Total expected errors of every read."""
+        if batch.quals is None:
+            return np.zeros(len(batch))
+        ee_sums = prefix_sums(PHRED_ERROR[batch.quals], dtype=np.float64)
+        return ee_sums[batch.seq_offsets[1:]] - ee_sums[batch.seq_offsets[:-1]]
+
+    def evaluate(self, batch: ReadBatch, stats: Optional[FilterStats] = None) -> FilterResult:
+        """
+        Compute the keep/truncate decision for every read of a batch.
+        """
+        n = len(batch)
+        lengths = batch.lengths
+        offsets = batch.seq_offsets[:-1]
+        start = np.zeros(n, dtype=np.int64)
+
+        if batch.quals is None:
+            end = lengths.copy()
+            high_ee = np.zeros(n, dtype=bool)
+        else:
+            ee_sums = prefix_sums(PHRED_ERROR[batch.quals], dtype=np.float64)
+            if self.truncate:
+                # Longest prefix whose cumulative EE stays within max_ee
+                limit = np.searchsorted(ee_sums, ee_sums[offsets] + self.max_ee, side="right") - 1
+                end = np.minimum(limit - offsets, lengths)
+                high_ee = np.zeros(n, dtype=bool)
+            else:
+                end = lengths.copy()
+                high_ee = (ee_sums[offsets + lengths] - ee_sums[offsets]) > self.max_ee
+
+        too_short = (end - start) < self.min_length
+        keep = ~(too_short | high_ee)
+
+        if stats is not None:
+            stats.reads_in += n
+            stats.bases_in += batch.total_bases
+            stats.reads_out += int(keep.sum())
+            stats.bases_out += int((end - start)[keep].sum())
+            stats.reads_trimmed += int((keep & (end - start < lengths)).sum())
+            stats.too_short += int(too_short.sum())
+            stats.high_ee += int((high_ee & ~too_short).sum())
+        return FilterResult(keep=keep, start=start, end=end)
+
+    def apply(self, batch: ReadBatch, stats: Optional[FilterStats] = None) -> ReadBatch:
+        """Return the reads that pass the filter, truncated if enabled."""
+        result = self.evaluate(batch, stats)
+        return batch.take(result.keep, result.start[result.keep], result.end[result.keep])
+
+
+def filter_batches(
+    read_filter: Union[QualityFilter, ExpectedErrorFilter],
+    batches: Iterable[tuple[ReadBatch, ...]],
+    profiles: Sequence[ReadProfile] = (),
+) -> Iterator[tuple[FilterStats, tuple[ReadBatch, ...]]]:
+    """
+    Filter batches of reads, or aligned batches of mates (a pair is kept
+    only if both mates pass), yielding the counters and the passing,
+    trimmed reads of each. The unfiltered reads are added to ``profiles``
+    if given.
+    """
+    for group in batches:
+        for profile, batch in zip(profiles, group):
+            profile.add(batch)
+        if len(group) == 1:
+            batch_stats = FilterStats()
+            yield batch_stats, (read_filter.apply(group[0], batch_stats),)
+            continue
+        batch1, batch2 = group
+        batch_stats = FilterStats()
+        result1 = read_filter.evaluate(batch1, batch_stats)
+        result2 = read_filter.evaluate(batch2, batch_stats)
+        keep = result1.keep & result2.keep
+        # Mates of rejected reads are dropped as well
+        batch_stats.reads_out = 2 * int(keep.sum())
+        batch_stats.bases_out = int(result1.lengths[keep].sum() + result2.lengths[keep].sum())
+        batch_stats.reads_trimmed = int(
+            (keep & (result1.lengths < batch1.lengths)).sum()
+            + (keep & (result2.lengths < batch2.lengths)).sum()
+        )
+        yield batch_stats, (
+            batch1.take(keep, result1.start[keep], result1.end[keep]),
+            batch2.take(keep, result2.start[keep], result2.end[keep]),
+        )
+
+
+def _filter_pairs(
+    read_filter: Union[QualityFilter, ExpectedErrorFilter],
+    pairs: Iterable[tuple[ReadBatch, ReadBatch]],
+    out1: BinaryIO,
+    out2: BinaryIO,
+    profiles: Sequence[ReadProfile] = (),
+) -> FilterStats:
+    """
+    Filter aligned batches of mates, keeping pairs whose mates both pass,
+    and add the unfiltered mates to ``profiles`` if given.
+    """
+    stats = FilterStats()
+    for batch_stats, (kept1, kept2) in filter_batches(read_filter, pairs, profiles):
+        stats += batch_stats
+        write_batch(out1, kept1)
+        write_batch(out2, kept2)
+    return stats
+
+
+def _filter_range(
+    read_filter: Union[QualityFilter, ExpectedErrorFilter],
+    input_paths: tuple[Path, ...],
+    output_paths: tuple[Path, ...],
+    start: int,
+    stop: int,
+    index_dir: Optional[Path],
+    compression_level: int = 0,
+    profile: bool = False,
+) -> FilterStats:
+    """Filter reads ``start`` to ``stop`` of indexed files (or mate files)."""
+    profiles = [ReadProfile() for _ in input_paths] if profile else []
+    with ExitStack() as stack:
+        readers = [stack.enter_context(MmapFastq(path, index_dir)) for path in input_paths]
+        outputs = [stack.enter_context(open_output(path, compression_level)) for path in output_paths]
+        # Mates are batched by read count so that their batches line up
+        batch_reads = readers[0].batch_reads()
+        batches = [reader.batches(start, stop, batch_reads) for reader in readers]
+        if len(readers) == 2:
+            stats = _filter_pairs(read_filter, zip(*batches), *outputs, profiles)
+        else:
+            stats = FilterStats()
+            for batch in batches[0]:
+                if profiles:
+                    profiles[0].add(batch)
+                write_batch(outputs[0], read_filter.apply(batch, stats))
+    stats.profiles = {path.name: p for path, p in zip(input_paths, profiles)}
+    return stats
+
+
+def _filter_parallel(
+    read_filter: Union[QualityFilter, ExpectedErrorFilter],
+    input_paths: tuple[Path, ...],
+    output_paths: tuple[Path, ...],
+    workers: int,
+    index_dir: Optional[Path],
+    compression_level: int = 0,
+    profile: bool = False,
+) -> Optional[FilterStats]:
+    """
+    Split large uncompressed FASTQ input into balanced read ranges and
+    filter them in worker processes, each writing its own part of the
+    output. ``None`` when the input is not worth splitting.
+    """
+    chunks = plan_chunks(input_paths, workers, index_dir)
+    if chunks is None:
+        return None
+    stats = FilterStats()
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        futures = [
+            pool.submit(
+                _filter_range,
+                read_filter,
+                input_paths,
+                tuple(part_path(path, part) for path in output_paths),
+                start,
+                stop,
+                index_dir,
+                compression_level,
+                profile,
+            )
+            for part, (start, stop) in enumerate(chunks)
+        ]
+        for future in futures:
+            stats += future.result()
+    for path in output_paths:
+        join_parts(path, len(chunks))
+    return stats
+
+
+def filter_file(
+    read_filter: Union[QualityFilter, ExpectedErrorFilter],
+    input_path: Path,
+    output_path: Path,
+    workers: int = 1,
+    index_dir: Optional[Path] = None,
+    compression_level: int = 0,
+    profile: bool = False,
+) -> FilterStats:
+    """
+    Stream a FASTA/FASTQ file through a filter and write the passing reads,
+    BGZF-compressed unless ``compression_level`` is 0. With ``profile``,
+    the statistics of the input reads are collected in the same pass.
+
+    With several ``workers``, a large uncompressed FASTQ file is indexed and
+    filtered in parallel chunks; otherwise they (de)compress BGZF blocks.
+    """
+    stats = _filter_parallel(
+        read_filter, (input_path,), (output_path,), workers, index_dir, compression_level, profile
+    )
+    if stats is not None:
+        return stats
+    stats = FilterStats()
+    read_profile = ReadProfile()
+    with open_output(output_path, compression_level, workers) as out:
+        for batch in FastxReader(input_path, threads=workers):
+            if profile:
+                read_profile.add(batch)
+            write_batch(out, read_filter.apply(batch, stats))
+    if profile:
+        stats.profiles = {input_path.name: read_profile}
+    return stats
+
+
+def filter_pair_files(
+    read_filter: Union[QualityFilter, ExpectedErrorFilter],
+    input_paths: tuple[Path, Path],
+    output_paths: tuple[Path, Path],
+    workers: int = 1,
+    index_dir: Optional[Path] = None,
+    compression_level: int = 0,
+    profile: bool = False,
+) -> FilterStats:
+    """
+    Filter R1/R2 mate files together: a pair is kept only if both mates pass.
+    Outputs are BGZF-compressed unless ``compression_level`` is 0. With
+    ``profile``, the statistics of both input files are collected too.
+
+    With several ``workers``, large uncompressed FASTQ files are indexed and
+    filtered in parallel chunks; otherwise they (de)compress BGZF blocks.
+    """
+    stats = _filter_parallel(
+        read_filter, tuple(input_paths), tuple(output_paths), workers, index_dir,
+        compression_level, profile,
+    )
+    if stats is not None:
+        return stats
+    profiles = [ReadProfile(), ReadProfile()] if profile else []
+    with open_output(output_paths[0], compression_level, workers) as out1:
+        with open_output(output_paths[1], compression_level, workers) as out2:
+            stats = _filter_pairs(
+                read_filter, read_pair_batches(*input_paths, threads=workers), out1, out2, profiles
+            )
+    stats.profiles = {path.name: p for path, p in zip(input_paths, profiles)}
+    return stats
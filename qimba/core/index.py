@@ -0,0 +1,266 @@
+import hashlib
+import mmap
+import os
+import shutil
+from pathlib import Path
+from typing import Iterator, Optional, Sequence, Union
+
+import numpy as np
+
+from qimba.core.fastx import DEFAULT_CHUNK_SIZE, ReadBatch, _parse_fastq, is_gzipped
+
+# Index files start with this marker, the indexed file's size and mtime and
+# the number of records, followed by the record offsets
+_INDEX_MAGIC = 0x51494458_00000001
+_HEADER = 4
+INDEX_SUFFIX = ".fqi.npy"
+
+# Files smaller than this are not worth splitting between processes
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+
+_NEWLINE = 0x0A
+_COPY_BUFFER = 1024 * 1024
+
+
+def can_index(path: Path) -> bool:
+    """Whether a file is an uncompressed FASTQ file that can be memory-mapped."""
+    path = Path(path)
+    if path.stat().st_size == 0 or is_gzipped(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(1) == b"@"
+
+
+def index_path(path: Path, index_dir: Optional[Path] = None) -> Path:
+    """
+    Where the index of a file is cached: next to it, or in ``index_dir``
+    under a name unique to the file's absolute path.
+    """
+    path = Path(path)
+    if index_dir is None:
+        return path.with_name(path.name + INDEX_SUFFIX)
+    digest = hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:16]
+    return Path(index_dir) / f"{digest}-{path.name}{INDEX_SUFFIX}"
+
+
+def scan_offsets(data: np.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    Byte offsets of the FASTQ records in ``data``, followed by the end of
+    the last record. Every fourth newline ends a record.
+    """
+    size = len(data)
+    starts = [np.zeros(1, dtype=np.int64)]
+    seen = 0
+    for begin in range(0, size, chunk_size):
+        newlines = np.flatnonzero(data[begin:begin + chunk_size] == _NEWLINE) + begin
+        ends = newlines[(np.arange(len(newlines)) + seen) % 4 == 3]
+        starts.append(ends.astype(np.int64) + 1)
+        seen += len(newlines)
+    offsets = np.concatenate(starts)
+    tail = data[offsets[-1]:]
+    if seen % 4 == 3 and size and data[-1] != _NEWLINE:
+        # The last record lacks its final newline
+        offsets = np.append(offsets, size)
+    elif len(tail) and tail.tobytes().strip():
+        raise ValueError("Truncated FASTQ record at end of input")
+    if len(offsets) > 1 and np.any(data[offsets[:-1]] != ord("@")):
+        raise ValueError("Malformed FASTQ record (expected '@' header)")
+    return offsets
+
+
+class FastqIndex:
+    """
+    Byte offsets of every record of an uncompressed FASTQ file.
+
+    ``offsets`` has one entry per record plus the end of the last one, so
+    record ``i`` spans ``offsets[i]:offsets[i + 1]``. Indexes are cached on
+    disk and memory-mapped when loaded; a cached index is rebuilt when the
+    file's size or modification time changes.
+    """
+
+    def __init__(self, path: Path, offsets: np.ndarray):
+        self.path = Path(path)
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def size(self) -> int:
+        """Bytes covered by the records."""
+        return int(self.offsets[-1])
+
+    @classmethod
+    def build(cls, path: Path) -> "FastqIndex":
+        path = Path(path)
+        if path.stat().st_size == 0:
+            return cls(path, np.zeros(1, dtype=np.int64))
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = np.frombuffer(mm, dtype=np.uint8)
+            try:
+                offsets = scan_offsets(data)
+            except ValueError as e:
+                raise ValueError(f"{path}: {e}") from None
+            finally:
+                del data
+        return cls(path, offsets)
+
+    def save(self, destination: Path) -> None:
+        stat = self.path.stat()
+        header = np.array([_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(self)], dtype=np.int64)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destination.with_name(f"{destination.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, np.concatenate((header, self.offsets)))
+        os.replace(tmp, destination)
+
+    @classmethod
+    def load(cls, path: Path, index_dir: Optional[Path] = None) -> "FastqIndex":
+        """Load the cached index of a file, building and caching it if needed."""
+        path = Path(path)
+        cached = index_path(path, index_dir)
+        stat = path.stat()
+        try:
+            data = np.load(cached, mmap_mode="r")
+            if (
+                len(data) >= _HEADER + 1
+                and data[0] == _INDEX_MAGIC
+                and data[1] == stat.st_size
+                and data[2] == stat.st_mtime_ns
+                and data[3] == len(data) - _HEADER - 1
+            ):
+                return cls(path, data[_HEADER:])
+        except (OSError, ValueError):
+            pass
+        index = cls.build(path)
+        try:
+            index.save(cached)
+        except OSError:
+            # A read-only location only costs rebuilding the index next time
+            pass
+        return index
+
+    def chunks(self, parts: int) -> list[tuple[int, int]]:
+        """
+        Split the records into up to ``parts`` ranges ``(start, stop)`` of
+        about the same number of bytes.
+        """
+        n = len(self)
+        if n == 0:
+            return []
+        targets = np.linspace(0, self.size, max(1, parts) + 1)[1:-1]
+        bounds = np.unique(np.concatenate((
+            [0], np.searchsorted(self.offsets[:-1], targets), [n]
+        )))
+        return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+class MmapFastq:
+    """
+    Random access to the records of an uncompressed FASTQ file.
+
+    The file is memory-mapped and located through its ``FastqIndex``, so any
+    read or range of reads is parsed straight from the page cache without
+    reading the file from the start.
+    """
+
+    def __init__(self, path: Union[str, Path], index_dir: Optional[Path] = None):
+        self.path = Path(path)
+        self.index = FastqIndex.load(self.path, index_dir)
+        self._file = open(self.path, "rb")
+        if self.index.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = np.frombuffer(self._mmap, dtype=np.uint8)
+        else:
+            self._mmap = None
+            self.data = np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __enter__(self) -> "MmapFastq":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.data = np.empty(0, dtype=np.uint8)
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def batch(self, start: int, stop: int) -> ReadBatch:
+        """Parse reads ``start`` to ``stop`` (exclusive)."""
+        stop = min(stop, len(self))
+        if stop <= start:
+            return ReadBatch.empty()
+        offsets = self.index.offsets
+        view = self.data[offsets[start]:offsets[stop]]
+        if view[-1] != _NEWLINE:
+            view = np.append(view, np.uint8(_NEWLINE))
+        batch, _ = _parse_fastq(view, final=True)
+        return batch
+
+    def __getitem__(self, i: int) -> tuple[bytes, bytes, bytes]:
+        """The ``(name, seq, qual)`` of read ``i``."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return next(self.batch(i, i + 1).records())
+
+    def batch_reads(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+        """Reads per batch for batches of about ``chunk_size`` bytes."""
+        if not len(self):
+            return 1
+        return max(1, chunk_size * len(self) // max(1, self.index.size))
+
+    def batches(
+        self,
+        start: int = 0,
+        stop: Optional[int] = None,
+        batch_reads: Optional[int] = None,
+    ) -> Iterator[ReadBatch]:
+        """Iterate over a range of reads in batches of ``batch_reads`` reads."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        step = batch_reads or self.batch_reads()
+        for begin in range(start, stop, step):
+            yield self.batch(begin, min(begin + step, stop))
+
+
+def plan_chunks(
+    paths: Sequence[Path],
+    parts: int,
+    index_dir: Optional[Path] = None,
+    min_bytes: int = PARALLEL_MIN_BYTES,
+) -> Optional[list[tuple[int, int]]]:
+    """
+    Read ranges splitting a file, or mate files read together, between
+    ``parts`` workers; ``None`` when the files are compressed, not FASTQ, or
+    too small for splitting to pay off.
+    """
+    if parts <= 1 or not all(can_index(path) for path in paths):
+        return None
+    if sum(Path(path).stat().st_size for path in paths) < min_bytes:
+        return None
+    indexes = [FastqIndex.load(path, index_dir) for path in paths]
+    if any(len(index) != len(indexes[0]) for index in indexes[1:]):
+        raise ValueError(f"Mate files have different numbers of reads: {', '.join(map(str, paths))}")
+    return indexes[0].chunks(parts)
+
+
+def part_path(path: Path, part: int) -> Path:
+    """Temporary file holding one worker's share of an output file."""
+    return path.with_name(f"{path.name}.part{part}")
+
+
+def join_parts(path: Path, parts: int) -> None:
+    """Concatenate the part files of an output file in order, removing them."""
+    with open(path, "wb") as out:
+        for part in range(parts):
+            source = part_path(path, part)
+            with open(source, "rb") as f:
+                shutil.copyfileobj(f, out, _COPY_BUFFER)
+            source.unlink()
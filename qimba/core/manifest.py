@@ -0,0 +1,74 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from qimba.core.cache import fingerprint
+from qimba.core.samples import Sample
+
+MANIFEST_NAME = "manifest.json"
+_VERSION = 1
+
+
+@dataclass
+class Manifest:
+    """
+    Record of the samples whose reads make up the results in an output
+    directory, and of the settings they were processed with.
+
+    ``samples`` maps each sample name to the fingerprints of its input
+    files. Incremental runs use it to tell new samples from those already
+    counted, and to notice recorded samples whose reads have changed.
+    """
+    samples: dict[str, list] = field(default_factory=dict)
+    params: dict = field(default_factory=dict)
+    updated: float = 0.0
+
+    @classmethod
+    def load(cls, output_dir: Path) -> Optional["Manifest"]:
+        """The manifest of an output directory, or ``None`` if it has none."""
+        path = Path(output_dir) / MANIFEST_NAME
+        if not path.exists():
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != _VERSION:
+            raise ValueError(f"{path}: unsupported manifest version {data.get('version')}")
+        return cls(samples=data["samples"], params=data["params"], updated=data["updated"])
+
+    def save(self, output_dir: Path) -> None:
+        path = Path(output_dir) / MANIFEST_NAME
+        self.updated = time.time()
+        data = {
+            "version": _VERSION,
+            "updated": self.updated,
+            "params": self.params,
+            "samples": self.samples,
+        }
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2, default=str)
+        os.replace(tmp, path)
+
+    def add(self, samples: list[Sample]) -> None:
+        for sample in samples:
+            self.samples[sample.name] = [fingerprint(path) for path in sample.files]
+
+    def new_samples(self, samples: list[Sample]) -> list[Sample]:
+        """The samples not recorded yet, in their original order."""
+        return [sample for sample in samples if sample.name not in self.samples]
+
+    def changed_samples(self, samples: list[Sample]) -> list[str]:
+        """
+        Names of recorded samples whose input files differ from those
+        recorded. Files are compared by size and modification time, not by
+        location, so that the input directory may move.
+        """
+        return [
+            sample.name for sample in samples
+            if sample.name in self.samples
+            and [recorded[1:] for recorded in self.samples[sample.name]]
+            != [fingerprint(path)[1:] for path in sample.files]
+        ]
@@ -0,0 +1,348 @@
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from qimba.core.align import _popcount
+from qimba.core.fastx import ReadBatch, _offsets, ragged_take, read_pair_batches
+from qimba.core.qcstats import PHRED_OFFSET, QUALITY_BINS
+from qimba.core.stream import BatchWriter, prefetch
+from qimba.utils.config import MergeConfig
+
+# Score of an overlap: its length, less this much for every mismatch
+_MISMATCH_COST = 4
+# Positions are compared 64 to a word, one word array per bit of the code
+_WORD = 64
+# Bit planes: low and high bit of the 2-bit code, and whether the base is called
+_PLANES = 3
+
+# Complement of every sequence byte; anything but ACGT is left as it is
+_COMPLEMENT = np.arange(256, dtype=np.uint8)
+for _base, _pair in zip(b"ACGTacgt", b"TGCAtgca"):
+    _COMPLEMENT[_base] = _pair
+
+
+def _posterior_table(max_quality: int) -> np.ndarray:
+    """
+    Encoded quality of an overlap base, indexed by ``(score1 * QUALITY_BINS
+    + score2) * 2 + agree`` for the Phred scores of its two reads and
+    whether they agree; when they disagree, the base of the higher score
+    is the one kept.
+
+    These are the posterior error probabilities of Edgar & Flyvbjerg
+    (2015), assuming errors turn a base into each of the other three alike.
+    """
+    error = 10.0 ** (-np.arange(QUALITY_BINS) / 10.0)
+    # Scores of 0 or 1 would claim error rates of 3/4 or more
+    error = np.minimum(error, 0.75)
+    p1, p2 = error[:, None], error[None, :]
+    agree = (p1 * p2 / 3) / (1 - p1 - p2 + 4 * p1 * p2 / 3)
+    high, low = np.minimum(p1, p2), np.maximum(p1, p2)
+    disagree = high * (1 - low / 3) / (high + low - 4 * high * low / 3)
+    scores = np.rint(-10 * np.log10(np.maximum(np.stack((disagree, agree), axis=2), 1e-30)))
+    return (np.clip(scores, 0, max_quality) + PHRED_OFFSET).astype(np.uint8).ravel()
+
+
+def _called(seqs: np.ndarray) -> np.ndarray:
+    """Whether every base is A, C, G or T, in either case."""
+    upper = seqs & 0xDF
+    return (upper == ord("A")) | (upper == ord("C")) | (upper == ord("G")) | (upper == ord("T"))
+
+
+def _scores(quals: np.ndarray) -> np.ndarray:
+    """Phred scores of encoded qualities, within the table's range."""
+    return (np.clip(quals, PHRED_OFFSET, PHRED_OFFSET + QUALITY_BINS - 1) - PHRED_OFFSET).astype(np.int32)
+
+
+@dataclass
+class MergeStats:
+    """Counters accumulated while merging read pairs."""
+    pairs: int = 0
+    merged: int = 0
+    no_overlap: int = 0
+    too_short: int = 0
+    too_long: int = 0
+    overlap_bases: int = 0
+    mismatches: int = 0
+
+    def __add__(self, other: "MergeStats") -> "MergeStats":
+        return MergeStats(**{
+            f.name: getattr(self, f.name) + getattr(other, f.name) for f in fields(self)
+        })
+
+    @property
+    def merge_rate(self) -> float:
+        return self.merged / self.pairs if self.pairs else 0.0
+
+    @property
+    def mean_overlap(self) -> float:
+        return self.overlap_bases / self.merged if self.merged else 0.0
+
+
+def _padded(
+    batch: ReadBatch, values: np.ndarray, width: int, fill: int, reverse: bool = False
+) -> np.ndarray:
+    """
+    Per-base ``values`` of a batch (its sequences or qualities) as a
+    ``(reads, width)`` matrix padded with ``fill``; with ``reverse``, each
+    read back to front.
+    """
+    lengths = batch.lengths
+    if len(batch) and width == values.size // len(batch) and (lengths == width).all():
+        # Reads of one length, as they come off the sequencer
+        matrix = values.reshape(len(batch), width)
+        return matrix[:, ::-1] if reverse else matrix
+    columns = np.arange(width)
+    valid = columns < lengths[:, None]
+    if reverse:
+        index = (batch.seq_offsets[1:, None] - 1) - columns
+    else:
+        index = batch.seq_offsets[:-1, None] + columns
+    matrix = values[np.where(valid, index, 0)] if len(values) else np.zeros(valid.shape, dtype=np.uint8)
+    matrix[~valid] = fill
+    return matrix
+
+
+def _bit_planes(seqs: np.ndarray, words: int) -> np.ndarray:
+    """
+    The bases of a padded sequence matrix as ``(_PLANES, words, reads)``
+    64-bit words, bit ``j`` of a word standing for the ``j``-th base it
+    covers. Words are the middle axis, so that one word of all reads is
+    contiguous.
+    """
+    # Bits 1 and 2 of the ASCII code tell A, C, G and T apart in either case
+    called = _called(seqs)
+    out = np.zeros((_PLANES, len(seqs), words * 8), dtype=np.uint8)
+    size = -(-seqs.shape[1] // 8)
+    for plane, bits in enumerate((seqs & 2, seqs & 4, called)):
+        out[plane, :, :size] = np.packbits(bits.astype(bool) & called, axis=1, bitorder="little")
+    return np.ascontiguousarray(out.view("<u8").transpose(0, 2, 1))
+
+
+class PairMerger:
+    """
+    Vectorised merging of read pairs into single reads covering the
+    whole fragment.
+
+    The forward read is compared with the reverse complement of the
+    reverse read at every start of the overlap, for all pairs of a batch
+    at once: bases are held as bit planes of 64-bit words, so a shift, a
+    few XORs and a population count give the mismatches of 64 positions.
+    The overlap scoring best (its length, less ``_MISMATCH_COST`` per
+    mismatch) among those at least ``min_overlap`` long with at most
+    ``max_mismatches`` mismatches is kept. Overlap bases take the call of
+    the read with the higher quality and a posterior quality from lookup
+    tables; uncalled bases (N) never count as mismatches.
+
+    The reverse read may end inside the forward read, whose extra bases
+    are then dropped, but may not start before it.
+    """
+
+    def __init__(
+        self,
+        min_overlap: int = 16,
+        max_mismatches: int = 5,
+        min_length: int = 0,
+        max_length: int = 0,
+        max_quality: int = 41,
+    ):
+        self.min_overlap = max(1, min_overlap)
+        self.max_mismatches = max_mismatches
+        self.min_length = min_length
+        self.max_length = max_length
+        self.max_quality = max_quality
+        self._posterior = _posterior_table(max_quality)
+
+    @classmethod
+    def from_config(cls, merge: MergeConfig) -> "PairMerger":
+        return cls(
+            min_overlap=merge.min_overlap,
+            max_mismatches=merge.max_mismatches,
+            min_length=merge.min_length,
+            max_length=merge.max_length,
+            max_quality=merge.max_quality,
+        )
+
+    def _best_overlaps(
+        self,
+        forward: np.ndarray,
+        reverse: np.ndarray,
+        lengths1: np.ndarray,
+        lengths2: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Start of the best overlap in the forward read of every pair (-1 if
+        none qualifies), its length and its mismatches.
+
+        Every start is first checked on one word only: at a wrong start
+        about 3 in 4 bases differ, so that word already rules out nearly
+        every pair, and only the rest are counted in full. Starts are
+        visited in order, so of equal scores the longer overlap is kept.
+        """
+        n = len(lengths1)
+        words2 = max(1, -(-int(lengths2.max()) // _WORD))
+        last_start = int(lengths1.max()) - self.min_overlap
+        # Room to read as many words as the reverse read has from the last start
+        words1 = last_start // _WORD + words2 + 1
+        a = _bit_planes(forward, words1)
+        b = _bit_planes(reverse, words2)
+        best_start = np.full(n, -1, dtype=np.int64)
+        best_score = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+        best_mismatches = np.zeros(n, dtype=np.int64)
+        for start in range(last_start + 1):
+            word, bit = divmod(start, _WORD)
+            # The first word of the forward read from this start, all planes
+            first = a[:, word] >> np.uint64(bit)
+            if bit:
+                first |= a[:, word + 1] << np.uint64(_WORD - bit)
+            # Positions where both bases are called and their codes differ
+            diff = (first[0] ^ b[0, 0]) | (first[1] ^ b[1, 0])
+            diff &= first[2]
+            diff &= b[2, 0]
+            pairs = np.flatnonzero(_popcount(diff) <= self.max_mismatches)
+            overlap = np.minimum(lengths1[pairs] - start, lengths2[pairs])
+            keep = overlap >= self.min_overlap
+            pairs, overlap = pairs[keep], overlap[keep]
+            if not len(pairs):
+                continue
+            rows = a[:, word:word + words2 + 1, pairs] >> np.uint64(bit)
+            if bit:
+                rows[:, :-1] |= a[:, word + 1:word + words2 + 1, pairs] << np.uint64(_WORD - bit)
+            rows, other = rows[:, :words2], b[:, :, pairs]
+            diff = (rows[0] ^ other[0]) | (rows[1] ^ other[1])
+            diff &= rows[2] & other[2]
+            mismatches = _popcount(diff).sum(axis=0)
+            score = overlap - _MISMATCH_COST * mismatches
+            better = (mismatches <= self.max_mismatches) & (score > best_score[pairs])
+            pairs = pairs[better]
+            best_start[pairs] = start
+            best_score[pairs] = score[better]
+            best_mismatches[pairs] = mismatches[better]
+        overlap = np.where(best_start >= 0, np.minimum(lengths1 - best_start, lengths2), 0)
+        return best_start, overlap, best_mismatches
+
+    def merge(self, r1: ReadBatch, r2: ReadBatch, stats: Optional[MergeStats] = None) -> ReadBatch:
+        """
+        Merge the pairs of two mate batches, returning the merged reads
+        under the names of the forward reads.
+        """
+        if len(r1) != len(r2):
+            raise ValueError(f"Mate batches differ in size: {len(r1)} and {len(r2)} reads")
+        if r1.quals is None or r2.quals is None:
+            raise ValueError("Merging read pairs needs quality scores")
+        n = len(r1)
+        if n == 0:
+            return ReadBatch.empty()
+        lengths1, lengths2 = r1.lengths, r2.lengths
+        width1, width2 = max(1, int(lengths1.max())), max(1, int(lengths2.max()))
+        forward = _padded(r1, r1.seqs, width1, ord("N"))
+        reverse = _COMPLEMENT[_padded(r2, r2.seqs, width2, ord("N"), reverse=True)]
+        start, overlap, mismatches = self._best_overlaps(forward, reverse, lengths1, lengths2)
+
+        found = start >= 0
+        merged_lengths = np.where(found, start + lengths2, 0)
+        keep = found.copy()
+        too_short = found & (merged_lengths < self.min_length)
+        keep &= ~too_short
+        too_long = keep & (self.max_length > 0) & (merged_lengths > self.max_length)
+        keep &= ~too_long
+        if stats is not None:
+            stats.pairs += n
+            stats.merged += int(keep.sum())
+            stats.no_overlap += int((~found).sum())
+            stats.too_short += int(too_short.sum())
+            stats.too_long += int(too_long.sum())
+            stats.overlap_bases += int(overlap[keep].sum())
+            stats.mismatches += int(mismatches[keep].sum())
+
+        index = np.flatnonzero(keep)
+        if not len(index):
+            return ReadBatch.empty()
+        start, overlap, lengths = start[index], overlap[index], merged_lengths[index]
+        lengths2 = lengths2[index]
+
+        # The reverse-complemented reverse reads, whose overlap with the
+        # forward reads is replaced by the consensus of both
+        everything = len(index) == n
+        seqs2 = reverse if everything else reverse[index]
+        quals2 = _padded(r2, r2.quals, width2, PHRED_OFFSET, reverse=True)
+        # Copied, as the padded qualities may be a view of the batch
+        quals2 = quals2.copy() if everything else quals2[index]
+        quals1 = _padded(r1, r1.quals, width1, PHRED_OFFSET)
+        width = int(overlap.max())
+        columns = np.arange(width)
+        in_overlap = columns < overlap[:, None]
+        rows = index[:, None]
+        in_forward = np.minimum(start[:, None] + columns, width1 - 1)
+        base1, qual1 = forward[rows, in_forward], quals1[rows, in_forward]
+        base2, qual2 = seqs2[:, :width], quals2[:, :width]
+        score1, score2 = _scores(qual1), _scores(qual2)
+        called1, called2 = _called(base1), _called(base2)
+        agree = (base1 | 0x20) == (base2 | 0x20)
+        # Outside the overlap and where only the reverse read is trusted
+        # more, its base stays
+        take1 = in_overlap & called1 & ~(called2 & ~agree & (score2 > score1))
+        posterior = self._posterior[(score1 * QUALITY_BINS + score2) * 2 + agree]
+        seqs2[:, :width] = np.where(take1, base1, base2)
+        quals2[:, :width] = np.where(
+            in_overlap & called1 & called2, posterior, np.where(take1, qual1, qual2)
+        )
+
+        # A merged read is the forward read up to the overlap, then the
+        # reverse read: gather both from one buffer, sequences and
+        # qualities with the same index
+        if (lengths2 == width2).all():
+            seqs2, quals2 = seqs2.ravel(), quals2.ravel()
+        else:
+            valid = np.arange(width2) < lengths2[:, None]
+            seqs2, quals2 = seqs2[valid], quals2[valid]
+        flat2 = len(r1.seqs) + np.cumsum(lengths2) - lengths2
+        starts = np.stack([r1.seq_offsets[:-1][index], flat2], axis=1).ravel()
+        parts = np.stack([start, lengths2], axis=1).ravel()
+        # One gather index into both, as ragged_take would build it
+        dtype = np.int32 if len(r1.seqs) + len(seqs2) < 2 ** 31 else np.int64
+        gather = np.arange(int(parts.sum()), dtype=dtype)
+        gather += np.repeat((starts - (np.cumsum(parts) - parts)).astype(dtype), parts)
+        seqs = np.concatenate((r1.seqs, seqs2))[gather]
+        quals = np.concatenate((r1.quals, quals2))[gather]
+        name_lengths = np.diff(r1.name_offsets)[index]
+        return ReadBatch(
+            names=ragged_take(r1.names, r1.name_offsets[:-1][index], name_lengths),
+            name_offsets=_offsets(name_lengths),
+            seqs=seqs,
+            seq_offsets=_offsets(lengths),
+            quals=quals,
+        )
+
+
+def merge_batches(
+    merger: PairMerger,
+    pairs: Iterable[tuple[ReadBatch, ReadBatch]],
+    stats: Optional[MergeStats] = None,
+) -> Iterator[ReadBatch]:
+    """Merge a stream of mate batch pairs batch by batch."""
+    for r1, r2 in pairs:
+        yield merger.merge(r1, r2, stats)
+
+
+def merge_pair_files(
+    merger: PairMerger,
+    inputs: tuple[Path, Path],
+    output: Path,
+    threads: int = 1,
+    compression_level: int = 0,
+    max_batches: int = 4,
+) -> MergeStats:
+    """
+    Merge the read pairs of two mate files into one file.
+
+    Reading runs ahead of merging, and writing behind it, in background
+    threads, at most ``max_batches`` batches apart.
+    """
+    stats = MergeStats()
+    pairs = prefetch(read_pair_batches(*inputs, threads=threads), max_batches)
+    with BatchWriter((output,), compression_level, threads, max_batches) as writer:
+        for batch in merge_batches(merger, pairs, stats):
+            writer.write((batch,))
+    return stats
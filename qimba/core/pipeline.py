@@ -1,12 +1,448 @@
+import json
+from concurrent.futures import Executor as PoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Iterable, Iterator, Optional
 from rich.console import Console
 
+from qimba import __version__
 from qimba.utils.config import Config
-from qimba.core.executor import Executor
+from qimba.core.cache import StepCache
+from qimba.core.chimera import ChimeraDetector, ChimeraSummary, remove_chimeras
+from qimba.core.denoiser import UNIQUE_ASVS, Denoiser, DenoiseSummary
+from qimba.core.derep import Dereplicator
+from qimba.core.executor import AsyncExecutor, Executor, tool_version
+from qimba.core.fastx import FastxReader, ReadBatch, find_fastx_files, output_name, read_pair_batches
+from qimba.core.filters import FilterStats, QualityFilter, filter_batches, filter_file, filter_pair_files
+from qimba.core.manifest import MANIFEST_NAME, Manifest
+from qimba.core.merge import MergeStats, PairMerger, merge_pair_files
+from qimba.core.profiling import Profiler
+from qimba.core.qcstats import QC_REPORT_NAME, QCReport, ReadProfile, write_report
+from qimba.core.resources import Reservation, ResourceManager
+from qimba.core.samples import Sample, SampleResult, discover_samples, split_threads
+from qimba.core.scheduler import Scheduler, Step, StepGraph, Task
+from qimba.core.stream import BatchWriter, prefetch
+from qimba.core.workqueue import LocalWorkers, QueueExecutor, WorkQueue
+from qimba.core.table import TABLE_SUFFIX
 
 console = Console()
 
+def qc_sample(
+    config: Config,
+    sample: Sample,
+    output_dir: Path,
+    threads: int = 1,
+) -> SampleResult:
+    """Run quality control on one sample."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if config.qc.engine == "native":
+        read_filter = QualityFilter.from_config(config.qc)
+        compressed = bool(config.compression_level)
+        if sample.paired:
+            outputs = (
+                output_dir / output_name(sample.r1, compressed),
+                output_dir / output_name(sample.r2, compressed),
+            )
+            stats = filter_pair_files(
+                read_filter, (sample.r1, sample.r2), outputs,
+                workers=threads, index_dir=config.index_dir,
+                compression_level=config.compression_level, profile=config.qc.stats,
+            )
+            output = Sample(name=sample.name, r1=outputs[0], r2=outputs[1])
+        else:
+            output = Sample(name=sample.name, r1=output_dir / output_name(sample.r1, compressed))
+            stats = filter_file(
+                read_filter, sample.r1, output.r1,
+                workers=threads, index_dir=config.index_dir,
+                compression_level=config.compression_level, profile=config.qc.stats,
+            )
+        return SampleResult(sample=sample.name, output=output, stats=stats)
+        
+    result = Executor(config).run_qc_tool(
+        input_dir=sample.r1.parent,
+        output_dir=output_dir,
+        min_quality=config.qc.min_quality,
+        threads=threads,
+        input_files=sample.files,
+        log_name=f"qc_{sample.name}",
+        # Held for this step by the scheduler
+        reservation=Reservation(threads, config.qc.memory_mb),
+    )
+    # External QC tools only report on the reads, which pass through unchanged
+    return SampleResult(
+        sample=sample.name, success=result.success, error=result.error, output=sample
+    )
+
+def qc_report(
+    config: Config,
+    results: list[SampleResult],
+    output_dir: Path,
+    threads: int = 1,
+) -> QCReport:
+    """Write the read statistics collected by native QC for every input file."""
+    return _qc_report(results, output_dir)
+
+def extend_qc_report(
+    config: Config,
+    results: list[SampleResult],
+    output_dir: Path,
+    threads: int = 1,
+) -> QCReport:
+    """Add the read statistics of new samples to an earlier QC report."""
+    return _qc_report(results, output_dir, update=True)
+
+def _qc_report(results: list[SampleResult], output_dir: Path, update: bool = False) -> QCReport:
+    profiles = {
+        name: profile
+        for result in results if result.stats is not None
+        for name, profile in result.stats.profiles.items()
+    }
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / QC_REPORT_NAME
+    write_report(profiles, path, update=update)
+    return QCReport(profiles=profiles, files=[path])
+
+async def external_qc(
+    config: Config,
+    samples: list[Sample],
+    output_dir: Path,
+    threads: int = 1,
+) -> list[SampleResult]:
+    """
+    Run the external QC tool on every sample from this one process.
+    
+    The tool invocations are asyncio subprocesses, as many at once as the
+    thread budget allows; the first failure cancels the others.
+    """
+    workers, threads = split_threads(threads, len(samples), config.threads_per_sample)
+    executor = AsyncExecutor(config, max_concurrency=workers)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results = await executor.run_all(
+        executor.run_qc_tool(
+            input_dir=sample.r1.parent,
+            output_dir=output_dir,
+            min_quality=config.qc.min_quality,
+            threads=threads,
+            input_files=sample.files,
+            log_name=f"qc_{sample.name}"
+        )
+        for sample in samples
+    )
+    return [
+        SampleResult(sample=sample.name, success=result.success, error=result.error, output=sample)
+        for sample, result in zip(samples, results)
+    ]
+
+def merge_sample(
+    config: Config,
+    sample: Sample,
+    output_dir: Path,
+    threads: int = 1,
+) -> SampleResult:
+    """
+    Merge the read pairs of one sample into single reads for native denoising.
+
+    Single-end samples pass through unchanged.
+    """
+    if not sample.paired:
+        return SampleResult(sample=sample.name, output=sample)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output = Sample(
+        name=sample.name,
+        r1=output_dir / output_name(sample.r1, bool(config.compression_level)),
+    )
+    stats = merge_pair_files(
+        PairMerger.from_config(config.merge), (sample.r1, sample.r2), output.r1,
+        threads=threads, compression_level=config.compression_level,
+    )
+    return SampleResult(sample=sample.name, output=output, merge=stats)
+
+def denoise_sample(
+    config: Config,
+    sample: Sample,
+    output_dir: Path,
+    threads: int = 1,
+) -> SampleResult:
+    """
+    Expected-error filter and dereplicate one sample for native denoising.
+    
+    Paired samples are denoised on their forward reads.
+    """
+    denoiser = Denoiser(
+        config.denoise, temp_dir=config.temp_dir, compression_level=config.compression_level
+    )
+    dereplicator = denoiser.new_dereplicator()
+    filtered = output_dir / "filtered"
+    stats = denoiser.process_sample(
+        sample.r1, filtered, dereplicator, sample.name,
+        workers=threads, index_dir=config.index_dir,
+    )
+    return SampleResult(
+        sample=sample.name,
+        output=Sample(
+            name=sample.name,
+            r1=filtered / output_name(sample.r1, bool(config.compression_level)),
+        ),
+        stats=stats,
+        uniques=dereplicator.finish(),
+    )
+
+def stream_sample(
+    config: Config,
+    sample: Sample,
+    output_dir: Path,
+    threads: int = 1,
+) -> SampleResult:
+    """
+    Quality filter one sample and stream the passing reads straight into
+    expected-error filtering and dereplication, without writing them.
+
+    QC runs in a background thread at most ``stream_buffer`` batches ahead
+    of dereplication. With ``stream_keep_qc`` the quality-filtered reads are
+    still written to ``qc_filtered``, by another background thread.
+    Paired samples are filtered as pairs, then merged with ``config.merge``
+    enabled or else denoised on their forward reads.
+    """
+    read_filter = QualityFilter.from_config(config.qc)
+    denoiser = Denoiser(
+        config.denoise, temp_dir=config.temp_dir, compression_level=config.compression_level
+    )
+    dereplicator = denoiser.new_dereplicator()
+    inputs = tuple(sample.files)
+    profiles = [ReadProfile() for _ in inputs] if config.qc.stats else []
+    compressed = bool(config.compression_level)
+    kept = tuple(output_dir / "qc_filtered" / output_name(path, compressed) for path in inputs)
+    writer = (
+        BatchWriter(kept, config.compression_level, threads, config.stream_buffer)
+        if config.stream_keep_qc else None
+    )
+    if sample.paired:
+        batches = read_pair_batches(*inputs, threads=threads)
+    else:
+        batches = ((batch,) for batch in FastxReader(sample.r1, threads=threads))
+
+    merger = PairMerger.from_config(config.merge) if config.merge.enabled and sample.paired else None
+    merged = MergeStats() if merger is not None else None
+    stats = FilterStats()
+
+    def passing_reads() -> Iterator[ReadBatch]:
+        nonlocal stats
+        for batch_stats, group in filter_batches(read_filter, batches, profiles):
+            stats += batch_stats
+            if writer is not None:
+                writer.write(group)
+            yield group[0] if merger is None else merger.merge(*group, merged)
+
+    with writer or nullcontext():
+        ee_stats = denoiser.filter_batches(
+            prefetch(passing_reads(), config.stream_buffer), None, dereplicator, sample.name
+        )
+    stats.profiles = {path.name: profile for path, profile in zip(inputs, profiles)}
+    output = None
+    if config.stream_keep_qc:
+        output = Sample(name=sample.name, r1=kept[0], r2=kept[1] if sample.paired else None)
+    return SampleResult(
+        sample=sample.name, output=output, stats=stats, ee_stats=ee_stats,
+        uniques=dereplicator.finish(), merge=merged,
+        # The reads the uniques come from, also when none are written
+        files=list(inputs),
+    )
+
+def pool_denoise(
+    config: Config,
+    results: list[SampleResult],
+    output_dir: Path,
+    threads: int = 1,
+) -> DenoiseSummary:
+    """Pool the per-sample uniques and finish native denoising."""
+    denoiser, combined, summary = _pool_uniques(config, results)
+    denoiser.find_asvs(denoiser.dereplicate(combined, output_dir, summary), output_dir, summary)
+    return summary
+
+def extend_denoise(
+    config: Config,
+    results: list[SampleResult],
+    output_dir: Path,
+    threads: int = 1,
+) -> DenoiseSummary:
+    """
+    Pool the uniques of new samples and add them to the ASVs and count
+    table of an earlier native denoising run in ``output_dir``.
+    """
+    denoiser, combined, summary = _pool_uniques(config, results)
+    denoiser.extend_asvs(combined.finish(), output_dir, summary)
+    return summary
+
+def _pool_uniques(
+    config: Config,
+    results: list[SampleResult],
+) -> tuple[Denoiser, Dereplicator, DenoiseSummary]:
+    denoiser = Denoiser(config.denoise, temp_dir=config.temp_dir)
+    combined = denoiser.new_dereplicator()
+    summary = DenoiseSummary()
+    for result in results:
+        stats = result.stats if result.ee_stats is None else result.ee_stats
+        summary.samples[result.sample] = stats
+        summary.filter_stats += stats
+        result.uniques.add_to(combined)
+    return denoiser, combined, summary
+
+def chimera_filter(
+    config: Config,
+    summary: DenoiseSummary,
+    output_dir: Path,
+    threads: int = 1,
+) -> ChimeraSummary:
+    """Remove chimeric ASVs from the output of native denoising."""
+    files = {path.name: path for path in summary.files}
+    return remove_chimeras(
+        files["asvs.fasta"],
+        files[f"asv_table{TABLE_SUFFIX}"],
+        output_dir,
+        ChimeraDetector.from_config(config.denoise, workers=threads),
+    )
+
+def external_denoise(
+    config: Config,
+    results: list[SampleResult],
+    output_dir: Path,
+    threads: int = 1,
+) -> SampleResult:
+    """Run the external denoising tool over the directory holding the reads."""
+    input_dir = results[0].output.r1.parent
+    result = Executor(config).run_denoise_tool(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        threads=threads,
+        # Held for this step by the scheduler
+        reservation=Reservation(threads, config.denoise.memory_mb),
+    )
+    return SampleResult(sample="all", success=result.success, error=result.error)
+
+def _qc_params(config: Config) -> dict:
+    if config.qc.engine == "native":
+        return {
+            "qc": config.qc.model_dump(exclude={"tool"}),
+            "compression_level": config.compression_level,
+            "version": __version__,
+        }
+    return {
+        "min_quality": config.qc.min_quality,
+        "tool": config.qc.tool,
+        "version": tool_version(config.qc.tool),
+    }
+
+def _denoise_sample_params(config: Config) -> dict:
+    return {
+        "max_ee": config.denoise.max_ee,
+        "truncate_ee": config.denoise.truncate_ee,
+        "compression_level": config.compression_level,
+        "version": __version__,
+    }
+
+def _merge_params(config: Config) -> dict:
+    return {
+        "merge": config.merge.model_dump(),
+        "compression_level": config.compression_level,
+        "version": __version__,
+    }
+
+def _pool_denoise_params(config: Config) -> dict:
+    return {
+        "min_reads": config.denoise.min_reads,
+        "unoise_alpha": config.denoise.unoise_alpha,
+        "version": __version__,
+    }
+
+def _chimera_params(config: Config) -> dict:
+    return {
+        "chimera_min_fold": config.denoise.chimera_min_fold,
+        "version": __version__,
+    }
+
+def _incremental_params(config: Config) -> dict:
+    # Settings that must not change between the runs adding to one output
+    return {
+        "qc": _qc_params(config),
+        "merge": _merge_params(config) if config.merge.enabled else None,
+        "denoise_sample": _denoise_sample_params(config),
+        "denoise": _pool_denoise_params(config),
+    }
+
+def _stream_params(config: Config) -> dict:
+    return {
+        "qc": _qc_params(config),
+        "merge": _merge_params(config) if config.merge.enabled else None,
+        "denoise_sample": _denoise_sample_params(config),
+        "keep_qc": config.stream_keep_qc,
+    }
+
+def build_graph(config: Config, incremental: bool = False) -> StepGraph:
+    """
+    The default Qimba step graph for a configuration.
+
+    With ``incremental``, pooled denoising adds the samples to the results
+    already in the output directory instead of replacing them. With
+    ``config.stream`` and native engines, QC and per-sample denoising are
+    fused into one streaming step. With ``config.merge.enabled`` and native
+    denoising, read pairs are merged before they are denoised.
+    """
+    graph = StepGraph()
+    native = config.qc.engine == "native" and config.denoise.engine == "native"
+    if config.stream and native:
+        graph.add(Step(
+            "qc_denoise", stream_sample, output="denoise_results",
+            memory_mb=config.qc.memory_mb + config.denoise.derep_memory_mb,
+            params=_stream_params,
+        ))
+        sample_step = "qc_denoise"
+    else:
+        graph.add(Step(
+            "qc", qc_sample, output="qc_results",
+            memory_mb=config.qc.memory_mb, params=_qc_params,
+        ))
+        sample_step = "qc"
+    if config.qc.engine == "native" and config.qc.stats:
+        graph.add(Step(
+            "qc_report", extend_qc_report if incremental else qc_report,
+            inputs=(sample_step,), output="qc_results", per_sample=False, threads=1,
+            params=None if incremental else _qc_params,
+        ))
+    if config.denoise.engine == "native":
+        if sample_step == "qc":
+            if config.merge.enabled:
+                graph.add(Step(
+                    "merge", merge_sample, inputs=("qc",), output="merge_results",
+                    params=_merge_params,
+                ))
+                sample_step = "merge"
+            graph.add(Step(
+                "denoise_sample", denoise_sample, inputs=(sample_step,),
+                output="denoise_results", memory_mb=config.denoise.derep_memory_mb,
+                params=_denoise_sample_params,
+            ))
+            sample_step = "denoise_sample"
+        graph.add(Step(
+            "denoise", extend_denoise if incremental else pool_denoise,
+            inputs=(sample_step,), output="denoise_results",
+            per_sample=False, threads=1, memory_mb=config.denoise.derep_memory_mb,
+            # Extending updates the earlier results in place, so never cached
+            params=None if incremental else _pool_denoise_params,
+        ))
+        graph.add(Step(
+            "chimeras", chimera_filter, inputs=("denoise",),
+            output="chimera_results", per_sample=False,
+            params=_chimera_params,
+        ))
+    else:
+        # The external denoiser's outputs are unknown, so it is never cached
+        graph.add(Step(
+            "denoise", external_denoise, inputs=("qc",),
+            output="denoise_results", per_sample=False,
+            memory_mb=config.denoise.memory_mb,
+        ))
+    return graph
+
 class Pipeline:
     """
     Pipeline orchestrator for running the complete Qimba workflow.
@@ -17,34 +453,165 @@ class Pipeline:
         input_dir: Path,
         output_dir: Path,
         threads: int = 1,
-        config: Optional[Config] = None
+        config: Optional[Config] = None,
+        incremental: bool = False,
     ):
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.threads = threads
         self.config = config or Config()
-        self.executor = Executor(self.config)
+        if self.config.threads != threads:
+            # Tools run by the steps size their thread budget from the config
+            self.config = self.config.model_copy(update={"threads": threads})
+        self.incremental = incremental
+        self.graph = build_graph(self.config, incremental)
+        self.cached_tasks = 0
+        self.retried_tasks = 0
+        
+    def input_files(self) -> list[Path]:
+        """FASTA/FASTQ files found in the input directory."""
+        return find_fastx_files(self.input_dir)
+        
+    def samples(self, input_dir: Optional[Path] = None) -> list[Sample]:
+        """Samples (single files or R1/R2 pairs) found in a directory."""
+        return discover_samples(input_dir or self.input_dir)
+        
+    def cache(self) -> Optional[StepCache]:
+        """The step cache, if enabled in the configuration."""
+        if not self.config.cache:
+            return None
+        return StepCache(
+            self.config.cache_dir,
+            max_bytes=self.config.cache_max_mb * 1024 * 1024,
+            content_hash=self.config.cache_content_hash,
+        )
+        
+    def resources(self) -> ResourceManager:
+        """
+        The thread and memory budget that the steps of a run share.
+
+        With the queue backend, the threads are the job slots of all
+        workers, and memory is only limited when set explicitly since the
+        workers' machines are unknown here.
+        """
+        if self.config.backend == "queue":
+            return ResourceManager(self.threads, self.config.memory_mb)
+        return ResourceManager.from_config(self.config)
+
+    def work_queue(self) -> Optional[WorkQueue]:
+        """The queue shared with ``qimba worker`` processes, for the queue backend."""
+        if self.config.backend != "queue":
+            return None
+        return WorkQueue(self.config.work_queue_dir)
         
-    def run_qc(self) -> None:
-        """Run the quality control step."""
-        qc_output = self.output_dir / "qc_results"
-        result = self.executor.run_qc_tool(
-            input_dir=self.input_dir,
-            output_dir=qc_output,
-            threads=self.threads
+    def manifest(self) -> Optional[Manifest]:
+        """The record of the samples already in the output directory."""
+        return Manifest.load(self.output_dir)
+
+    def pending_samples(self) -> list[Sample]:
+        """
+        The samples a run processes: all of them, or in incremental mode
+        those not recorded in the manifest yet.
+        """
+        samples = self.samples()
+        if not self.incremental:
+            return samples
+        manifest = self.manifest()
+        if manifest is None:
+            raise RuntimeError(f"No {MANIFEST_NAME} in {self.output_dir} to add samples to")
+        if self.config.denoise.engine != "native":
+            raise RuntimeError("Incremental runs need the native denoising engine")
+        if manifest.params != json.loads(json.dumps(_incremental_params(self.config), default=str)):
+            raise RuntimeError(
+                f"Settings differ from those of the samples in {self.output_dir}; "
+                "run the pipeline in full instead"
+            )
+        missing = [
+            name for name in ("uniques.fasta", UNIQUE_ASVS, "asvs.fasta", f"asv_table{TABLE_SUFFIX}")
+            if not (self.output_dir / "denoise_results" / name).exists()
+        ]
+        if missing:
+            raise RuntimeError(f"Missing denoising results to add samples to: {', '.join(missing)}")
+        changed = manifest.changed_samples(samples)
+        if changed:
+            raise RuntimeError(
+                f"Reads of samples already in {self.output_dir} have changed: "
+                f"{', '.join(changed)}; run the pipeline in full instead"
+            )
+        return manifest.new_samples(samples)
+
+    def run(
+        self,
+        skip: Iterable[str] = (),
+        on_complete: Optional[Callable[[Task, Any], None]] = None,
+        use_cache: bool = True,
+        profiler: Optional[Profiler] = None,
+        pool: Optional[PoolExecutor] = None,
+        resources: Optional[ResourceManager] = None,
+    ) -> dict[str, Any]:
+        """
+        Run all steps of the graph except ``skip``.
+        
+        Independent samples and steps run concurrently within the thread
+        budget; each sample moves on to its next step as soon as it is ready.
+        Steps whose inputs and settings are unchanged since a previous run
+        are taken from the step cache. With a ``profiler``, the resource
+        usage of every step task and external command is recorded in it.
+        A ``pool`` shared with other runs is used as is instead of starting
+        one for this run (or the backend's queue), and so are ``resources``
+        shared with them instead of the run's own budget.
+        """
+        graph = self.graph.prune(skip)
+        if not self.samples():
+            raise RuntimeError(f"No FASTA/FASTQ files found in {self.input_dir}")
+        samples = self.pending_samples()
+        if not samples:
+            return {}
+        scheduler = Scheduler(
+            graph=graph,
+            samples=samples,
+            output_dir=self.output_dir,
+            context=self.config,
+            threads=self.threads,
+            threads_per_sample=self.config.threads_per_sample,
+            on_complete=on_complete,
+            cache=self.cache() if use_cache else None,
+            resources=resources or self.resources(),
+            profiler=profiler,
         )
-        if not result.success:
-            console.print(f"[red]QC step failed: {result.error}[/red]")
-            raise RuntimeError("QC step failed")
-            
-    def run_denoise(self) -> None:
-        """Run the denoising step."""
-        denoise_output = self.output_dir / "denoise_results"
-        result = self.executor.run_denoise_tool(
-            input_dir=self.input_dir,
-            output_dir=denoise_output,
-            threads=self.threads
+        queue = self.work_queue() if pool is None else None
+        workers = nullcontext()
+        if queue is not None:
+            pool = QueueExecutor(
+                queue,
+                timeout=self.config.queue_timeout,
+                max_attempts=self.config.queue_max_attempts,
+            )
+            workers = LocalWorkers(
+                queue, self.config.queue_local_workers, self.config.queue_heartbeat
+            )
+        try:
+            with workers:
+                results = scheduler.run(pool)
+        except RuntimeError as e:
+            console.print(f"[red]Pipeline failed: {e}[/red]")
+            raise
+        finally:
+            self.cached_tasks = scheduler.cached
+            if queue is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.retried_tasks = pool.retried
+        if "denoise" in graph.steps and self.config.denoise.engine == "native":
+            self.record(samples)
+        return results
+
+    def record(self, samples: list[Sample]) -> None:
+        """
+        Record in the manifest that the results now include ``samples``;
+        a full run starts a new manifest.
+        """
+        manifest = (self.manifest() if self.incremental else None) or Manifest(
+            params=_incremental_params(self.config)
         )
-        if not result.success:
-            console.print(f"[red]Denoising step failed: {result.error}[/red]")
-            raise RuntimeError("Denoising step failed")
+        manifest.add(samples)
+        manifest.save(self.output_dir)
@@ -0,0 +1,273 @@
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+_PROC_IO = Path("/proc/self/io")
+_PROC_STATUS = Path("/proc/self/status")
+_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+# Records collected by the current process while a step runs
+_records: Optional[list["ProfileRecord"]] = None
+
+
+@dataclass
+class ProfileRecord:
+    """
+    Resource usage of one step task or one external command.
+
+    CPU times include child processes. ``max_rss_kb`` is the peak resident
+    set size of the command, or of the process running the step while the
+    step ran (on Linux; elsewhere the peak over the process's lifetime).
+    Bytes are those read and written through system calls, including by
+    children.
+    """
+    name: str
+    category: str
+    label: str = ""
+    step: str = ""
+    start: float = 0.0
+    wall: float = 0.0
+    user_cpu: float = 0.0
+    sys_cpu: float = 0.0
+    max_rss_kb: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    reads: int = 0
+    pid: int = 0
+
+
+@dataclass
+class StepSummary:
+    """Profile records of one step added up over its tasks."""
+    step: str
+    tasks: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    max_rss_kb: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    reads: int = 0
+    slowest: str = ""
+    slowest_wall: float = 0.0
+
+    @property
+    def reads_per_second(self) -> float:
+        return self.reads / self.wall if self.wall else 0.0
+
+
+def io_counters() -> tuple[int, int]:
+    """Bytes read and written by this process and its reaped children."""
+    try:
+        counters = dict(
+            line.split(": ") for line in _PROC_IO.read_text().splitlines()
+        )
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def reset_peak_rss() -> bool:
+    """Restart this process's peak RSS from its current RSS, if the OS allows."""
+    try:
+        _CLEAR_REFS.write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb() -> int:
+    """Peak RSS of this process since it started or was last reset (0 if unknown)."""
+    try:
+        for line in _PROC_STATUS.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class Probe:
+    """
+    Snapshot of time, CPU and I/O counters, turned into a record once the
+    measured work is done. With ``own_peak``, the peak RSS of this process
+    is reset so that the record gets the work's own peak.
+    """
+
+    def __init__(self, own_peak: bool = False):
+        self._own_peak = own_peak and reset_peak_rss()
+        self.start = time.time()
+        self._clock = time.perf_counter()
+        self._self = resource.getrusage(resource.RUSAGE_SELF)
+        self._children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._io = io_counters()
+
+    def finish(
+        self,
+        name: str,
+        category: str,
+        label: str = "",
+        usage: Optional[resource.struct_rusage] = None,
+        children_only: bool = False,
+    ) -> ProfileRecord:
+        """
+        Measure since the snapshot. With ``usage`` (the rusage of a single
+        child process), CPU and peak RSS are taken from it instead; with
+        ``children_only`` only child processes are counted.
+        """
+        wall = time.perf_counter() - self._clock
+        read_bytes, write_bytes = io_counters()
+        if usage is not None:
+            user, system, max_rss = usage.ru_utime, usage.ru_stime, usage.ru_maxrss
+        else:
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            user = children.ru_utime - self._children.ru_utime
+            system = children.ru_stime - self._children.ru_stime
+            max_rss = children.ru_maxrss
+            if not children_only:
+                user += own.ru_utime - self._self.ru_utime
+                system += own.ru_stime - self._self.ru_stime
+                max_rss = (self._own_peak and peak_rss_kb()) or own.ru_maxrss
+                # Children reaped meanwhile count if one of them set a new peak
+                if children.ru_maxrss > self._children.ru_maxrss:
+                    max_rss = max(max_rss, children.ru_maxrss)
+        return ProfileRecord(
+            name=name,
+            category=category,
+            label=label,
+            start=self.start,
+            wall=wall,
+            user_cpu=user,
+            sys_cpu=system,
+            max_rss_kb=max_rss,
+            read_bytes=read_bytes - self._io[0],
+            write_bytes=write_bytes - self._io[1],
+            pid=os.getpid(),
+        )
+
+
+@contextmanager
+def collecting() -> Iterator[list[ProfileRecord]]:
+    """Collect the records made by ``record`` in this process."""
+    global _records
+    previous, _records = _records, []
+    try:
+        yield _records
+    finally:
+        _records = previous
+
+
+def record(profile: ProfileRecord) -> None:
+    """Keep a record if a ``collecting`` block is active."""
+    if _records is not None:
+        _records.append(profile)
+
+
+def result_reads(result: Any) -> int:
+    """Reads processed according to a step result's filter or merge statistics."""
+    stats = getattr(result, "stats", None) or getattr(result, "filter_stats", None)
+    if stats is None and getattr(result, "merge", None) is not None:
+        # Both mates of every pair
+        return 2 * result.merge.pairs
+    return getattr(stats, "reads_in", 0)
+
+
+def profiled_call(
+    func: Callable[..., Any],
+    name: str,
+    label: str,
+    *args: Any,
+) -> tuple[Any, list[ProfileRecord]]:
+    """
+    Call a step function and return its result with the profile of the
+    call followed by those of the commands it ran.
+    """
+    with collecting() as records:
+        probe = Probe(own_peak=True)
+        result = func(*args)
+        profile = probe.finish(name, "step", label)
+    profile.step = name
+    profile.reads = result_reads(result)
+    for command in records:
+        command.step, command.label = name, label
+    return result, [profile, *records]
+
+
+@dataclass
+class Profiler:
+    """
+    Collects the profile records of a run and writes them out.
+    """
+    records: list[ProfileRecord] = field(default_factory=list)
+    start: float = field(default_factory=time.time)
+
+    def add(self, records: list[ProfileRecord]) -> None:
+        self.records.extend(records)
+
+    def summary(self) -> list[StepSummary]:
+        """Totals per step, in the order the steps first ran."""
+        steps: dict[str, StepSummary] = {}
+        for profile in self.records:
+            if profile.category != "step":
+                continue
+            summary = steps.setdefault(profile.name, StepSummary(profile.name))
+            summary.tasks += 1
+            summary.wall += profile.wall
+            summary.cpu += profile.user_cpu + profile.sys_cpu
+            summary.max_rss_kb = max(summary.max_rss_kb, profile.max_rss_kb)
+            summary.read_bytes += profile.read_bytes
+            summary.write_bytes += profile.write_bytes
+            summary.reads += profile.reads
+            if profile.wall >= summary.slowest_wall:
+                summary.slowest, summary.slowest_wall = profile.label, profile.wall
+        for profile in self.records:
+            # External tools run in children whose peak RSS is not the step's
+            if profile.category == "command" and profile.step in steps:
+                summary = steps[profile.step]
+                summary.max_rss_kb = max(summary.max_rss_kb, profile.max_rss_kb)
+        return list(steps.values())
+
+    def write_json(self, path: Path) -> None:
+        """Write all records and the per-step summary as JSON."""
+        data = {
+            "start": self.start,
+            "wall": time.time() - self.start,
+            "steps": [asdict(summary) for summary in self.summary()],
+            "records": [asdict(profile) for profile in self.records],
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def write_chrome_trace(self, path: Path) -> None:
+        """
+        Write the records in Chrome trace event format, viewable in
+        chrome://tracing or Perfetto. Commands nest under their step.
+        """
+        events = []
+        for profile in self.records:
+            events.append({
+                "name": f"{profile.name} ({profile.label})" if profile.label else profile.name,
+                "cat": profile.category,
+                "ph": "X",
+                "ts": (profile.start - self.start) * 1e6,
+                "dur": profile.wall * 1e6,
+                "pid": 0,
+                "tid": profile.pid,
+                "args": {
+                    "user_cpu": profile.user_cpu,
+                    "sys_cpu": profile.sys_cpu,
+                    "max_rss_kb": profile.max_rss_kb,
+                    "read_bytes": profile.read_bytes,
+                    "write_bytes": profile.write_bytes,
+                    "reads": profile.reads,
+                },
+            })
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
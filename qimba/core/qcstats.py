@@ -0,0 +1,248 @@
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from qimba.core.derep import _CODES
+from qimba.core.fastx import ReadBatch
+
+PHRED_OFFSET = 33
+QC_REPORT_NAME = "qc_stats.json"
+
+# Positions tracked per read; later bases are counted in the last position
+MAX_POSITIONS = 1024
+# Phred scores 0 to 63, higher ones are counted as 63
+QUALITY_BINS = 64
+# Distinct sequences sampled to estimate duplication
+SKETCH_SIZE = 16384
+# A, C, G, T and anything else (N)
+_SYMBOLS = 5
+_N = 4
+# Duplication levels reported, the last one for that many copies or more
+_LEVELS = 10
+
+_HASH_BASE = np.uint64(0x100000001B3)
+
+# Lookup tables from sequence and quality bytes to histogram bins
+_SYMBOL_BINS = np.minimum(_CODES, _N).astype(np.int32)
+_SCORE_BINS = np.clip(np.arange(256) - PHRED_OFFSET, 0, QUALITY_BINS - 1).astype(np.int32)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """The splitmix64 finaliser, spreading hash bits over the whole word."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _positions(batch: ReadBatch) -> np.ndarray:
+    """Position of every base within its read."""
+    starts = batch.seq_offsets[:-1].astype(np.int32)
+    return np.arange(len(batch.seqs), dtype=np.int32) - np.repeat(starts, batch.lengths)
+
+
+def sequence_hashes(batch: ReadBatch, positions: Optional[np.ndarray] = None) -> np.ndarray:
+    """64-bit hash of the sequence of every read of a batch."""
+    lengths = batch.lengths
+    if positions is None:
+        positions = _positions(batch)
+    powers = np.ones(max(1, int(lengths.max(initial=0))), dtype=np.uint64)
+    np.cumprod(np.full(len(powers) - 1, _HASH_BASE), out=powers[1:])
+    terms = (batch.seqs.astype(np.uint64) + np.uint64(1)) * powers[positions]
+    hashes = np.zeros(len(batch), dtype=np.uint64)
+    nonempty = np.flatnonzero(lengths > 0)
+    if len(nonempty):
+        hashes[nonempty] = np.add.reduceat(terms, batch.seq_offsets[nonempty])
+    return _mix(hashes ^ lengths.astype(np.uint64))
+
+
+def _quantiles(histograms: np.ndarray, fractions: tuple[float, ...]) -> np.ndarray:
+    """Quantiles of every row of a histogram over 0, 1, 2..."""
+    cumulative = np.cumsum(histograms, axis=1)
+    totals = cumulative[:, -1:]
+    return np.stack([
+        np.argmax(cumulative >= np.maximum(1, fraction * totals), axis=1) for fraction in fractions
+    ], axis=1)
+
+
+@dataclass
+class ReadProfile:
+    """
+    Statistics of a stream of reads, in memory that does not grow with it.
+
+    Per position, qualities are histogrammed and bases counted, so any
+    quantile or composition can be derived later. Duplication is estimated
+    from a bottom-k sketch: the ``SKETCH_SIZE`` smallest sequence hashes
+    are a uniform sample of the distinct sequences, and the reads of every
+    sampled sequence are counted exactly, since a sequence can only enter
+    the sketch on its first occurrence. Profiles of chunks, files or
+    samples add up to the profile of their union.
+    """
+    reads: int = 0
+    bases: int = 0
+    reads_with_n: int = 0
+    lengths: np.ndarray = field(default_factory=lambda: np.zeros(MAX_POSITIONS + 1, dtype=np.int64))
+    quality: np.ndarray = field(
+        default_factory=lambda: np.zeros((MAX_POSITIONS, QUALITY_BINS), dtype=np.int64)
+    )
+    read_quality: np.ndarray = field(default_factory=lambda: np.zeros(QUALITY_BINS, dtype=np.int64))
+    composition: np.ndarray = field(
+        default_factory=lambda: np.zeros((MAX_POSITIONS, _SYMBOLS), dtype=np.int64)
+    )
+    sketch: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.uint64))
+    sketch_counts: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+
+    def add(self, batch: ReadBatch) -> None:
+        """Count the reads of a batch."""
+        n = len(batch)
+        if not n:
+            return
+        lengths = batch.lengths
+        offsets = _positions(batch)
+        positions = np.minimum(offsets, MAX_POSITIONS - 1)
+        self.reads += n
+        self.bases += batch.total_bases
+        self.lengths += np.bincount(np.minimum(lengths, MAX_POSITIONS), minlength=MAX_POSITIONS + 1)
+
+        symbols = _SYMBOL_BINS[batch.seqs]
+        self.composition += np.bincount(
+            positions * _SYMBOLS + symbols, minlength=MAX_POSITIONS * _SYMBOLS
+        ).reshape(MAX_POSITIONS, _SYMBOLS)
+        nonempty = np.flatnonzero(lengths > 0)
+        starts = batch.seq_offsets[nonempty]
+        if len(nonempty):
+            self.reads_with_n += int(np.count_nonzero(np.add.reduceat(symbols == _N, starts)))
+
+        if batch.quals is not None:
+            scores = _SCORE_BINS[batch.quals]
+            self.quality += np.bincount(
+                positions * QUALITY_BINS + scores, minlength=MAX_POSITIONS * QUALITY_BINS
+            ).reshape(MAX_POSITIONS, QUALITY_BINS)
+            if len(nonempty):
+                means = np.add.reduceat(scores, starts) // lengths[nonempty]
+                self.read_quality += np.bincount(means, minlength=QUALITY_BINS)
+        self._sample(sequence_hashes(batch, offsets))
+
+    def _sample(self, hashes: np.ndarray, counts: Optional[np.ndarray] = None) -> None:
+        if len(self.sketch) == SKETCH_SIZE:
+            below = hashes < self.sketch[-1]
+            hashes = hashes[below]
+            counts = None if counts is None else counts[below]
+        if counts is None:
+            counts = np.ones(len(hashes), dtype=np.int64)
+        merged, inverse = np.unique(np.concatenate((self.sketch, hashes)), return_inverse=True)
+        totals = np.bincount(
+            inverse.ravel(), weights=np.concatenate((self.sketch_counts, counts)), minlength=len(merged)
+        )
+        self.sketch = merged[:SKETCH_SIZE]
+        self.sketch_counts = totals[:SKETCH_SIZE].astype(np.int64)
+
+    def __add__(self, other: "ReadProfile") -> "ReadProfile":
+        merged = ReadProfile(
+            reads=self.reads + other.reads,
+            bases=self.bases + other.bases,
+            reads_with_n=self.reads_with_n + other.reads_with_n,
+            lengths=self.lengths + other.lengths,
+            quality=self.quality + other.quality,
+            read_quality=self.read_quality + other.read_quality,
+            composition=self.composition + other.composition,
+            sketch=self.sketch,
+            sketch_counts=self.sketch_counts,
+        )
+        merged._sample(other.sketch, other.sketch_counts)
+        return merged
+
+    @property
+    def max_length(self) -> int:
+        lengths = np.flatnonzero(self.lengths)
+        return int(lengths[-1]) if len(lengths) else 0
+
+    @property
+    def distinct(self) -> float:
+        """Estimated number of distinct sequences."""
+        if len(self.sketch) < SKETCH_SIZE:
+            return float(len(self.sketch))
+        # The k-th smallest of uniform hashes sits near k / distinct of the range
+        return (SKETCH_SIZE - 1) / ((float(self.sketch[-1]) + 1) / 2.0 ** 64)
+
+    @property
+    def duplicate_rate(self) -> float:
+        """Estimated fraction of reads repeating an earlier read."""
+        return max(0.0, 1.0 - self.distinct / self.reads) if self.reads else 0.0
+
+    def duplication_levels(self) -> np.ndarray:
+        """
+        Estimated fraction of the reads whose sequence occurs once, twice...
+        and ``_LEVELS`` times or more.
+        """
+        levels = np.minimum(self.sketch_counts, _LEVELS)
+        reads = np.bincount(levels, weights=self.sketch_counts, minlength=_LEVELS + 1)[1:]
+        return reads / reads.sum() if reads.sum() else reads
+
+    def to_dict(self) -> dict:
+        """Summary values and per-position tables, up to the longest read."""
+        width = max(1, min(self.max_length, MAX_POSITIONS))
+        bases = self.composition[:width].sum(axis=1)
+        scored = self.quality[:width].sum(axis=1)
+        values = np.arange(QUALITY_BINS)
+        mean = (self.quality[:width] @ values) / np.maximum(scored, 1)
+        lower, median, upper = _quantiles(self.quality[:width], (0.25, 0.5, 0.75)).T
+        fractions = self.composition[:width] / np.maximum(bases, 1)[:, None]
+        total = self.composition.sum(axis=0)
+        called = total[:_N].sum()
+        return {
+            "reads": self.reads,
+            "bases": self.bases,
+            "mean_length": self.bases / self.reads if self.reads else 0.0,
+            "max_length": self.max_length,
+            "mean_quality": float(self.read_quality @ values / self.read_quality.sum())
+            if self.read_quality.sum() else None,
+            "gc_content": float(total[1:3].sum() / called) if called else 0.0,
+            "n_content": float(total[_N] / self.bases) if self.bases else 0.0,
+            "reads_with_n": self.reads_with_n,
+            "distinct_sequences": round(self.distinct),
+            "duplicate_rate": self.duplicate_rate,
+            "duplication_levels": self.duplication_levels().tolist(),
+            "length_distribution": {
+                str(length): int(count) for length, count in enumerate(self.lengths) if count
+            },
+            "read_quality_distribution": {
+                str(score): int(count) for score, count in enumerate(self.read_quality) if count
+            },
+            "positions": {
+                "reads": bases.tolist(),
+                "mean_quality": np.round(mean, 2).tolist() if scored.any() else [],
+                "quality_q1": lower.tolist() if scored.any() else [],
+                "quality_median": median.tolist() if scored.any() else [],
+                "quality_q3": upper.tolist() if scored.any() else [],
+                **{
+                    f"fraction_{symbol}": np.round(fractions[:, i], 4).tolist()
+                    for i, symbol in enumerate("ACGTN")
+                },
+            },
+        }
+
+
+@dataclass
+class QCReport:
+    """Read profiles of the input files of a run and the report written."""
+    profiles: dict[str, ReadProfile] = field(default_factory=dict)
+    files: list[Path] = field(default_factory=list)
+
+
+def write_report(profiles: dict[str, ReadProfile], path: Path, update: bool = False) -> None:
+    """
+    Write the profiles of several files (or samples) as one JSON report,
+    or with ``update`` add them to the report already at ``path``.
+    """
+    report = {}
+    if update and path.exists():
+        with open(path) as f:
+            report = json.load(f)
+    report.update((name, profile.to_dict()) for name, profile in profiles.items())
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+from qimba.utils.config import Config
+
+
+def physical_memory_mb() -> int:
+    """Total physical memory of the machine in MB (0 if unknown)."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+@dataclass(frozen=True)
+class Reservation:
+    """Cores and memory held by one running job."""
+    threads: int
+    memory_mb: int = 0
+
+
+class ResourceManager:
+    """
+    Shared budget of CPU threads and memory for concurrent jobs.
+
+    Every job reserves its threads and memory before it starts and gives
+    them back when it finishes, so jobs are packed onto the machine
+    without oversubscribing it. A request larger than the whole budget is
+    clamped to it: the job still runs, just alone. A ``memory_mb`` of 0
+    means memory is not limited.
+    """
+
+    def __init__(self, threads: int = 1, memory_mb: int = 0):
+        self.threads = max(1, threads)
+        self.memory_mb = max(0, memory_mb)
+        self.free_threads = self.threads
+        self.free_memory_mb = self.memory_mb
+        self._condition = threading.Condition()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ResourceManager":
+        return cls(*_budget(config))
+
+    def clamp(self, threads: int, memory_mb: int = 0) -> Reservation:
+        """The part of a request that the budget can ever satisfy."""
+        memory_mb = max(0, memory_mb)
+        if self.memory_mb:
+            memory_mb = min(memory_mb, self.memory_mb)
+        return Reservation(max(1, min(threads, self.threads)), memory_mb)
+
+    def fits(self, threads: int, memory_mb: int = 0) -> bool:
+        """Whether a request could start now."""
+        request = self.clamp(threads, memory_mb)
+        with self._condition:
+            return self._fits(request)
+
+    def _fits(self, request: Reservation) -> bool:
+        if request.threads > self.free_threads:
+            return False
+        return not self.memory_mb or request.memory_mb <= self.free_memory_mb
+
+    def try_acquire(self, threads: int, memory_mb: int = 0) -> Optional[Reservation]:
+        """Reserve resources if they are free now, else return ``None``."""
+        request = self.clamp(threads, memory_mb)
+        with self._condition:
+            if not self._fits(request):
+                return None
+            self._take(request)
+        return request
+
+    def _take(self, request: Reservation) -> None:
+        self.free_threads -= request.threads
+        if self.memory_mb:
+            self.free_memory_mb -= request.memory_mb
+
+    def acquire(
+        self,
+        threads: int,
+        memory_mb: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Reservation:
+        """
+        Block until the resources are free and reserve them.
+
+        Raises ``TimeoutError`` if they are still busy after ``timeout``
+        seconds.
+        """
+        request = self.clamp(threads, memory_mb)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._fits(request), timeout):
+                raise TimeoutError(
+                    f"Timed out waiting for {request.threads} threads and {request.memory_mb} MB"
+                )
+            self._take(request)
+        return request
+
+    async def acquire_async(self, threads: int, memory_mb: int = 0) -> Reservation:
+        """Wait without blocking the event loop until the resources are free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            reservation = self.try_acquire(threads, memory_mb)
+            if reservation is not None:
+                return reservation
+            future = loop.create_future()
+            with self._condition:
+                # Check again under the lock so a release cannot be missed
+                if self._fits(self.clamp(threads, memory_mb)):
+                    continue
+                self._waiters.append((loop, future))
+            await future
+
+    def release(self, reservation: Reservation) -> None:
+        """Give back a reservation and wake up waiting jobs."""
+        with self._condition:
+            self.free_threads += reservation.threads
+            if self.memory_mb:
+                self.free_memory_mb += reservation.memory_mb
+        self._notify()
+
+    def resize(self, threads: int, memory_mb: int = 0) -> None:
+        """Change the budget; running jobs keep their reservations."""
+        with self._condition:
+            threads = max(1, threads)
+            memory_mb = max(0, memory_mb)
+            self.free_threads += threads - self.threads
+            self.free_memory_mb = memory_mb - (self.memory_mb - self.free_memory_mb if self.memory_mb else 0)
+            self.threads = threads
+            self.memory_mb = memory_mb
+        self._notify()
+
+    def _notify(self) -> None:
+        with self._condition:
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    @contextmanager
+    def reserve(self, threads: int, memory_mb: int = 0) -> Iterator[Reservation]:
+        """Hold resources for the duration of a ``with`` block."""
+        reservation = self.acquire(threads, memory_mb)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+    @asynccontextmanager
+    async def reserve_async(self, threads: int, memory_mb: int = 0) -> AsyncIterator[Reservation]:
+        """Hold resources for the duration of an ``async with`` block."""
+        reservation = await self.acquire_async(threads, memory_mb)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+
+def _budget(config: Config) -> tuple[int, int]:
+    """Threads and memory (MB) of the budget described by a configuration."""
+    return max(1, config.threads), config.memory_mb or physical_memory_mb()
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_shared: Optional[ResourceManager] = None
+_shared_lock = threading.Lock()
+
+
+def shared_resources(config: Config) -> ResourceManager:
+    """
+    The resource manager shared by all executors of this process.
+
+    It is created from the first configuration it is asked for, and
+    resized if a later configuration has a different budget.
+    """
+    global _shared
+    budget = _budget(config)
+    with _shared_lock:
+        if _shared is None:
+            _shared = ResourceManager(*budget)
+        elif (_shared.threads, _shared.memory_mb) != budget:
+            _shared.resize(*budget)
+        return _shared
@@ -0,0 +1,99 @@
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from qimba.core.derep import DerepResult
+from qimba.core.fastx import fastx_stem, find_fastx_files
+from qimba.core.filters import FilterStats
+from qimba.core.merge import MergeStats
+
+# Read tags such as "_R1_001", "_R2", ".1" or "_2" at the end of a file stem
+_READ_TAG = re.compile(r"^(?P<name>.+?)[_.](?:R)?(?P<read>[12])(?:_001)?$")
+
+
+@dataclass
+class Sample:
+    """A sequencing sample: one FASTA/FASTQ file or an R1/R2 pair."""
+    name: str
+    r1: Path
+    r2: Optional[Path] = None
+
+    @property
+    def paired(self) -> bool:
+        return self.r2 is not None
+
+    @property
+    def files(self) -> list[Path]:
+        return [self.r1] if self.r2 is None else [self.r1, self.r2]
+
+
+@dataclass
+class SampleResult:
+    """
+    Outcome of a per-sample pipeline stage.
+
+    ``output`` is the sample as produced by the stage (e.g. the filtered
+    reads), which downstream stages consume. A stage that quality filters
+    and denoises in one pass reports the QC counters in ``stats`` and those
+    of expected-error filtering in ``ee_stats``. ``files`` are further files
+    the result depends on, such as the inputs of a stage that writes no
+    reads, so that cached downstream steps are keyed on them.
+    """
+    sample: str
+    success: bool = True
+    error: Optional[str] = None
+    output: Optional[Sample] = None
+    stats: Optional[FilterStats] = None
+    ee_stats: Optional[FilterStats] = None
+    uniques: Optional[DerepResult] = None
+    merge: Optional[MergeStats] = None
+    files: list[Path] = field(default_factory=list)
+
+
+def discover_samples(input_dir: Path) -> list[Sample]:
+    """
+    Group the FASTA/FASTQ files of a directory into samples.
+
+    Files whose names differ only by an R1/R2 tag become one paired sample;
+    every other file is a single-end sample named after the file.
+    """
+    tagged: dict[str, dict[str, Path]] = {}
+    samples = []
+    for path in find_fastx_files(input_dir):
+        match = _READ_TAG.match(fastx_stem(path))
+        if match:
+            tagged.setdefault(match.group("name"), {})[match.group("read")] = path
+        else:
+            samples.append(Sample(name=fastx_stem(path), r1=path))
+
+    for name, reads in tagged.items():
+        if set(reads) == {"1", "2"}:
+            samples.append(Sample(name=name, r1=reads["1"], r2=reads["2"]))
+        else:
+            # A lone R1 (or R2) file is just a single-end sample
+            for path in reads.values():
+                samples.append(Sample(name=fastx_stem(path), r1=path))
+    return sorted(samples, key=lambda sample: sample.name)
+
+
+def split_threads(
+    threads: int,
+    jobs: int,
+    threads_per_job: int = 0,
+) -> tuple[int, int]:
+    """
+    Split a thread budget between concurrent jobs.
+
+    Returns ``(workers, threads_per_job)`` with ``workers * threads_per_job``
+    never exceeding ``threads``. With ``threads_per_job=0`` the budget is
+    spread evenly: as many single-threaded workers as there are jobs, and
+    any spare threads given to each job.
+    """
+    threads = max(1, threads)
+    jobs = max(1, jobs)
+    if threads_per_job <= 0:
+        threads_per_job = max(1, threads // jobs)
+    threads_per_job = min(threads_per_job, threads)
+    workers = max(1, min(jobs, threads // threads_per_job))
+    return workers, threads_per_job
@@ -0,0 +1,329 @@
+from concurrent.futures import FIRST_COMPLETED, Executor as PoolExecutor, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+from qimba.core.cache import StepCache, input_files
+from qimba.core.profiling import Profiler, profiled_call
+from qimba.core.resources import Reservation, ResourceManager
+from qimba.core.samples import Sample, SampleResult, split_threads
+
+
+@dataclass
+class Step:
+    """
+    A node of the pipeline graph.
+
+    Per-sample steps are called as ``func(context, sample, output_dir, threads)``
+    once for every sample and return a ``SampleResult`` whose ``output`` is
+    the sample handed to downstream per-sample steps. Pooled steps run once
+    as ``func(context, results, output_dir, threads)`` with the results of
+    their upstream per-sample step for all samples (or the result of their
+    upstream pooled step).
+
+    ``params`` extracts the settings that determine the step's result from
+    the context; steps without it are never cached.
+    """
+    name: str
+    func: Callable[..., Any]
+    inputs: tuple[str, ...] = ()
+    output: str = ""
+    per_sample: bool = True
+    threads: Optional[int] = None
+    memory_mb: int = 0
+    params: Optional[Callable[[Any], dict]] = None
+
+
+@dataclass
+class Task:
+    """One unit of scheduled work: a step applied to a sample (or pooled)."""
+    step: Step
+    sample: Optional[Sample] = None
+    index: int = 0
+    depth: int = 0
+
+    @property
+    def key(self) -> tuple[str, Optional[str]]:
+        return self.step.name, self.sample.name if self.sample else None
+
+
+class StepGraph:
+    """
+    Directed acyclic graph of pipeline steps.
+    """
+
+    def __init__(self, steps: Iterable[Step] = ()):
+        self.steps: dict[str, Step] = {}
+        for step in steps:
+            self.add(step)
+
+    def add(self, step: Step) -> None:
+        if step.name in self.steps:
+            raise ValueError(f"Duplicate step: {step.name}")
+        missing = [name for name in step.inputs if name not in self.steps]
+        if missing:
+            raise ValueError(f"Step {step.name} depends on unknown steps: {', '.join(missing)}")
+        # Steps can only depend on steps added before them, so the graph stays acyclic
+        self.steps[step.name] = step
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.steps
+
+    def order(self) -> list[Step]:
+        """Steps in topological order."""
+        return list(self.steps.values())
+
+    def depth(self, name: str) -> int:
+        """Length of the longest chain of upstream steps."""
+        inputs = self.steps[name].inputs
+        return 1 + max((self.depth(i) for i in inputs), default=0)
+
+    def prune(self, skip: Iterable[str]) -> "StepGraph":
+        """
+        Return a copy without the skipped steps.
+
+        Steps that consumed a skipped step are rewired to its inputs, so
+        skipping QC makes denoising read the raw samples.
+        """
+        skip = set(skip)
+        unknown = skip - set(self.steps)
+        if unknown:
+            raise ValueError(f"Cannot skip unknown steps: {', '.join(sorted(unknown))}")
+        rewired: dict[str, tuple[str, ...]] = {}
+        graph = StepGraph()
+        for step in self.order():
+            inputs: list[str] = []
+            for name in step.inputs:
+                for upstream in rewired.get(name, (name,)):
+                    if upstream not in inputs:
+                        inputs.append(upstream)
+            if step.name in skip:
+                rewired[step.name] = tuple(inputs)
+                continue
+            graph.add(replace(step, inputs=tuple(inputs)))
+        return graph
+
+
+class _InlineExecutor(PoolExecutor):
+    """Runs submitted calls immediately in the calling process."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+@dataclass
+class Scheduler:
+    """
+    Runs a ``StepGraph`` over a set of samples on a process pool.
+
+    Every (step, sample) pair becomes a task that starts as soon as the
+    same sample has finished its upstream steps, so a sample can be
+    denoised while others are still in QC. Pooled steps wait for all
+    samples of their inputs. Each task reserves its threads from the
+    shared ``threads`` budget before it is started. With a ``cache``,
+    tasks whose inputs and parameters are unchanged reuse the stored result
+    instead of running, so an interrupted run resumes where it stopped.
+    With a ``profiler``, every task that runs is profiled.
+
+    ``resources`` may be shared with other schedulers, the run then keeps
+    to its own ``threads`` and waits for the others when the budget is
+    used up. Pools with a ``submit_weighted(weight, fn, *args)`` method are
+    told the threads each call holds.
+    """
+    graph: StepGraph
+    samples: list[Sample]
+    output_dir: Path
+    context: Any = None
+    threads: int = 1
+    threads_per_sample: int = 0
+    on_complete: Optional[Callable[[Task, Any], None]] = None
+    cache: Optional[StepCache] = None
+    resources: Optional[ResourceManager] = None
+    profiler: Optional[Profiler] = None
+    cached: int = 0
+    results: dict[tuple[str, Optional[str]], Any] = field(default_factory=dict)
+
+    def tasks(self) -> list[Task]:
+        tasks = []
+        for step in self.graph.order():
+            depth = self.graph.depth(step.name)
+            if step.per_sample:
+                tasks.extend(
+                    Task(step, sample, index, depth) for index, sample in enumerate(self.samples)
+                )
+            else:
+                tasks.append(Task(step, None, len(self.samples), depth))
+        return tasks
+
+    def _threads_for(self, task: Task) -> int:
+        if task.step.threads is not None:
+            return max(1, min(task.step.threads, self.threads))
+        if not task.step.per_sample:
+            return self.threads
+        return split_threads(self.threads, len(self.samples), self.threads_per_sample)[1]
+
+    def _ready(self, task: Task) -> bool:
+        for name in task.step.inputs:
+            upstream = self.graph.steps[name]
+            if upstream.per_sample and task.sample is not None:
+                if (name, task.sample.name) not in self.results:
+                    return False
+            elif upstream.per_sample:
+                if any((name, s.name) not in self.results for s in self.samples):
+                    return False
+            elif (name, None) not in self.results:
+                return False
+        return True
+
+    def _arguments(self, task: Task) -> Any:
+        """
+        What a task consumes: per-sample tasks get the sample produced by
+        their per-sample input; pooled tasks get the results of their
+        per-sample input for all samples, or else the result of their pooled
+        input. Without inputs, the raw samples are used.
+        """
+        per_sample_inputs = [n for n in task.step.inputs if self.graph.steps[n].per_sample]
+        pooled_inputs = [n for n in task.step.inputs if not self.graph.steps[n].per_sample]
+        if task.sample is not None:
+            if per_sample_inputs:
+                return self.results[(per_sample_inputs[-1], task.sample.name)].output
+            return task.sample
+        if per_sample_inputs:
+            return [self.results[(per_sample_inputs[-1], s.name)] for s in self.samples]
+        if pooled_inputs:
+            return self.results[(pooled_inputs[-1], None)]
+        return [SampleResult(sample=s.name, output=s) for s in self.samples]
+
+    def _cache_key(self, task: Task, arguments: Any) -> Optional[str]:
+        if self.cache is None or task.step.params is None:
+            return None
+        return self.cache.key(
+            task.step.name,
+            task.step.params(self.context),
+            input_files(arguments),
+            self.output_dir / task.step.output,
+        )
+
+    def _complete(self, task: Task, result: Any) -> None:
+        self.results[task.key] = result
+        if self.on_complete:
+            self.on_complete(task, result)
+
+    def _submit(self, pool: PoolExecutor, task: Task, arguments: Any, reservation: Reservation) -> Future:
+        call = (
+            task.step.func,
+            self.context,
+            arguments,
+            self.output_dir / task.step.output,
+            reservation.threads,
+        )
+        if self.profiler is not None:
+            call = (profiled_call, task.step.func, task.step.name, _label(task), *call[1:])
+        submit_weighted = getattr(pool, "submit_weighted", None)
+        if submit_weighted is not None:
+            return submit_weighted(reservation.threads, *call)
+        return pool.submit(*call)
+
+    def run(self, pool: Optional[PoolExecutor] = None) -> dict[str, Any]:
+        """
+        Execute all tasks and return the results by step name.
+
+        Per-sample steps map to a list of results in sample order, pooled
+        steps to their return value.
+        """
+        own_pool = pool is None
+        if pool is None:
+            pool = _InlineExecutor() if self.threads <= 1 else ProcessPoolExecutor(self.threads)
+        resources = self.resources or ResourceManager(self.threads)
+        pending = self.tasks()
+        running: dict[Future, tuple[Task, Reservation, Optional[str]]] = {}
+        errors: list[str] = []
+        # Cache keys of ready tasks, looked up once per task
+        keys: dict[tuple[str, Optional[str]], Optional[str]] = {}
+        # Threads held by this run's tasks, which a shared budget does not limit
+        busy = 0
+        try:
+            while (pending and not errors) or running:
+                progressed = False
+                blocked: Optional[tuple[Task, Any]] = None
+                # Deeper steps first: finished samples flow downstream before
+                # new samples are started
+                for task in sorted(pending, key=lambda t: (-t.depth, t.index)):
+                    if errors or not self._ready(task):
+                        continue
+                    arguments = self._arguments(task)
+                    if task.key not in keys:
+                        key = keys[task.key] = self._cache_key(task, arguments)
+                        cached = self.cache.get(key) if key is not None else None
+                        if cached is not None:
+                            pending.remove(task)
+                            self.cached += 1
+                            self._complete(task, cached)
+                            progressed = True
+                            continue
+                    threads = self._threads_for(task)
+                    if busy + threads > self.threads:
+                        continue
+                    reservation = resources.try_acquire(threads, task.step.memory_mb)
+                    if reservation is None:
+                        blocked = blocked or (task, arguments)
+                        continue
+                    pending.remove(task)
+                    busy += reservation.threads
+                    running[self._submit(pool, task, arguments, reservation)] = (task, reservation, keys[task.key])
+                if not running:
+                    if progressed:
+                        continue
+                    if blocked is not None and not errors:
+                        # Only other runs on a shared budget can hold it: wait for them
+                        task, arguments = blocked
+                        reservation = resources.acquire(self._threads_for(task), task.step.memory_mb)
+                        pending.remove(task)
+                        busy += reservation.threads
+                        running[self._submit(pool, task, arguments, reservation)] = (task, reservation, keys[task.key])
+                        continue
+                    if pending and not errors:
+                        raise RuntimeError("Pipeline graph has tasks that can never run")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, reservation, key = running.pop(future)
+                    resources.release(reservation)
+                    busy -= reservation.threads
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors.append(f"{task.step.name} failed for {_label(task)}: {e}")
+                        continue
+                    if self.profiler is not None:
+                        result, profiles = result
+                        self.profiler.add(profiles)
+                    if getattr(result, "success", True) is False:
+                        errors.append(f"{task.step.name} failed for {_label(task)}: {result.error}")
+                        continue
+                    if key is not None:
+                        self.cache.put(key, task.step.name, result)
+                    self._complete(task, result)
+        finally:
+            if own_pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+        collected: dict[str, Any] = {}
+        for step in self.graph.order():
+            if step.per_sample:
+                collected[step.name] = [self.results[(step.name, s.name)] for s in self.samples]
+            else:
+                collected[step.name] = self.results[(step.name, None)]
+        return collected
+
+
+def _label(task: Task) -> str:
+    return task.sample.name if task.sample else "all samples"
+
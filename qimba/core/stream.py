@@ -0,0 +1,156 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TypeVar
+
+from qimba.core.fastx import ReadBatch, open_output, write_batch
+
+T = TypeVar("T")
+
+# How often a blocked side checks whether the other one gave up (seconds)
+_POLL = 0.1
+
+
+class _End:
+    """Marks the end of a channel, with the producer's error if it failed."""
+
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+class Channel:
+    """
+    Bounded hand-off of items between two threads.
+
+    ``put`` blocks while ``max_items`` items are waiting, so a slow
+    consumer holds the producer back instead of letting the buffer grow.
+    The producer ends the stream with ``close``, passing its error if it
+    failed, which is then raised in the consumer. Either side can
+    ``cancel``: ``put`` then returns ``False`` and iteration stops.
+    """
+
+    def __init__(self, max_items: int = 4):
+        self._items: queue.Queue = queue.Queue(maxsize=max(1, max_items))
+        self._cancelled = threading.Event()
+
+    def put(self, item) -> bool:
+        """Hand an item over; ``False`` if the consumer has gone away."""
+        while not self._cancelled.is_set():
+            try:
+                self._items.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        self.put(_End(error))
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def __iter__(self) -> Iterator:
+        while True:
+            try:
+                item = self._items.get(timeout=_POLL)
+            except queue.Empty:
+                if self._cancelled.is_set():
+                    return
+                continue
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+
+
+def prefetch(source: Iterable[T], max_items: int = 4) -> Iterator[T]:
+    """
+    Iterate over ``source`` in a background thread, running at most
+    ``max_items`` items ahead of the consumer.
+
+    Errors of the source are raised in the consumer. When the consumer
+    stops early, the source is stopped before its next item.
+    """
+    channel = Channel(max_items)
+
+    def produce() -> None:
+        items = iter(source)
+        try:
+            for item in items:
+                if not channel.put(item):
+                    break
+            else:
+                channel.close()
+        except BaseException as e:
+            channel.close(e)
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name="qimba-prefetch", daemon=True)
+    thread.start()
+    try:
+        yield from channel
+    finally:
+        channel.cancel()
+        thread.join()
+
+
+class BatchWriter:
+    """
+    Writes batches of reads (one per output file, e.g. mates) from a
+    background thread, so that writing overlaps with producing them.
+
+    At most ``max_batches`` batches wait to be written; ``write`` blocks
+    beyond that. Errors of the writer thread are raised on exit.
+    """
+
+    def __init__(
+        self,
+        paths: tuple[Path, ...],
+        compression_level: int = 0,
+        threads: int = 1,
+        max_batches: int = 4,
+    ):
+        self.paths = paths
+        self.compression_level = compression_level
+        self.threads = threads
+        self._channel = Channel(max_batches)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="qimba-writer", daemon=True)
+
+    def _run(self) -> None:
+        try:
+            handles = [open_output(path, self.compression_level, self.threads) for path in self.paths]
+            try:
+                for batches in self._channel:
+                    for handle, batch in zip(handles, batches):
+                        write_batch(handle, batch)
+            finally:
+                for handle in handles:
+                    handle.close()
+        except BaseException as e:
+            self._error = e
+            # Unblock the producer, whose batches can no longer be written
+            self._channel.cancel()
+
+    def __enter__(self) -> "BatchWriter":
+        for path in self.paths:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread.start()
+        return self
+
+    def write(self, batches: tuple[ReadBatch, ...]) -> None:
+        if not self._channel.put(batches) and self._error is not None:
+            raise self._error
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self._channel.close()
+        else:
+            self._channel.cancel()
+        self._thread.join()
+        if self._error is not None and exc_type is None:
+            raise self._error
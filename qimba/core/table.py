@@ -0,0 +1,347 @@
+import json
+import os
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from qimba import __version__
+from qimba.core.unoise import AsvResult
+
+# Files start with this marker and the length of a JSON header describing
+# the samples, observations and the arrays that follow it
+_MAGIC = b"QIMBACT\x00"
+_PREAMBLE = struct.Struct("<8sQ")
+_FORMAT_VERSION = 1
+# Arrays start at multiples of this, so their memory maps are aligned
+_ALIGN = 64
+TABLE_SUFFIX = ".qct"
+
+# Observations formatted at once when exporting to text
+_EXPORT_ROWS = 1024
+_BIOM_ENTRIES = 65536
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def _count_dtype(data: np.ndarray) -> np.dtype:
+    """Smallest unsigned type holding every count (counts are kept as int64)."""
+    largest = int(data.max(initial=0))
+    if largest < 2 ** 32:
+        return np.dtype("<u4")
+    return np.dtype("<i8")
+
+
+class CountTable:
+    """
+    Sparse sample-by-observation (ASV) count table.
+
+    Counts are held in CSR form with a row per sample: sample ``i`` has
+    ``data[indptr[i]:indptr[i + 1]]`` reads of the observations
+    ``indices[indptr[i]:indptr[i + 1]]``, sorted by observation and without
+    zeros. Memory and disk use grow with the non-zero counts only.
+
+    Tables are saved in a single columnar file: a JSON header with the
+    sample and observation ids, followed by each array stored contiguously
+    and aligned, so that ``load`` memory-maps the arrays instead of reading
+    them.
+    """
+
+    def __init__(
+        self,
+        samples: Sequence[str],
+        observations: Sequence[str],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+    ):
+        self.samples = list(samples)
+        self.observations = list(observations)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.samples), len(self.observations)
+
+    @property
+    def nnz(self) -> int:
+        """Number of non-zero counts."""
+        return len(self.data)
+
+    @property
+    def total(self) -> int:
+        return int(self.data.sum(dtype=np.int64))
+
+    @classmethod
+    def from_coo(
+        cls,
+        samples: Sequence[str],
+        observations: Sequence[str],
+        sample_ids: np.ndarray,
+        observation_ids: np.ndarray,
+        counts: np.ndarray,
+    ) -> "CountTable":
+        """
+        Build a table from coordinate triples; counts of repeated
+        (sample, observation) pairs are added up.
+        """
+        n_obs = max(1, len(observations))
+        keys = np.asarray(sample_ids, dtype=np.int64) * n_obs + np.asarray(observation_ids, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        nonzero = counts != 0
+        keys, counts = keys[nonzero], counts[nonzero]
+        order = np.argsort(keys, kind="stable")
+        keys, counts = keys[order], counts[order]
+        if len(keys):
+            starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+            counts = np.add.reduceat(counts, starts)
+            keys = keys[starts]
+        rows = keys // n_obs
+        indptr = np.zeros(len(samples) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(samples)), out=indptr[1:])
+        indices = (keys % n_obs).astype(np.int32 if n_obs < 2 ** 31 else np.int64)
+        return cls(samples, observations, indptr, indices, counts)
+
+    @classmethod
+    def from_asvs(cls, result: AsvResult) -> "CountTable":
+        """
+        Per-sample ASV counts of a UNOISE run: the reads of every unique
+        count towards the ASV it was merged into.
+        """
+        uniques = result.uniques
+        asvs = result.assignments[uniques.count_uniques]
+        kept = asvs >= 0
+        return cls.from_coo(
+            uniques.samples,
+            [f"ASV{j + 1}" for j in range(len(result))],
+            uniques.count_samples[kept],
+            asvs[kept],
+            uniques.count_values[kept],
+        )
+
+    def _rows(self) -> np.ndarray:
+        """Sample index of every stored count."""
+        return np.repeat(np.arange(len(self.samples)), np.diff(self.indptr))
+
+    def sample_totals(self) -> np.ndarray:
+        """Reads of every sample."""
+        return np.bincount(
+            self._rows(), weights=self.data, minlength=len(self.samples)
+        ).astype(np.int64)
+
+    def observation_totals(self) -> np.ndarray:
+        """Reads of every observation over all samples."""
+        return np.bincount(
+            self.indices, weights=self.data, minlength=len(self.observations)
+        ).astype(np.int64)
+
+    def sample(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """Observation indices and counts of one sample."""
+        i = self.samples.index(name)
+        span = slice(self.indptr[i], self.indptr[i + 1])
+        return self.indices[span], self.data[span]
+
+    def filter(self, min_abundance: int = 1, min_samples: int = 1) -> "CountTable":
+        """
+        Drop observations with fewer than ``min_abundance`` reads in total
+        or present in fewer than ``min_samples`` samples.
+        """
+        keep = self.observation_totals() >= min_abundance
+        if min_samples > 1:
+            keep &= np.bincount(self.indices, minlength=len(self.observations)) >= min_samples
+        return self.take_observations(keep)
+
+    def take_observations(self, keep: np.ndarray) -> "CountTable":
+        """The table restricted to the observations where ``keep`` is set."""
+        new_index = np.cumsum(keep) - 1
+        entries = keep[self.indices]
+        indptr = np.zeros(len(self.samples) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self._rows()[entries], minlength=len(self.samples)), out=indptr[1:])
+        return CountTable(
+            self.samples,
+            [o for o, k in zip(self.observations, keep.tolist()) if k],
+            indptr,
+            new_index[self.indices[entries]].astype(self.indices.dtype),
+            np.asarray(self.data[entries], dtype=np.int64),
+        )
+
+    @classmethod
+    def merge(cls, tables: Iterable["CountTable"]) -> "CountTable":
+        """
+        Combine tables, e.g. those of samples processed in parallel.
+
+        Observations are matched by id and samples by name; counts of a
+        sample present in several tables are added up.
+        """
+        samples: dict[str, int] = {}
+        observations: dict[str, int] = {}
+        rows, columns, counts = [], [], []
+        for table in tables:
+            sample_map = np.array(
+                [samples.setdefault(s, len(samples)) for s in table.samples], dtype=np.int64
+            )
+            observation_map = np.array(
+                [observations.setdefault(o, len(observations)) for o in table.observations],
+                dtype=np.int64,
+            )
+            if not table.nnz:
+                continue
+            rows.append(sample_map[table._rows()])
+            columns.append(observation_map[table.indices])
+            counts.append(np.asarray(table.data, dtype=np.int64))
+        if not counts:
+            rows = columns = counts = [np.empty(0, dtype=np.int64)]
+        return cls.from_coo(
+            list(samples),
+            list(observations),
+            np.concatenate(rows),
+            np.concatenate(columns),
+            np.concatenate(counts),
+        )
+
+    def save(self, path: Path) -> None:
+        """Write the table in the columnar ``.qct`` format."""
+        path = Path(path)
+        arrays = {
+            "indptr": np.ascontiguousarray(self.indptr, dtype="<i8"),
+            "indices": np.ascontiguousarray(
+                self.indices, dtype="<i4" if len(self.observations) < 2 ** 31 else "<i8"
+            ),
+            "data": np.ascontiguousarray(self.data, dtype=_count_dtype(self.data)),
+        }
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            offset = _aligned(offset)
+            layout[name] = {"offset": offset, "dtype": array.dtype.str, "length": len(array)}
+            offset += array.nbytes
+        header = json.dumps({
+            "version": _FORMAT_VERSION,
+            "samples": self.samples,
+            "observations": self.observations,
+            "arrays": layout,
+        }).encode()
+        start = _aligned(_PREAMBLE.size + len(header))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(_PREAMBLE.pack(_MAGIC, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(start + layout[name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "CountTable":
+        """Open a ``.qct`` table, memory-mapping its arrays."""
+        path = Path(path)
+        with open(path, "rb") as f:
+            preamble = f.read(_PREAMBLE.size)
+            if len(preamble) != _PREAMBLE.size or preamble[:8] != _MAGIC:
+                raise ValueError(f"{path} is not a qimba count table")
+            header_size = _PREAMBLE.unpack(preamble)[1]
+            header = json.loads(f.read(header_size))
+        if header.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported count table version {header.get('version')}")
+        start = _aligned(_PREAMBLE.size + header_size)
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            begin = start + spec["offset"]
+            arrays[name] = buffer[begin:begin + spec["length"] * dtype.itemsize].view(dtype)
+        return cls(header["samples"], header["observations"], **arrays)
+
+    def _by_observation(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Counts reordered by observation: (observation ptr, samples, counts)."""
+        order = np.argsort(self.indices, kind="stable")
+        ptr = np.zeros(len(self.observations) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.observations)), out=ptr[1:])
+        return ptr, self._rows()[order], np.asarray(self.data[order], dtype=np.int64)
+
+    def write_tsv(self, path: Path) -> None:
+        """
+        Export as a dense observation-by-sample TSV (the classic
+        ``#OTU ID`` layout read by QIIME and most R packages).
+        """
+        ptr, rows, counts = self._by_observation()
+        with open(path, "w") as out:
+            out.write("\t".join(["#OTU ID", *self.samples]) + "\n")
+            for begin in range(0, len(self.observations), _EXPORT_ROWS):
+                end = min(begin + _EXPORT_ROWS, len(self.observations))
+                block = np.zeros((end - begin, len(self.samples)), dtype=np.int64)
+                span = slice(ptr[begin], ptr[end])
+                block_rows = np.repeat(np.arange(end - begin), np.diff(ptr[begin:end + 1]))
+                block[block_rows, rows[span]] = counts[span]
+                out.write("".join(
+                    "\t".join([observation, *map(str, values)]) + "\n"
+                    for observation, values in zip(self.observations[begin:end], block.tolist())
+                ))
+
+    @classmethod
+    def read_tsv(cls, path: Path) -> "CountTable":
+        """Read an observation-by-sample TSV as written by ``write_tsv``."""
+        observations, sample_ids, observation_ids, counts = [], [], [], []
+        samples: Optional[list[str]] = None
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if samples is None:
+                    if line.startswith("#") and not line.startswith("#OTU ID"):
+                        continue
+                    samples = fields[1:]
+                    continue
+                values = np.array(fields[1:], dtype=np.float64).astype(np.int64)
+                nonzero = np.flatnonzero(values)
+                sample_ids.append(nonzero)
+                observation_ids.append(np.full(len(nonzero), len(observations), dtype=np.int64))
+                counts.append(values[nonzero])
+                observations.append(fields[0])
+        if samples is None:
+            raise ValueError(f"{path}: empty count table")
+        empty = [np.empty(0, dtype=np.int64)]
+        return cls.from_coo(
+            samples,
+            observations,
+            np.concatenate(sample_ids or empty),
+            np.concatenate(observation_ids or empty),
+            np.concatenate(counts or empty),
+        )
+
+    def write_biom(self, path: Path) -> None:
+        """
+        Export in the sparse JSON BIOM 1.0 format (observations as rows),
+        which ``biom convert`` turns into HDF5 BIOM 2.1 if needed.
+        """
+        ptr, rows, counts = self._by_observation()
+        observation_rows = np.repeat(np.arange(len(self.observations)), np.diff(ptr))
+        header = {
+            "id": None,
+            "format": "Biological Observation Matrix 1.0.0",
+            "format_url": "http://biom-format.org",
+            "type": "OTU table",
+            "generated_by": f"qimba {__version__}",
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "matrix_type": "sparse",
+            "matrix_element_type": "int",
+            "shape": [len(self.observations), len(self.samples)],
+            "rows": [{"id": o, "metadata": None} for o in self.observations],
+            "columns": [{"id": s, "metadata": None} for s in self.samples],
+        }
+        with open(path, "w") as out:
+            out.write(json.dumps(header)[:-1] + ', "data": [')
+            for begin in range(0, len(counts), _BIOM_ENTRIES):
+                span = slice(begin, begin + _BIOM_ENTRIES)
+                out.write(("," if begin else "") + ",".join(
+                    f"[{r},{c},{v}]" for r, c, v in zip(
+                        observation_rows[span].tolist(), rows[span].tolist(), counts[span].tolist()
+                    )
+                ))
+            out.write("]}")
@@ -0,0 +1,284 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from qimba.core.align import MAX_DISTANCE, edit_distances
+from qimba.core.derep import DerepResult, _CODES
+from qimba.core.fastx import ReadBatch, _offsets
+from qimba.utils.config import DenoiseConfig
+
+# Uniques whose k-mers are computed together
+_KMER_BLOCK = 4096
+
+
+def rolling_kmers(codes: np.ndarray, k: int) -> np.ndarray:
+    """
+    K-mer (as an integer) starting at every position of 2-bit coded bases;
+    -1 where the window holds a non-ACGT base or runs past the end.
+    """
+    values = np.full(len(codes), -1, dtype=np.int64)
+    m = len(codes) - k + 1
+    if m <= 0:
+        return values
+    window = np.zeros(m, dtype=np.int64)
+    for j in range(k):
+        window <<= 2
+        window |= codes[j:j + m] & 3
+    invalid = np.concatenate(([0], np.cumsum(codes >= 4)))
+    window[invalid[k:] > invalid[:m]] = -1
+    values[:m] = window
+    return values
+
+
+def kmer_set(codes: np.ndarray, k: int) -> np.ndarray:
+    """Distinct k-mers of a 2-bit coded sequence, skipping non-ACGT bases."""
+    values = rolling_kmers(codes, k)
+    return np.unique(values[values >= 0])
+
+
+class KmerIndex:
+    """
+    Index of the k-mers contained in each centroid.
+
+    Membership is a bit matrix with a row per k-mer seen so far and a
+    column per centroid, so that ``shared`` counts the k-mers a query has
+    in common with every centroid in one vectorised gather and sum. Rows
+    and columns grow by doubling.
+    """
+
+    def __init__(self, k: int = 8):
+        self.k = k
+        self.size = 0
+        self._rows = np.full(4 ** k, -1, dtype=np.int64)
+        self._used = 0
+        self._bits = np.zeros((64, 8), dtype=np.uint8)
+
+    def _grow(self, rows: int, columns: int) -> None:
+        shape = self._bits.shape
+        if rows <= shape[0] and columns <= shape[1] * 8:
+            return
+        bits = np.zeros((
+            max(shape[0], 2 * shape[0] if rows > shape[0] else 0, rows),
+            max(shape[1], 2 * shape[1] if columns > shape[1] * 8 else 0, (columns + 7) // 8),
+        ), dtype=np.uint8)
+        bits[:shape[0], :shape[1]] = self._bits
+        self._bits = bits
+
+    def add(self, kmers: np.ndarray) -> int:
+        """Index the k-mers of a new centroid and return its id."""
+        cid = self.size
+        new = kmers[self._rows[kmers] < 0]
+        self._rows[new] = np.arange(self._used, self._used + len(new))
+        self._used += len(new)
+        self._grow(self._used, cid + 1)
+        self._bits[self._rows[kmers], cid >> 3] |= np.uint8(0x80 >> (cid & 7))
+        self.size += 1
+        return cid
+
+    def shared(self, kmers: np.ndarray) -> np.ndarray:
+        """K-mers of the query contained in each centroid."""
+        rows = self._rows[kmers]
+        rows = rows[rows >= 0]
+        if not len(rows) or not self.size:
+            return np.zeros(self.size, dtype=np.int64)
+        columns = (self.size + 7) // 8
+        hits = np.unpackbits(self._bits[rows, :columns], axis=1, count=self.size)
+        return hits.sum(axis=0, dtype=np.int64)
+
+
+@dataclass
+class AsvResult:
+    """
+    Amplicon sequence variants found among dereplicated uniques.
+
+    ``centroids[j]`` is the unique that ASV ``j`` is based on and
+    ``assignments[i]`` the ASV that unique ``i`` was merged into (-1 for
+    uniques below ``min_reads``). ``abundances`` add up the reads of all
+    uniques of an ASV.
+    """
+    asvs: ReadBatch
+    abundances: np.ndarray
+    centroids: np.ndarray
+    assignments: np.ndarray
+    uniques: DerepResult
+
+    def __len__(self) -> int:
+        return len(self.centroids)
+
+    def write_fasta(self, path: Path) -> None:
+        """Write the ASVs with usearch-style ``;size=`` annotations."""
+        with open(path, "wb") as out:
+            out.write(self.asvs.to_fasta())
+
+
+class Unoise:
+    """
+    UNOISE-style denoising of abundance-sorted uniques.
+
+    Uniques are visited in order of decreasing abundance. A unique with
+    abundance ``a`` joins the centroid ``C`` at distance ``d`` when
+    ``a / a_C <= 1 / 2 ** (alpha * d + 1)``, otherwise it becomes a new
+    centroid. Candidate centroids are found through a k-mer index: with
+    ``d`` differences at most ``k * d`` of the query's k-mers are lost, so
+    only centroids sharing enough k-mers are compared, at most
+    ``max_candidates`` of them. Uniques seen fewer than ``min_reads``
+    times are discarded.
+    """
+
+    def __init__(
+        self,
+        min_reads: int = 8,
+        alpha: float = 2.0,
+        k: int = 8,
+        max_candidates: int = 32,
+    ):
+        self.min_reads = min_reads
+        self.alpha = alpha
+        self.k = k
+        self.max_candidates = max_candidates
+
+    @classmethod
+    def from_config(cls, denoise: DenoiseConfig) -> "Unoise":
+        return cls(min_reads=denoise.min_reads, alpha=denoise.unoise_alpha)
+
+    def max_distance(self, abundance: np.ndarray, centroid_abundance: np.ndarray) -> np.ndarray:
+        """Largest distance at which the skew criterion still holds."""
+        skew = np.log2(centroid_abundance / abundance)
+        return np.floor((skew - 1) / self.alpha).astype(np.int64)
+
+    def run(
+        self,
+        uniques: DerepResult,
+        seeds: Optional[ReadBatch] = None,
+        seed_abundances: Optional[np.ndarray] = None,
+    ) -> AsvResult:
+        """
+        Denoise uniques sorted by decreasing abundance.
+
+        ``seeds`` are ASVs found earlier, e.g. in previously processed
+        samples: they keep the first ASV ids (with a ``centroids`` entry of
+        -1) and the uniques may join them as if they had been seen with
+        ``seed_abundances`` reads.
+        """
+        batch = uniques.uniques
+        n = int(np.count_nonzero(uniques.abundances >= self.min_reads))
+        codes = np.take(_CODES, batch.seqs)
+        offsets = batch.seq_offsets
+        assignments = np.full(len(uniques), -1, dtype=np.int64)
+        index = KmerIndex(self.k)
+        centroids: list[int] = []
+        sequences: list[np.ndarray] = []
+        seeded = 0 if seeds is None else len(seeds)
+        centroid_abundance = np.empty(max(n + seeded, 1), dtype=np.float64)
+        if seeded:
+            seed_codes = np.take(_CODES, seeds.seqs)
+            for j in range(seeded):
+                sequence = seed_codes[seeds.seq_offsets[j]:seeds.seq_offsets[j + 1]]
+                index.add(kmer_set(sequence, self.k))
+                sequences.append(sequence)
+                centroids.append(-1)
+            centroid_abundance[:seeded] = seed_abundances
+        top = float(centroid_abundance[:seeded].max(initial=0))
+
+        block_end = 0
+        for i in range(n):
+            if i == block_end:
+                # K-mers are computed over many uniques at once
+                block_end = min(n, i + _KMER_BLOCK)
+                base = offsets[i]
+                values = rolling_kmers(codes[base:offsets[block_end]], self.k)
+            query = codes[offsets[i]:offsets[i + 1]]
+            abundance = float(uniques.abundances[i])
+            window = values[offsets[i] - base:max(offsets[i], offsets[i + 1] - self.k + 1) - base]
+            kmers = np.unique(window[window >= 0])
+            cid = -1
+            # The most abundant centroid allows the largest distance
+            if centroids and self.max_distance(abundance, top) >= 1:
+                cid = self._match(query, kmers, abundance, index, sequences, centroid_abundance)
+            if cid < 0:
+                cid = index.add(kmers)
+                centroids.append(i)
+                sequences.append(query)
+                centroid_abundance[cid] = abundance
+                top = max(top, abundance)
+            assignments[i] = cid
+
+        centroids = np.array(centroids, dtype=np.int64)
+        kept = assignments >= 0
+        abundances = np.bincount(
+            assignments[kept], weights=uniques.abundances[kept], minlength=len(centroids)
+        ).astype(np.int64)
+        asvs = batch.take(centroids[seeded:])
+        if seeded:
+            abundances[:seeded] += np.asarray(seed_abundances, dtype=np.int64)
+            asvs = ReadBatch.concat([seeds, asvs])
+        labels = [b"ASV%d;size=%d" % (j + 1, size) for j, size in enumerate(abundances.tolist())]
+        asvs.names = np.frombuffer(b"".join(labels), dtype=np.uint8)
+        asvs.name_offsets = _offsets(np.array([len(label) for label in labels], dtype=np.int64))
+        return AsvResult(
+            asvs=asvs,
+            abundances=abundances,
+            centroids=centroids,
+            assignments=assignments,
+            uniques=uniques,
+        )
+
+    def _match(
+        self,
+        query: np.ndarray,
+        kmers: np.ndarray,
+        abundance: float,
+        index: KmerIndex,
+        sequences: list[np.ndarray],
+        centroid_abundance: np.ndarray,
+    ) -> int:
+        """The centroid a unique belongs to, or -1 if none qualifies."""
+        allowed = self.max_distance(abundance, centroid_abundance[:index.size])
+        shared = index.shared(kmers)
+        candidates = np.flatnonzero((allowed >= 1) & (shared >= len(kmers) - self.k * allowed))
+        if not len(candidates):
+            return -1
+        if len(candidates) > self.max_candidates:
+            best = np.argsort(-shared[candidates], kind="stable")[:self.max_candidates]
+            candidates = np.sort(candidates[best])
+        targets = [sequences[c] for c in candidates.tolist()]
+        limits = np.minimum(allowed[candidates], MAX_DISTANCE)
+        distances = self._distances(query, targets, shared[candidates], len(kmers), limits)
+        ok = distances <= limits
+        if not ok.any():
+            return -1
+        # Closest qualifying centroid; the most abundant one on ties
+        candidates, distances = candidates[ok], distances[ok]
+        return int(candidates[np.argmin(distances)])
+
+    def _distances(
+        self,
+        query: np.ndarray,
+        targets: list[np.ndarray],
+        shared: np.ndarray,
+        nkmers: int,
+        limits: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Edit distances between a unique and candidate centroids, up to
+        ``limits`` (``limits + 1`` beyond). Substitutions alone bound the
+        distance from above and the lost k-mers and the difference in length
+        bound it from below; the alignment kernel only runs where the two
+        bounds differ, which for reads with few, scattered errors is rare.
+        """
+        lengths = np.array([len(t) for t in targets], dtype=np.int64)
+        lower = np.maximum(-(-(nkmers - shared) // self.k), np.abs(lengths - len(query)))
+        upper = np.full(len(targets), np.iinfo(np.int64).max, dtype=np.int64)
+        for i in np.flatnonzero(lengths == len(query)).tolist():
+            upper[i] = np.count_nonzero(query != targets[i])
+        distances = np.where(upper <= lower, upper, limits + 1)
+        align = np.flatnonzero((upper > lower) & (lower <= limits))
+        if len(align):
+            distances[align] = edit_distances(
+                query,
+                [targets[i] for i in align.tolist()],
+                np.minimum(limits[align], upper[align]),
+            )
+        return np.minimum(distances, limits + 1)
@@ -0,0 +1,383 @@
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Executor as PoolExecutor, Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+_JOB = ".job"
+_RESULT = ".result"
+
+
+def _write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+@dataclass
+class QueueStatus:
+    """Jobs in each state and the workers seen recently."""
+    pending: int
+    running: int
+    results: int
+    workers: list[dict]
+
+
+class WorkQueue:
+    """
+    A job queue in a directory, shared through the file system.
+
+    Jobs are pickled calls in ``pending``. A worker claims one by renaming
+    it into ``running`` under its own name, which only one worker can do,
+    keeps its modification time fresh while working on it (the heartbeat)
+    and writes the outcome to ``results``. Files are written under a
+    temporary name and renamed, so readers never see partial files. Any
+    storage with atomic renames will do: a local disk for workers on the
+    same machine, or a shared file system for workers on several nodes.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.pending = self.root / "pending"
+        self.running = self.root / "running"
+        self.results = self.root / "results"
+        self.workers = self.root / "workers"
+        for directory in (self.pending, self.running, self.results, self.workers):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, job_id: str, payload: Any) -> None:
+        _write(self.pending / f"{job_id}{_JOB}", pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+
+    def claim(self, worker: str) -> Optional[tuple[str, Path]]:
+        """Take the oldest pending job: its id and its file in ``running``."""
+        for path in sorted(self.pending.glob(f"*{_JOB}")):
+            job_id = path.name[:-len(_JOB)]
+            claimed = self.running / f"{job_id}@{worker}{_JOB}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Claimed by another worker first
+                continue
+            # The first heartbeat; the file kept the time it was queued at
+            os.utime(claimed)
+            return job_id, claimed
+        return None
+
+    def running_jobs(self) -> dict[str, tuple[Path, float]]:
+        """Claimed jobs by id, with their file and time of last heartbeat."""
+        jobs = {}
+        for path in self.running.glob(f"*{_JOB}"):
+            try:
+                jobs[path.name.split("@", 1)[0]] = (path, path.stat().st_mtime)
+            except FileNotFoundError:
+                continue
+        return jobs
+
+    def requeue(self, job_id: str, claimed: Path) -> bool:
+        """Put a claimed job back in ``pending``, unless its worker just finished it."""
+        try:
+            os.rename(claimed, self.pending / f"{job_id}{_JOB}")
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put_result(self, job_id: str, outcome: tuple) -> None:
+        try:
+            data = pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Unpicklable errors are passed on as their message
+            data = pickle.dumps(("error", RuntimeError(str(outcome[1])), outcome[2]))
+        _write(self.results / f"{job_id}{_RESULT}", data)
+
+    def take_result(self, job_id: str) -> Optional[tuple]:
+        path = self.results / f"{job_id}{_RESULT}"
+        try:
+            with open(path, "rb") as f:
+                outcome = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        path.unlink()
+        return outcome
+
+    def result_ids(self) -> set[str]:
+        return {path.name[:-len(_RESULT)] for path in self.results.glob(f"*{_RESULT}")}
+
+    def remove(self, job_id: str) -> bool:
+        """Withdraw a job that no worker has claimed yet."""
+        try:
+            (self.pending / f"{job_id}{_JOB}").unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def status(self, max_age: Optional[float] = None) -> QueueStatus:
+        """The state of the queue; ``max_age`` hides workers silent for longer."""
+        workers = []
+        now = time.time()
+        for path in sorted(self.workers.glob("*.json")):
+            try:
+                with open(path) as f:
+                    info = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if max_age is None or now - info.get("heartbeat", 0) <= max_age:
+                workers.append(info)
+        return QueueStatus(
+            pending=len(list(self.pending.glob(f"*{_JOB}"))),
+            running=len(list(self.running.glob(f"*{_JOB}"))),
+            results=len(list(self.results.glob(f"*{_RESULT}"))),
+            workers=workers,
+        )
+
+
+class QueueExecutor(PoolExecutor):
+    """
+    ``concurrent.futures`` executor that runs calls on ``qimba worker``
+    processes through a ``WorkQueue``.
+
+    A background thread collects results into the futures. A job whose
+    worker has not sent a heartbeat for ``timeout`` seconds (the worker
+    died, or its node went away) is queued again for another worker, at
+    most ``max_attempts`` times in total. Errors raised by the call itself
+    are passed on without retrying, as they would happen again.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        timeout: float = 120.0,
+        max_attempts: int = 3,
+        poll: float = 0.5,
+    ):
+        self.queue = queue
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.poll = poll
+        self.retried = 0
+        self._prefix = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._ids = itertools.count()
+        self._futures: dict[str, Future] = {}
+        self._attempts: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = threading.Thread(target=self._watch, name="qimba-queue", daemon=True)
+        self._monitor.start()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        if self._stop.is_set():
+            raise RuntimeError("cannot submit to a queue executor after shutdown")
+        job_id = f"{self._prefix}-{next(self._ids):06d}"
+        future: Future = Future()
+        with self._lock:
+            self._futures[job_id] = future
+            self._attempts[job_id] = 1
+        try:
+            self.queue.put(job_id, (fn, args, kwargs))
+        except Exception as e:
+            with self._lock:
+                del self._futures[job_id]
+            future.set_exception(e)
+        return future
+
+    def _finish(self, job_id: str, outcome: Optional[tuple] = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            future = self._futures.pop(job_id, None)
+            self._attempts.pop(job_id, None)
+        if future is None or not future.set_running_or_notify_cancel():
+            return
+        if error is not None:
+            future.set_exception(error)
+        elif outcome[0] == "ok":
+            future.set_result(outcome[1])
+        else:
+            error = outcome[1]
+            if outcome[2]:
+                # Chained, so that the worker's traceback shows in the message
+                cause, error = error, RuntimeError(f"Job failed on the worker:\n{outcome[2]}")
+                error.__cause__ = cause
+            future.set_exception(error)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll):
+            with self._lock:
+                mine = set(self._futures)
+            if not mine:
+                continue
+            for job_id in mine & self.queue.result_ids():
+                outcome = self.queue.take_result(job_id)
+                if outcome is not None:
+                    self._finish(job_id, outcome)
+            now = time.time()
+            for job_id, (claimed, heartbeat) in self.queue.running_jobs().items():
+                if job_id not in mine or now - heartbeat <= self.timeout:
+                    continue
+                attempts = self._attempts.get(job_id, self.max_attempts)
+                if attempts >= self.max_attempts:
+                    claimed.unlink(missing_ok=True)
+                    self._finish(job_id, error=RuntimeError(
+                        f"job lost {attempts} times: no heartbeat from its worker for {self.timeout:.0f}s"
+                    ))
+                elif self.queue.requeue(job_id, claimed):
+                    with self._lock:
+                        self._attempts[job_id] = attempts + 1
+                    self.retried += 1
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        if cancel_futures:
+            with self._lock:
+                pending = list(self._futures)
+            for job_id in pending:
+                if self.queue.remove(job_id):
+                    with self._lock:
+                        future = self._futures.pop(job_id, None)
+                    if future is not None:
+                        future.cancel()
+        if wait:
+            while True:
+                with self._lock:
+                    futures = list(self._futures.values())
+                if not futures:
+                    break
+                futures[0].exception()
+        self._stop.set()
+        self._monitor.join()
+
+
+class Worker:
+    """
+    Runs jobs from a ``WorkQueue`` one at a time.
+
+    While a job runs, a heartbeat thread refreshes the claimed job file
+    every ``heartbeat`` seconds and records the worker's state in
+    ``workers/<name>.json``.
+    """
+
+    def __init__(self, queue: WorkQueue, name: Optional[str] = None, heartbeat: float = 10.0):
+        self.queue = queue
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat = heartbeat
+        self.jobs_done = 0
+        self.job: Optional[str] = None
+        self.started = time.time()
+
+    def _beat(self, claimed: Optional[Path] = None) -> None:
+        if claimed is not None:
+            try:
+                os.utime(claimed)
+            except FileNotFoundError:
+                # Given to another worker meanwhile; its result still counts
+                pass
+        info = {
+            "name": self.name,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": self.started,
+            "heartbeat": time.time(),
+            "job": self.job,
+            "jobs_done": self.jobs_done,
+        }
+        _write(self.queue.workers / f"{self.name}.json", json.dumps(info).encode())
+
+    def run_one(self) -> bool:
+        """Run the next pending job; ``False`` if there was none."""
+        claim = self.queue.claim(self.name)
+        if claim is None:
+            return False
+        job_id, claimed = claim
+        self.job = job_id
+        done = threading.Event()
+
+        def beat() -> None:
+            while not done.wait(self.heartbeat):
+                self._beat(claimed)
+
+        beater = threading.Thread(target=beat, name="qimba-heartbeat", daemon=True)
+        self._beat(claimed)
+        beater.start()
+        try:
+            with open(claimed, "rb") as f:
+                fn, args, kwargs = pickle.load(f)
+            outcome = ("ok", fn(*args, **kwargs), None)
+        except Exception as e:
+            outcome = ("error", e, traceback.format_exc())
+        finally:
+            done.set()
+            beater.join()
+        self.queue.put_result(job_id, outcome)
+        try:
+            claimed.unlink()
+        except FileNotFoundError:
+            pass
+        self.job = None
+        self.jobs_done += 1
+        self._beat()
+        return True
+
+    def run(
+        self,
+        max_jobs: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        poll: float = 1.0,
+        stop: Optional[threading.Event] = None,
+    ) -> int:
+        """
+        Run jobs until ``max_jobs`` are done, the queue has been empty for
+        ``idle_timeout`` seconds or ``stop`` is set. Returns the jobs run.
+        """
+        idle_since = time.time()
+        try:
+            while max_jobs is None or self.jobs_done < max_jobs:
+                if stop is not None and stop.is_set():
+                    break
+                if self.run_one():
+                    idle_since = time.time()
+                    continue
+                if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                    break
+                self._beat()
+                time.sleep(poll)
+        finally:
+            (self.queue.workers / f"{self.name}.json").unlink(missing_ok=True)
+        return self.jobs_done
+
+
+def _serve(root: Path, heartbeat: float, stop) -> None:
+    Worker(WorkQueue(root), heartbeat=heartbeat).run(poll=0.2, stop=stop)
+
+
+class LocalWorkers:
+    """
+    Worker processes on this machine for the duration of a ``with`` block,
+    to use the queue without a cluster or to add the local cores to one.
+    """
+
+    def __init__(self, queue: WorkQueue, count: int, heartbeat: float = 10.0):
+        self.queue = queue
+        self.count = count
+        self.heartbeat = heartbeat
+        self._stop = multiprocessing.Event()
+        self._processes: list = []
+
+    def __enter__(self) -> "LocalWorkers":
+        for _ in range(self.count):
+            process = multiprocessing.Process(
+                target=_serve, args=(self.queue.root, self.heartbeat, self._stop)
+            )
+            process.start()
+            self._processes.append(process)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._stop.set()
+        for process in self._processes:
+            process.join()
@@ -17,23 +17,59 @@ class QCConfig(BaseModel):
     min_quality: int = Field(default=20, description="Minimum quality score threshold")
     min_length: int = Field(default=100, description="Minimum read length")
     max_n: int = Field(default=0, description="Maximum number of N bases allowed")
+    window_size: int = Field(default=4, description="Sliding window size for quality trimming")
     tool: str = Field(default="fastp", description="QC tool to use")
+    memory_mb: int = Field(default=512, description="Memory reserved for each QC job (MB)")
+    engine: str = Field(default="external", description="QC engine: 'external' tool or 'native'")
+    stats: bool = Field(default=True, description="Collect read statistics (qualities, lengths, composition, duplication) while filtering natively")
 
 class DenoiseConfig(BaseModel):
     """Denoising specific configuration."""
     min_reads: int = Field(default=10, description="Minimum number of reads for ASV")
     max_ee: float = Field(default=1.0, description="Maximum expected error rate")
+    truncate_ee: bool = Field(default=False, description="Truncate reads where max_ee is exceeded instead of discarding them")
+    derep_memory_mb: int = Field(default=2048, description="Memory cap for dereplication before spilling to disk (MB)")
+    unoise_alpha: float = Field(default=2.0, description="UNOISE alpha: how fast the abundance skew allowed for a merge falls with distance")
+    chimera_min_fold: float = Field(default=2.0, description="Minimum abundance of chimera parents relative to the chimera")
     tool: str = Field(default="dada2", description="Denoising tool to use")
+    memory_mb: int = Field(default=4096, description="Memory reserved for the external denoising tool (MB)")
+    engine: str = Field(default="external", description="Denoising engine: 'external' tool or 'native'")
+
+class MergeConfig(BaseModel):
+    """Paired-end read merging configuration."""
+    enabled: bool = Field(default=False, description="Merge read pairs natively before denoising")
+    min_overlap: int = Field(default=16, ge=1, description="Minimum overlap between the mates of a pair")
+    max_mismatches: int = Field(default=5, ge=0, description="Maximum mismatches in the overlap")
+    min_length: int = Field(default=0, ge=0, description="Minimum merged read length (0: no limit)")
+    max_length: int = Field(default=0, ge=0, description="Maximum merged read length (0: no limit)")
+    max_quality: int = Field(default=41, ge=2, le=63, description="Highest quality score given to merged bases")
 
 class Config(BaseModel):
     """Main configuration handler for Qimba."""
     config_path: Optional[Path] = None
     verbose: bool = Field(default=False, description="Enable verbose output")
     threads: int = Field(default=1, description="Number of threads to use")
+    memory_mb: int = Field(default=0, description="Memory shared by concurrent jobs (MB, 0: physical memory)")
+    threads_per_sample: int = Field(default=0, description="Threads given to each per-sample job (0: split evenly)")
+    cache: bool = Field(default=True, description="Reuse results of unchanged pipeline steps")
+    cache_max_mb: int = Field(default=10240, description="Maximum size of the step cache (MB)")
+    cache_content_hash: bool = Field(default=False, description="Fingerprint inputs by content hash instead of size and mtime")
+    tool_timeout: Optional[float] = Field(default=None, description="Seconds before an external tool run is killed (none: no limit)")
+    compression_level: int = Field(default=0, ge=0, le=9, description="BGZF compression level of step outputs (0: uncompressed)")
+    stream: bool = Field(default=False, description="Stream quality-filtered reads straight into dereplication instead of writing and re-reading them (native engines)")
+    stream_keep_qc: bool = Field(default=False, description="When streaming, still write the quality-filtered reads, from a background thread")
+    stream_buffer: int = Field(default=4, ge=1, description="Read batches buffered between streamed steps before the producer waits")
+    backend: str = Field(default="local", description="Where pipeline steps run: 'local' processes or 'queue' for qimba workers")
+    queue_dir: Optional[Path] = Field(default=None, description="Work queue shared with qimba workers (default: <temp_dir>/queue)")
+    queue_local_workers: int = Field(default=0, ge=0, description="Workers started on this machine for the duration of a queue run")
+    queue_heartbeat: float = Field(default=10.0, gt=0, description="Seconds between the heartbeats of a worker running a job")
+    queue_timeout: float = Field(default=120.0, gt=0, description="Seconds without heartbeat before a job is given to another worker")
+    queue_max_attempts: int = Field(default=3, ge=1, description="Times a job is started before its loss fails the run")
     
     # Tool configurations
     qc: QCConfig = Field(default_factory=QCConfig, description="Quality control settings")
     denoise: DenoiseConfig = Field(default_factory=DenoiseConfig, description="Denoising settings")
+    merge: MergeConfig = Field(default_factory=MergeConfig, description="Paired-end merging settings")
     
     # Paths and environment
     data_dir: Path = Field(
@@ -44,6 +80,21 @@ class Config(BaseModel):
         default=Path.home() / ".cache" / "qimba",
         description="Directory for temporary files"
     )
+    
+    @property
+    def cache_dir(self) -> Path:
+        """Directory of the step result cache."""
+        return self.temp_dir / "steps"
+
+    @property
+    def work_queue_dir(self) -> Path:
+        """Directory of the work queue of the queue backend."""
+        return self.queue_dir or self.temp_dir / "queue"
+
+    @property
+    def index_dir(self) -> Path:
+        """Directory of the cached FASTQ record indexes."""
+        return self.temp_dir / "index"
 
     class Config:
         arbitrary_types_allowed = True
@@ -69,16 +120,21 @@ class Config(BaseModel):
             if "temp_dir" in config_data:
                 config_data["temp_dir"] = Path(config_data["temp_dir"])
             
-            # Update configuration
+            # Merge the file over the current settings and validate the result
+            merged = self.model_dump()
             for key, value in config_data.items():
-                if hasattr(self, key):
-                    if key in ["qc", "denoise"]:
+                if key in merged and key != "config_path":
+                    if key in ["qc", "denoise", "merge"]:
                         # Handle nested configs
-                        current_value = getattr(self, key)
-                        for subkey, subvalue in value.items():
-                            setattr(current_value, subkey, subvalue)
+                        merged[key].update(value)
                     else:
-                        setattr(self, key, value)
+                        merged[key] = value
+            # Without a path, validation does not load the file again
+            merged["config_path"] = None
+            validated = type(self).model_validate(merged)
+            for key in type(self).model_fields:
+                if key != "config_path":
+                    setattr(self, key, getattr(validated, key))
                         
         except Exception as e:
             console.print(f"[yellow]Warning: Failed to load configuration: {e}[/yellow]")
@@ -87,15 +143,8 @@ class Config(BaseModel):
         """Save current configuration to file."""
         save_path = config_path or self.config_path or DEFAULT_CONFIG_FILE
         
-        # Create config data
-        config_data = {
-            "verbose": self.verbose,
-            "threads": self.threads,
-            "qc": self.qc.model_dump(),
-            "denoise": self.denoise.model_dump(),
-            "data_dir": str(self.data_dir),
-            "temp_dir": str(self.temp_dir)
-        }
+        # Every setting but the location of the file itself
+        config_data = self.model_dump(mode="json", exclude={"config_path"})
         
         # Create directory if needed
         save_path.parent.mkdir(parents=True, exist_ok=True)
@@ -108,4 +157,13 @@ class Config(BaseModel):
         if config_path:
             self.config_path = config_path
         
-        console.print(f"[green]Configuration saved to {save_path}[/green]")
\ No newline at end of file
+        console.print(f"[green]Configuration saved to {save_path}[/green]")
+
+def load_config(config_path: Optional[Path] = None, verbose: bool = False) -> Config:
+    """
+    Configuration for one command invocation, read from a configuration
+    file (the default one if no path is given).
+    """
+    config = Config(config_path=Path(config_path or DEFAULT_CONFIG_FILE))
+    config.verbose = config.verbose or verbose
+    return config
@@ -0,0 +1,141 @@
+import gzip
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from qimba.core.fastx import ReadBatch, _offsets
+from qimba.core.filters import PHRED_OFFSET
+from qimba.core.samples import Sample
+
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+# Complement of the 2-bit codes A, C, G, T
+_COMPLEMENT = np.array([3, 2, 1, 0], dtype=np.uint8)
+
+
+@dataclass
+class ErrorProfile:
+    """
+    Quality and error model of simulated reads.
+
+    Mean quality falls linearly from ``quality_start`` at the first base to
+    ``quality_end`` at the last, with Gaussian noise of ``quality_sd``.
+    Substitutions are drawn from the quality of each base, scaled by
+    ``error_scale`` (1.0: exactly as often as the quality claims), and a
+    fraction ``n_rate`` of bases is called N.
+    """
+    quality_start: float = 36.0
+    quality_end: float = 24.0
+    quality_sd: float = 3.0
+    error_scale: float = 1.0
+    n_rate: float = 0.0
+
+
+@dataclass
+class AmpliconSimulator:
+    """
+    Deterministic generator of paired-end amplicon sequencing data.
+
+    ``variants`` true sequences of ``amplicon_length`` bases are derived
+    from one random ancestor by a few substitutions each, and sampled with
+    Zipf-like abundances of exponent ``skew``. R1 reads the first
+    ``read_length`` bases of the amplicon and R2 the reverse complement of
+    the last ones, so the mates overlap when the amplicon is shorter than
+    twice the read length. The same ``seed`` always gives the same data.
+    """
+    variants: int = 20
+    amplicon_length: int = 400
+    read_length: int = 250
+    divergence: float = 0.02
+    skew: float = 1.2
+    errors: ErrorProfile = field(default_factory=ErrorProfile)
+    seed: int = 0
+
+    def __post_init__(self):
+        rng = np.random.default_rng(self.seed)
+        ancestor = rng.integers(0, 4, self.amplicon_length, dtype=np.uint8)
+        codes = np.tile(ancestor, (self.variants, 1))
+        mutated = rng.random(codes.shape) < self.divergence
+        mutated[0] = False
+        codes[mutated] = (codes[mutated] + rng.integers(1, 4, mutated.sum(), dtype=np.uint8)) % 4
+        # 2-bit codes of the true sequences, shape (variants, amplicon_length)
+        self.codes = codes
+        weights = 1.0 / np.arange(1, self.variants + 1) ** self.skew
+        self.abundances = weights / weights.sum()
+
+    def sequences(self) -> list[bytes]:
+        """The true amplicon sequences, most abundant first."""
+        return [_BASES[row].tobytes() for row in self.codes]
+
+    def _reads(self, codes: np.ndarray, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+        """Add quality scores and sequencing errors to true read codes."""
+        n, length = codes.shape
+        profile = self.errors
+        mean = np.linspace(profile.quality_start, profile.quality_end, length, dtype=np.float32)
+        quals = rng.standard_normal((n, length), dtype=np.float32)
+        quals *= profile.quality_sd
+        quals += mean
+        quals = np.clip(np.rint(quals), 2, 41).astype(np.uint8)
+        error = (profile.error_scale * 10.0 ** (-np.arange(42) / 10.0)).astype(np.float32)
+        wrong = rng.random((n, length), dtype=np.float32) < error[quals]
+        codes = codes.copy()
+        codes[wrong] = (codes[wrong] + rng.integers(1, 4, wrong.sum(), dtype=np.uint8)) % 4
+        seqs = _BASES[codes]
+        if profile.n_rate:
+            uncalled = rng.random((n, length), dtype=np.float32) < profile.n_rate
+            seqs[uncalled] = ord("N")
+            quals[uncalled] = 2
+        return seqs, quals + PHRED_OFFSET
+
+    def sample(self, name: str, depth: int, seed: int = 0) -> tuple[ReadBatch, ReadBatch]:
+        """Simulate ``depth`` read pairs of one sample."""
+        rng = np.random.default_rng([self.seed, seed])
+        origin = rng.choice(self.variants, size=depth, p=self.abundances)
+        true = self.codes[origin]
+        length = min(self.read_length, self.amplicon_length)
+        forward = true[:, :length]
+        reverse = _COMPLEMENT[true[:, ::-1][:, :length]]
+        batches = []
+        for mate, codes in ((1, forward), (2, reverse)):
+            seqs, quals = self._reads(codes, rng)
+            names = b"".join(
+                b"%s.%d variant=%d %d:N:0\n" % (name.encode(), i, v, mate)
+                for i, v in enumerate(origin)
+            )
+            name_buf = np.frombuffer(names, dtype=np.uint8)
+            ends = np.flatnonzero(name_buf == ord("\n"))
+            lengths = np.diff(np.concatenate(([-1], ends))) - 1
+            batches.append(ReadBatch(
+                names=np.delete(name_buf, ends),
+                name_offsets=_offsets(lengths),
+                seqs=seqs.ravel(),
+                seq_offsets=np.arange(depth + 1, dtype=np.int64) * length,
+                quals=quals.ravel(),
+            ))
+        return batches[0], batches[1]
+
+    def write_dataset(
+        self,
+        output_dir: Path,
+        samples: int = 4,
+        depth: int = 10000,
+        compress: bool = False,
+    ) -> list[Sample]:
+        """
+        Write ``samples`` paired samples of ``depth`` read pairs each as
+        ``S<i>_R1.fastq`` / ``S<i>_R2.fastq`` (gzipped with ``compress``).
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        suffix = ".fastq.gz" if compress else ".fastq"
+        written = []
+        for i in range(samples):
+            name = f"S{i}"
+            r1, r2 = self.sample(name, depth, seed=i)
+            paths = (output_dir / f"{name}_R1{suffix}", output_dir / f"{name}_R2{suffix}")
+            for path, batch in zip(paths, (r1, r2)):
+                opener = gzip.open if compress else open
+                with opener(path, "wb") as f:
+                    f.write(batch.to_fastq())
+            written.append(Sample(name=name, r1=paths[0], r2=paths[1]))
+        return written
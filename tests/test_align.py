@@ -0,0 +1,108 @@
+import random
+
+import numpy as np
+import pytest
+
+from qimba.core.align import MAX_DISTANCE, edit_distance, edit_distances, pair_distances
+
+
+def levenshtein(a: bytes, b: bytes) -> int:
+    """Plain dynamic programming; N (or anything but ACGT) matches nothing."""
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            same = x == y and x in b"ACGT"
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (not same)))
+        previous = current
+    return previous[-1]
+
+
+def capped(a: bytes, b: bytes, limit: int) -> int:
+    return min(levenshtein(a, b), limit + 1)
+
+
+def random_sequence(rng: random.Random, length: int, alphabet: bytes = b"ACGT") -> bytes:
+    return bytes(rng.choice(alphabet) for _ in range(length))
+
+
+def mutate(rng: random.Random, sequence: bytes, edits: int, alphabet: bytes = b"ACGT") -> bytes:
+    mutated = bytearray(sequence)
+    for _ in range(edits):
+        kind = rng.randrange(3)
+        position = rng.randrange(len(mutated) + 1)
+        if kind == 0 and position < len(mutated):
+            mutated[position] = rng.choice(alphabet)
+        elif kind == 1 and position < len(mutated):
+            del mutated[position]
+        else:
+            mutated.insert(position, rng.choice(alphabet))
+    return bytes(mutated)
+
+
+@pytest.mark.parametrize("count", [3, 200])
+@pytest.mark.parametrize("limit", [0, 1, 4, 8])
+def test_edit_distances_match_reference(count, limit):
+    # Few targets take the scalar path, many the banded kernel
+    rng = random.Random(count * 100 + limit)
+    query = random_sequence(rng, 120)
+    targets = [mutate(rng, query, rng.randrange(2 * limit + 3)) for _ in range(count)]
+    expected = [capped(query, target, limit) for target in targets]
+    assert edit_distances(query, targets, max_distance=limit).tolist() == expected
+
+
+def test_edit_distances_with_ambiguous_bases():
+    rng = random.Random(3)
+    query = mutate(rng, random_sequence(rng, 80), 4, b"ACGTN")
+    targets = [mutate(rng, query, rng.randrange(6), b"ACGTN") for _ in range(50)]
+    for chosen in (targets[:5], targets):
+        expected = [capped(query, target, 6) for target in chosen]
+        assert edit_distances(query, chosen, max_distance=6).tolist() == expected
+
+
+def test_band_limit():
+    rng = random.Random(5)
+    query = random_sequence(rng, 60)
+    # Length differences beyond the band can never be within the limit
+    targets = [query[:60 - shift] for shift in range(8)] * 3
+    expected = [capped(query, target, 3) for target in targets]
+    assert edit_distances(query, targets, max_distance=3).tolist() == expected
+    assert max(expected) == 4
+
+
+def test_per_target_limits():
+    rng = random.Random(7)
+    query = random_sequence(rng, 100)
+    targets = [mutate(rng, query, rng.randrange(10)) for _ in range(100)]
+    limits = np.array([rng.randrange(9) for _ in targets])
+    expected = [capped(query, target, int(limit)) for target, limit in zip(targets, limits)]
+    assert edit_distances(query, targets, max_distance=limits).tolist() == expected
+
+
+def test_max_distance():
+    rng = random.Random(11)
+    query = random_sequence(rng, 150)
+    targets = [mutate(rng, query, rng.randrange(45)) for _ in range(40)]
+    expected = [capped(query, target, MAX_DISTANCE) for target in targets]
+    assert edit_distances(query, targets, max_distance=MAX_DISTANCE).tolist() == expected
+    assert edit_distance(query, targets[0]) == expected[0]
+    with pytest.raises(ValueError):
+        edit_distances(query, targets, max_distance=MAX_DISTANCE + 1)
+
+
+def test_pair_distances_match_reference():
+    rng = random.Random(13)
+    queries = [random_sequence(rng, rng.randrange(40, 130)) for _ in range(6)]
+    query_ids = np.array([rng.randrange(len(queries)) for _ in range(150)])
+    targets = [mutate(rng, queries[q], rng.randrange(12)) for q in query_ids]
+    expected = [capped(queries[q], target, 8) for q, target in zip(query_ids, targets)]
+    assert pair_distances(queries, targets, max_distance=8, query_ids=query_ids).tolist() == expected
+    pairs = [queries[q] for q in query_ids]
+    assert pair_distances(pairs, targets, max_distance=8).tolist() == expected
+
+
+def test_empty_inputs():
+    assert len(edit_distances(b"ACGT", [])) == 0
+    assert len(pair_distances([], [])) == 0
+    assert edit_distance(b"", b"ACG") == 3
+    assert edit_distance(b"ACGT", b"ACGT") == 0
@@ -0,0 +1,108 @@
+import random
+
+import numpy as np
+import pytest
+
+from qimba.core.chimera import ChimeraDetector
+from qimba.core.fastx import ReadBatch
+
+
+def common_prefix(a: bytes, b: bytes) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+def reference(sequences: list[bytes], abundances: list[int], min_fold: float) -> list[bool]:
+    """Compare every ASV with all more abundant ones, by exact matching."""
+    order = sorted(range(len(sequences)), key=lambda i: -abundances[i])
+    rank = {asv: position for position, asv in enumerate(order)}
+    chimeric = []
+    for query, sequence in enumerate(sequences):
+        parents = [
+            p for p in range(len(sequences))
+            if rank[p] < rank[query] and abundances[p] >= min_fold * abundances[query]
+        ]
+        prefixes = [common_prefix(sequence, sequences[p]) for p in parents]
+        suffixes = [common_prefix(sequence[::-1], sequences[p][::-1]) for p in parents]
+        length = len(sequence)
+        if len(parents) < 2 or max(prefixes) >= length or max(suffixes) >= length:
+            chimeric.append(False)
+            continue
+        chimeric.append(any(
+            prefixes[i] + suffixes[j] >= length
+            for i in range(len(parents)) for j in range(len(parents)) if i != j
+        ))
+    return chimeric
+
+
+def batch(sequences: list[bytes]) -> ReadBatch:
+    return ReadBatch.from_records((b"ASV%d" % i, seq, None) for i, seq in enumerate(sequences))
+
+
+def random_asvs(seed: int, count: int):
+    """Parents, their point mutants and crossovers between them."""
+    rng = random.Random(seed)
+    parents = [bytes(rng.choice(b"ACGT") for _ in range(rng.randint(60, 80))) for _ in range(6)]
+    sequences = list(parents)
+    while len(sequences) < count:
+        kind = rng.randrange(3)
+        a, b = rng.sample(sequences[:max(6, len(sequences) // 2)], 2)
+        if kind == 0:
+            cut = rng.randint(5, min(len(a), len(b)) - 5)
+            sequence = a[:cut] + b[cut:]
+        elif kind == 1:
+            mutated = bytearray(a)
+            mutated[rng.randrange(len(mutated))] = rng.choice(b"ACGT")
+            sequence = bytes(mutated)
+        elif len(a) > 30:
+            sequence = a[:rng.randint(20, len(a) - 1)]
+        else:
+            continue
+        if sequence not in sequences:
+            sequences.append(sequence)
+    abundances = sorted((rng.randint(1, 5000) for _ in sequences), reverse=True)
+    return sequences, abundances
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("min_fold", [1.0, 2.0])
+def test_detect_matches_all_pairs(seed, min_fold):
+    sequences, abundances = random_asvs(seed, 150)
+    # Shuffled, so that the input is not already in abundance order
+    shuffle = np.random.default_rng(seed).permutation(len(sequences))
+    sequences = [sequences[i] for i in shuffle]
+    abundances = np.array(abundances)[shuffle]
+    result = ChimeraDetector(min_fold=min_fold).detect(batch(sequences), abundances)
+    expected = reference(sequences, abundances.tolist(), min_fold)
+    assert result.chimeric.tolist() == expected
+    assert any(expected)
+    for asv in np.flatnonzero(result.chimeric).tolist():
+        head, tail = result.parents[asv]
+        length = len(sequences[asv])
+        assert head != tail
+        assert min(abundances[head], abundances[tail]) >= min_fold * abundances[asv]
+        prefix = common_prefix(sequences[asv], sequences[head])
+        suffix = common_prefix(sequences[asv][::-1], sequences[tail][::-1])
+        assert prefix + suffix >= length
+    assert (result.parents[~result.chimeric] == -1).all()
+
+
+def test_exact_matching_only():
+    rng = random.Random(1)
+    a = bytes(rng.choice(b"ACGT") for _ in range(80))
+    b = bytes(rng.choice(b"ACGT") for _ in range(80))
+    chimera = a[:40] + b[40:]
+    # One substitution away from its parents: no longer an exact match
+    mutated = bytearray(chimera)
+    mutated[60] = next(base for base in b"ACGT" if base != chimera[60])
+    detector = ChimeraDetector(min_fold=2.0)
+    result = detector.detect(batch([a, b, chimera, bytes(mutated)]), np.array([100, 100, 10, 10]))
+    assert result.chimeric.tolist() == [False, False, True, False]
+    assert result.parents[2].tolist() == [0, 1]
+    # Parents must be min_fold times as abundant
+    result = detector.detect(batch([a, b, chimera]), np.array([100, 15, 10]))
+    assert not result.chimeric.any()
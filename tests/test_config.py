@@ -0,0 +1,43 @@
+from qimba.utils.config import Config
+
+
+def _reload(config: Config, tmp_path) -> Config:
+    path = tmp_path / "config.json"
+    config.save(path)
+    return Config(config_path=path)
+
+
+def test_save_keeps_stream_settings(tmp_path):
+    config = Config(config_path=None, stream=True, stream_keep_qc=True, stream_buffer=9)
+    loaded = _reload(config, tmp_path)
+    assert loaded.stream
+    assert loaded.stream_keep_qc
+    assert loaded.stream_buffer == 9
+
+
+def test_save_keeps_nested_settings(tmp_path):
+    config = Config(config_path=None, tool_timeout=None)
+    config.qc.engine = "native"
+    config.merge.enabled = True
+    config.merge.min_overlap = 30
+    loaded = _reload(config, tmp_path)
+    assert loaded.qc.engine == "native"
+    assert loaded.merge.enabled
+    assert loaded.merge.min_overlap == 30
+    assert loaded.tool_timeout is None
+    assert loaded.config_path == tmp_path / "config.json"
+
+
+def test_save_keeps_queue_settings(tmp_path):
+    config = Config(
+        config_path=None, backend="queue", queue_dir=tmp_path / "queue",
+        queue_local_workers=2, queue_heartbeat=5.0, queue_timeout=30.0, queue_max_attempts=4,
+    )
+    loaded = _reload(config, tmp_path)
+    assert loaded.backend == "queue"
+    assert loaded.queue_dir == tmp_path / "queue"
+    assert loaded.work_queue_dir == tmp_path / "queue"
+    assert loaded.queue_local_workers == 2
+    assert loaded.queue_heartbeat == 5.0
+    assert loaded.queue_timeout == 30.0
+    assert loaded.queue_max_attempts == 4
@@ -0,0 +1,45 @@
+import random
+
+import numpy as np
+
+from qimba.core.denoiser import PENDING_UNIQUES, Denoiser, DenoiseSummary
+from qimba.core.derep import read_sized_fasta
+from qimba.core.fastx import ReadBatch
+from qimba.utils.config import DenoiseConfig
+
+
+def uniques(denoiser: Denoiser, sample: str, counts: dict[bytes, int]):
+    dereplicator = denoiser.new_dereplicator()
+    reads = [seq for seq, count in counts.items() for _ in range(count)]
+    dereplicator.add_batch(ReadBatch.from_records((b"r", seq, None) for seq in reads), sample)
+    return dereplicator
+
+
+def asv_sizes(output_dir) -> dict[bytes, int]:
+    asvs, sizes = read_sized_fasta(output_dir / "asvs.fasta")
+    return {asvs.seq(j): int(size) for j, size in enumerate(sizes)}
+
+
+def test_extend_counts_earlier_reads(tmp_path):
+    rng = random.Random(1)
+    a, b, c = (bytes(rng.choice(b"ACGT") for _ in range(60)) for _ in range(3))
+    denoiser = Denoiser(DenoiseConfig(min_reads=8))
+    first = {a: 100, b: 5, c: 2}
+    second = {a: 50, b: 4, c: 1}
+
+    summary = DenoiseSummary()
+    retained = denoiser.dereplicate(uniques(denoiser, "S1", first), tmp_path, summary)
+    denoiser.find_asvs(retained, tmp_path, summary)
+    assert asv_sizes(tmp_path) == {a: 100}
+    pending, sizes = read_sized_fasta(tmp_path / PENDING_UNIQUES)
+    assert {pending.seq(i): int(s) for i, s in enumerate(sizes)} == {b: 5, c: 2}
+
+    # b only reaches min_reads with its reads in the first sample
+    result = denoiser.extend_asvs(uniques(denoiser, "S2", second).finish(), tmp_path, DenoiseSummary())
+    assert asv_sizes(tmp_path) == {a: 150, b: 9}
+    pending, sizes = read_sized_fasta(tmp_path / PENDING_UNIQUES)
+    assert {pending.seq(i): int(s) for i, s in enumerate(sizes)} == {c: 3}
+    known, _ = read_sized_fasta(tmp_path / "uniques.fasta")
+    assert [known.seq(i) for i in range(len(known))] == [a, b]
+    assert np.load(tmp_path / "unique_asvs.npy").tolist() == [0, 1]
+    assert result.assignments.tolist() == [0, 1, -1]
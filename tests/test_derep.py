@@ -0,0 +1,118 @@
+import random
+from collections import Counter
+
+import pytest
+
+from qimba.core.denoiser import Denoiser
+from qimba.core.derep import DerepResult, Dereplicator
+from qimba.core.fastx import ReadBatch
+from qimba.utils.config import DenoiseConfig
+
+
+def random_batches(seed: int, batches: int, size: int, alphabet: bytes = b"ACGTacgtN"):
+    """
+    Batches of reads of all lengths (not only multiples of 4), drawn from
+    a small pool so that sequences repeat, with lower case and N bases.
+    """
+    rng = random.Random(seed)
+    pool = [
+        bytes(rng.choice(alphabet) for _ in range(rng.randint(1, 70)))
+        for _ in range(size)
+    ]
+    return [
+        ReadBatch.from_records(
+            (b"r%d" % i, seq, None) for i, seq in enumerate(rng.choices(pool, k=size))
+        )
+        for _ in range(batches)
+    ]
+
+
+def reference(batches_by_sample: dict[str, list[ReadBatch]]) -> dict[str, Counter]:
+    counts: dict[str, Counter] = {}
+    for sample, batches in batches_by_sample.items():
+        counter = counts.setdefault(sample, Counter())
+        for batch in batches:
+            counter.update(batch.seq(i).upper() for i in range(len(batch)))
+    return counts
+
+
+def observed(result: DerepResult) -> dict[str, Counter]:
+    return {
+        sample: Counter({
+            result.uniques.seq(int(unique)): int(count)
+            for unique, count in zip(*result.sample_counts(sample))
+        })
+        for sample in result.samples
+    }
+
+
+def dereplicate(dereplicator: Dereplicator, batches_by_sample: dict[str, list[ReadBatch]]) -> DerepResult:
+    for sample, batches in batches_by_sample.items():
+        for batch in batches:
+            dereplicator.add_batch(batch, sample)
+    return dereplicator.finish()
+
+
+def check(result: DerepResult, expected: dict[str, Counter]) -> None:
+    assert observed(result) == expected
+    totals = sum(expected.values(), Counter())
+    assert {result.uniques.seq(i): int(a) for i, a in enumerate(result.abundances)} == totals
+    assert result.total_reads == sum(totals.values())
+    assert len(set(result.uniques.seq(i) for i in range(len(result)))) == len(result)
+    assert list(result.abundances) == sorted(result.abundances, reverse=True)
+
+
+def samples(seed: int, size: int = 300) -> dict[str, list[ReadBatch]]:
+    return {
+        "S1": random_batches(seed, 3, size),
+        "S2": random_batches(seed + 1, 2, size, b"ACGT"),
+    }
+
+
+def test_counts_match_reference():
+    data = samples(1)
+    check(dereplicate(Dereplicator(), data), reference(data))
+
+
+def test_packed_keys_round_trip():
+    # Every length from 1 to 40 in pure ACGT, packed 4 bases to a byte
+    rng = random.Random(2)
+    seqs = [bytes(rng.choice(b"ACGT") for _ in range(length)) for length in range(1, 41)]
+    batch = ReadBatch.from_records((b"r", seq, None) for seq in seqs + seqs[::3])
+    result = dereplicate(Dereplicator(), {"S": [batch]})
+    assert {result.uniques.seq(i) for i in range(len(result))} == set(seqs)
+    check(result, reference({"S": [batch]}))
+
+
+@pytest.mark.parametrize("max_memory", [2000, 20000])
+def test_spilling_matches_reference(tmp_path, max_memory):
+    data = samples(3)
+    dereplicator = Dereplicator(max_memory=max_memory, spill_dir=tmp_path)
+    for sample, batches in data.items():
+        for batch in batches:
+            dereplicator.add_batch(batch, sample)
+    assert dereplicator._runs
+    check(dereplicator.finish(), reference(data))
+    assert not any(tmp_path.iterdir())
+
+
+def test_denoiser_memory_cap_spills(tmp_path):
+    # Enough distinct sequences to exceed a 1 MB index
+    data = {"S1": random_batches(4, 3, 4000, b"ACGT"), "S2": random_batches(5, 2, 4000)}
+    denoiser = Denoiser(DenoiseConfig(derep_memory_mb=1), temp_dir=tmp_path)
+    dereplicator = denoiser.new_dereplicator()
+    for sample, batches in data.items():
+        for batch in batches:
+            dereplicator.add_batch(batch, sample)
+    assert dereplicator._runs
+    check(dereplicator.finish(), reference(data))
+
+
+def test_weighted_counts_and_add_to():
+    data = samples(6)
+    result = dereplicate(Dereplicator(), data)
+    pooled = Dereplicator()
+    result.add_to(pooled)
+    result.add_to(pooled)
+    doubled = {sample: counter + counter for sample, counter in reference(data).items()}
+    check(pooled.finish(), doubled)
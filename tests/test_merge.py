@@ -0,0 +1,182 @@
+import math
+import random
+
+import pytest
+
+from qimba.core.fastx import ReadBatch
+from qimba.core.merge import MergeStats, PairMerger
+
+COMPLEMENT = {ord(a): ord(b) for a, b in zip("ACGTN", "TGCAN")}
+N = ord("N")
+
+
+def reverse_complement(sequence: bytes) -> bytes:
+    return bytes(COMPLEMENT[base] for base in reversed(sequence))
+
+
+def posterior(q1: int, q2: int, agree: bool, max_quality: int) -> int:
+    """Edgar & Flyvbjerg (2015) posterior quality of an overlap base."""
+    p1, p2 = (min(10 ** (-q / 10), 0.75) for q in (q1, q2))
+    if agree:
+        error = (p1 * p2 / 3) / (1 - p1 - p2 + 4 * p1 * p2 / 3)
+    else:
+        high, low = min(p1, p2), max(p1, p2)
+        error = high * (1 - low / 3) / (high + low - 4 * high * low / 3)
+    return min(max(round(-10 * math.log10(max(error, 1e-30))), 0), max_quality)
+
+
+def merge_pair(merger: PairMerger, seq1: bytes, qual1: bytes, seq2: bytes, qual2: bytes):
+    """Scalar reference: the best scoring overlap and its consensus, or None."""
+    seq2, qual2 = reverse_complement(seq2), bytes(reversed(qual2))
+    best = None
+    for start in range(len(seq1) - merger.min_overlap + 1):
+        overlap = min(len(seq1) - start, len(seq2))
+        if overlap < merger.min_overlap:
+            continue
+        mismatches = sum(
+            1 for j in range(overlap)
+            if seq1[start + j] != seq2[j] and N not in (seq1[start + j], seq2[j])
+        )
+        if mismatches > merger.max_mismatches:
+            continue
+        score = overlap - 4 * mismatches
+        if best is None or score > best[0]:
+            best = (score, start, overlap)
+    if best is None:
+        return None
+    _, start, overlap = best
+    length = start + len(seq2)
+    if length < merger.min_length or (merger.max_length and length > merger.max_length):
+        return None
+    seq = bytearray(seq1[:start] + seq2)
+    qual = bytearray(qual1[:start] + qual2)
+    for j in range(overlap):
+        a, b = seq1[start + j], seq2[j]
+        qa, qb = qual1[start + j] - 33, qual2[j] - 33
+        if N not in (a, b):
+            if a == b or qa >= qb:
+                seq[start + j] = a
+            qual[start + j] = posterior(qa, qb, a == b, merger.max_quality) + 33
+        elif a != N:
+            seq[start + j], qual[start + j] = a, qual1[start + j]
+    return bytes(seq), bytes(qual)
+
+
+def random_pairs(seed: int, count: int):
+    rng = random.Random(seed)
+    records1, records2 = [], []
+    for i in range(count):
+        fragment = bytes(rng.choice(b"ACGT") for _ in range(rng.randint(40, 160)))
+        read1 = bytearray(fragment[:rng.randint(20, 100)])
+        read2 = bytearray(reverse_complement(fragment)[:rng.randint(20, 100)])
+        for read in (read1, read2):
+            for _ in range(rng.randint(0, 4)):
+                read[rng.randrange(len(read))] = rng.choice(b"ACGTN")
+        name = b"p%d" % i
+        records1.append((name, bytes(read1), bytes(rng.randint(35, 75) for _ in read1)))
+        records2.append((name, bytes(read2), bytes(rng.randint(35, 75) for _ in read2)))
+    return records1, records2
+
+
+def check(merger: PairMerger, records1, records2) -> MergeStats:
+    stats = MergeStats()
+    merged = merger.merge(ReadBatch.from_records(records1), ReadBatch.from_records(records2), stats)
+    got = {name: (seq, qual) for name, seq, qual in merged.records()}
+    expected = {
+        r1[0]: merge_pair(merger, r1[1], r1[2], r2[1], r2[2]) for r1, r2 in zip(records1, records2)
+    }
+    assert got == {name: result for name, result in expected.items() if result is not None}
+    assert stats.pairs == len(records1)
+    assert stats.merged == len(got)
+    assert stats.merged + stats.no_overlap + stats.too_short + stats.too_long == stats.pairs
+    return stats
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_matches_reference(seed):
+    records1, records2 = random_pairs(seed, 300)
+    stats = check(PairMerger(min_overlap=10, max_mismatches=3), records1, records2)
+    assert 0 < stats.merged < stats.pairs
+
+
+def test_length_limits():
+    records1, records2 = random_pairs(11, 300)
+    stats = check(PairMerger(min_overlap=10, max_mismatches=3, min_length=100, max_length=140), records1, records2)
+    assert stats.too_short and stats.too_long
+
+
+def test_quality_cap():
+    records1, records2 = random_pairs(12, 200)
+    merger = PairMerger(min_overlap=10, max_mismatches=3, max_quality=30)
+    check(merger, records1, records2)
+    # Fully overlapping mates: every base is an overlap base
+    amplicon = b"TTGACCAGGATCCAGTTACGGA"
+    merged = merger.merge(
+        ReadBatch.from_records([(b"r", amplicon, b"I" * len(amplicon))]),
+        ReadBatch.from_records([(b"r", reverse_complement(amplicon), b"I" * len(amplicon))]),
+    )
+    assert set(merged.quals.tolist()) == {30 + 33}
+
+
+def test_overlap_choice():
+    # The repeat also lines up at shifts of 4, 8, ... with few mismatches;
+    # the full overlap scores best
+    amplicon = b"ACGTACGTACGTACGTACGTTTGACCA"
+    quality = b"I" * len(amplicon)
+    merger = PairMerger(min_overlap=8, max_mismatches=5)
+    read2 = reverse_complement(amplicon)
+    merged = merger.merge(
+        ReadBatch.from_records([(b"r", amplicon, quality)]),
+        ReadBatch.from_records([(b"r", read2, quality)]),
+    )
+    assert [seq for _, seq, _ in merged.records()] == [amplicon]
+
+
+def test_reverse_read_shorter_than_forward():
+    forward = b"TTGACCAGGATCCAGTTACGGA"
+    reverse = reverse_complement(forward[:15])
+    merger = PairMerger(min_overlap=10, max_mismatches=0)
+    merged = merger.merge(
+        ReadBatch.from_records([(b"r", forward, b"I" * len(forward))]),
+        ReadBatch.from_records([(b"r", reverse, b"5" * len(reverse))]),
+    )
+    # The forward read is cut where the reverse read ends
+    [(_, seq, qual)] = merged.records()
+    assert seq == forward[:15]
+    assert qual == bytes([posterior(40, 20, True, 41) + 33]) * 15
+
+
+def test_ambiguous_bases():
+    amplicon = b"GATTACAGATTACACCGGTTAA"
+    read1 = b"GATTACAGNTTACACC"
+    read2 = bytearray(reverse_complement(amplicon)[:16])
+    # Read 2 position 10 is amplicon position 11, inside the overlap
+    read2[10] = N
+    merger = PairMerger(min_overlap=8, max_mismatches=0)
+    merged = merger.merge(
+        ReadBatch.from_records([(b"r", read1, b"I" * len(read1))]),
+        ReadBatch.from_records([(b"r", bytes(read2), b"I" * len(read2))]),
+    )
+    # Each N is replaced by the other read's base, with that read's quality
+    [(_, seq, qual)] = merged.records()
+    assert seq == amplicon
+    assert qual[8] == qual[11] == ord("I")
+
+
+def test_posterior_quality():
+    merger = PairMerger()
+    for q1, q2 in [(40, 40), (30, 10), (2, 2), (0, 41), (20, 25)]:
+        for agree in (False, True):
+            index = (q1 * 64 + q2) * 2 + agree
+            assert merger._posterior[index] - 33 == posterior(q1, q2, agree, 41)
+    assert posterior(30, 30, True, 41) > 30
+    assert posterior(30, 10, False, 41) < 30
+
+
+def test_invalid_batches():
+    merger = PairMerger()
+    one = ReadBatch.from_records([(b"r", b"ACGT", b"IIII")])
+    two = ReadBatch.from_records([(b"r", b"ACGT", b"IIII")] * 2)
+    with pytest.raises(ValueError):
+        merger.merge(one, two)
+    assert len(merger.merge(ReadBatch.empty(), ReadBatch.empty())) == 0
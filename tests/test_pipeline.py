@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from qimba.core.pipeline import Pipeline
+from qimba.utils.config import Config
+
+
+def write_reads(path, seed: int, count: int) -> None:
+    rng = random.Random(seed)
+    amplicons = [bytes(rng.choice(b"ACGT") for _ in range(120)) for _ in range(3)]
+    with open(path, "wb") as out:
+        for i in range(count):
+            seq = rng.choice(amplicons)
+            out.write(b"@r%d\n%s\n+\n%s\n" % (i, seq, b"I" * len(seq)))
+
+
+def config(tmp_path) -> Config:
+    config = Config(config_path=None, stream=True, temp_dir=tmp_path / "tmp")
+    config.qc.engine = "native"
+    config.denoise.engine = "native"
+    return config
+
+
+def test_stream_rerun_with_changed_inputs(tmp_path):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    for name in ("A", "B"):
+        write_reads(input_dir / f"{name}.fastq", ord(name), 2000)
+    output_dir = tmp_path / "out"
+    first = Pipeline(input_dir, output_dir, config=config(tmp_path))
+    results = first.run()
+    assert results["denoise"].filter_stats.reads_in == 4000
+
+    rerun = Pipeline(input_dir, output_dir, config=config(tmp_path))
+    rerun.run()
+    assert rerun.cached_tasks == len(rerun.graph.steps) + 1
+
+    # Fewer reads, so the file size (and fingerprint) changes
+    for name in ("A", "B"):
+        write_reads(input_dir / f"{name}.fastq", ord(name) + 10, 1000)
+    changed = Pipeline(input_dir, output_dir, config=config(tmp_path))
+    results = changed.run()
+    assert changed.cached_tasks == 0
+    assert results["denoise"].filter_stats.reads_in == 2000
+
+
+def test_incremental_rejects_changed_samples(tmp_path):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    write_reads(input_dir / "A.fastq", 1, 500)
+    output_dir = tmp_path / "out"
+    Pipeline(input_dir, output_dir, config=config(tmp_path)).run()
+
+    write_reads(input_dir / "B.fastq", 2, 500)
+    added = Pipeline(input_dir, output_dir, config=config(tmp_path), incremental=True)
+    assert [sample.name for sample in added.pending_samples()] == ["B"]
+    added.run()
+
+    # A re-delivered sample is not silently skipped
+    write_reads(input_dir / "A.fastq", 3, 400)
+    write_reads(input_dir / "C.fastq", 4, 500)
+    rerun = Pipeline(input_dir, output_dir, config=config(tmp_path), incremental=True)
+    with pytest.raises(RuntimeError, match="A; run the pipeline in full"):
+        rerun.pending_samples()